@@ -0,0 +1,373 @@
+"""
+Async ingest server for Arduino driving data.
+Same routes, payloads and responses as api_endpoint.py, served by Starlette
+on an ASGI server: each request is a coroutine and database access goes
+through SQLAlchemy's async engine, so thousands of connected devices share
+one event loop instead of needing a thread each.
+
+To run:
+    python api_asgi.py
+    uvicorn api_asgi:app --host 0.0.0.0 --port 5000 --timeout-keep-alive 75
+
+Connections are kept alive for API_KEEPALIVE_SECONDS so devices posting
+every second reuse theirs. API_WRITE_BEHIND=1 queues metrics through the
+same group-commit writer as the Flask app. Compare with the Flask app:
+    python3 bench_api.py
+"""
+import asyncio
+import contextlib
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from database.models import Base, db, DrivingEvent, DrivingMetric, DrivingSession
+from database.session_cache import ActiveSessionCache
+from database.metric_writer import GroupCommitWriter
+from database.metric_rows import metric_row, distance_increment, parse_metrics
+
+load_dotenv()
+
+API_KEY = os.getenv('ARDUINO_API_KEY', 'your_secret_api_key')
+MAX_BATCH_METRICS = int(os.getenv('API_MAX_BATCH_METRICS', 10000))
+WRITE_BEHIND = os.getenv('API_WRITE_BEHIND', '0') == '1'
+# Idle seconds before the server closes a device's connection
+KEEPALIVE_SECONDS = int(os.getenv('API_KEEPALIVE_SECONDS', 75))
+
+# Async drivers for the URLs DATABASE_URL usually holds
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg'
+}
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with an async driver, e.g. sqlite:/// -> sqlite+aiosqlite:///"""
+    scheme, separator, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+def create_engine_for(url: str):
+    """Async engine for `url`, with a clear error when its async driver isn't installed"""
+    try:
+        return create_async_engine(url)
+    except ModuleNotFoundError as e:
+        raise RuntimeError(f"{url.partition('://')[0]} needs the '{e.name}' package for api_asgi.py "
+                           f"(pip install -r requirements.txt)") from e
+
+
+engine = create_engine_for(async_database_url(db.database_url))
+AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+active_sessions = ActiveSessionCache()
+metric_writer = GroupCommitWriter(db)
+
+
+def verify_api_key(request) -> bool:
+    return request.headers.get('X-API-Key') == API_KEY
+
+
+def error(message: str, status: int, **extra) -> JSONResponse:
+    return JSONResponse({'error': message, **extra}, status_code=status)
+
+
+async def read_json(request):
+    """Request body as JSON, or None when it isn't valid JSON."""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def active_session_ids(db_session, session_ids) -> set:
+    """Active sessions among `session_ids`, checked through the cache (one query for the misses)."""
+    active, missing = active_sessions.lookup(session_ids)
+    if missing:
+        result = await db_session.execute(select(DrivingSession.id).where(
+            DrivingSession.id.in_(missing),
+            DrivingSession.is_active.is_(True)
+        ))
+        active |= active_sessions.add_loaded(missing, result.scalars())
+    return active
+
+
+async def add_distances(db_session, distances: dict):
+    for session_id, distance in distances.items():
+        if distance:
+            await db_session.execute(update(DrivingSession).where(DrivingSession.id == session_id).values(
+                distance=DrivingSession.distance + distance
+            ))
+
+
+def queue_metrics(rows: list) -> JSONResponse:
+    if not metric_writer.enqueue(rows, [distance_increment(row) for row in rows]):
+        return error('Ingest queue full, retry later', 503)
+    return JSONResponse({
+        'status': 'accepted',
+        'queued': len(rows),
+        'timestamp': datetime.utcnow().isoformat()
+    }, status_code=202)
+
+
+async def health_check(request):
+    return JSONResponse({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
+
+
+async def submit_metric(request):
+    """Same payload as api_endpoint.submit_metric."""
+    if not verify_api_key(request):
+        return error('Unauthorized', 401)
+
+    try:
+        data = await read_json(request)
+        if not isinstance(data, dict) or 'session_id' not in data:
+            return error('session_id is required', 400)
+
+        async with AsyncSessionLocal() as db_session:
+            if not await active_session_ids(db_session, [data['session_id']]):
+                return error('Invalid or inactive session', 400)
+
+            try:
+                row = metric_row(data, datetime.utcnow())
+            except ValueError as e:
+                return error(f'Invalid metric: {e}', 400)
+            distances = {data['session_id']: distance_increment(row)}
+            if WRITE_BEHIND:
+                return queue_metrics([row])
+
+            result = await db_session.execute(insert(DrivingMetric).values(row).returning(DrivingMetric.id))
+            metric_id = result.scalar_one()
+            await add_distances(db_session, distances)
+            await db_session.commit()
+
+        return JSONResponse({
+            'status': 'success',
+            'metric_id': metric_id,
+            'timestamp': row['timestamp'].isoformat()
+        }, status_code=201)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def submit_metrics_batch(request):
+    """Same body (JSON array or NDJSON) and all-or-nothing semantics as the Flask endpoint."""
+    if not verify_api_key(request):
+        return error('Unauthorized', 401)
+
+    try:
+        try:
+            metrics = parse_metrics((await request.body()).decode())
+        except ValueError as e:
+            return error(f'Invalid JSON: {e}', 400)
+
+        if not isinstance(metrics, list) or not metrics:
+            return error('Expected a non-empty JSON array or NDJSON body', 400)
+        if len(metrics) > MAX_BATCH_METRICS:
+            return error(f'Batch too large (max {MAX_BATCH_METRICS} metrics)', 413)
+
+        missing = [i for i, data in enumerate(metrics) if not isinstance(data, dict) or 'session_id' not in data]
+        if missing:
+            return error('session_id is required', 400, indexes=missing[:100])
+
+        async with AsyncSessionLocal() as db_session:
+            session_ids = {data['session_id'] for data in metrics}
+            sessions = await active_session_ids(db_session, session_ids)
+
+            invalid = sorted(session_ids - sessions, key=str)
+            if invalid:
+                return error('Invalid or inactive session', 400, session_ids=invalid)
+
+            received_at = datetime.utcnow()
+            rows = []
+            for index, data in enumerate(metrics):
+                try:
+                    rows.append(metric_row(data, received_at))
+                except ValueError as e:
+                    return error(f'Invalid metric: {e}', 400, index=index)
+
+            distances = dict.fromkeys(sessions, 0.0)
+            for row in rows:
+                distances[row['session_id']] += distance_increment(row)
+
+            if WRITE_BEHIND:
+                return queue_metrics(rows)
+
+            await db_session.execute(insert(DrivingMetric), rows)
+            await add_distances(db_session, distances)
+            await db_session.commit()
+
+        return JSONResponse({
+            'status': 'success',
+            'inserted': len(rows),
+            'sessions': len(sessions),
+            'timestamp': received_at.isoformat()
+        }, status_code=201)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def submit_event(request):
+    """Same payload as api_endpoint.submit_event."""
+    if not verify_api_key(request):
+        return error('Unauthorized', 401)
+
+    try:
+        data = await read_json(request)
+        if not isinstance(data, dict) or 'session_id' not in data or 'event_type' not in data:
+            return error('session_id and event_type are required', 400)
+
+        async with AsyncSessionLocal() as db_session:
+            if not await active_session_ids(db_session, [data['session_id']]):
+                return error('Invalid or inactive session', 400)
+
+            event = DrivingEvent(
+                session_id=data['session_id'],
+                timestamp=datetime.utcnow(),
+                event_type=data['event_type'],
+                severity=data.get('severity', 'low'),
+                description=data.get('description'),
+                speed_at_event=data.get('speed_at_event'),
+                latitude=data.get('latitude'),
+                longitude=data.get('longitude')
+            )
+            db_session.add(event)
+            await db_session.commit()
+
+        return JSONResponse({
+            'status': 'success',
+            'event_id': event.id,
+            'timestamp': event.timestamp.isoformat()
+        }, status_code=201)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def start_session(request):
+    """Same payload as api_endpoint.start_session."""
+    if not verify_api_key(request):
+        return error('Unauthorized', 401)
+
+    try:
+        data = await read_json(request)
+        if not isinstance(data, dict) or 'driver_id' not in data:
+            return error('driver_id is required', 400)
+
+        async with AsyncSessionLocal() as db_session:
+            active = (await db_session.execute(select(DrivingSession).where(
+                DrivingSession.driver_id == data['driver_id'],
+                DrivingSession.is_active.is_(True)
+            ).limit(1))).scalar_one_or_none()
+
+            if active:
+                active_sessions.add(active.id)
+                return JSONResponse({'status': 'already_active', 'session_id': active.id})
+
+            new_session = DrivingSession(
+                driver_id=data['driver_id'],
+                start_time=datetime.utcnow(),
+                is_active=True
+            )
+            db_session.add(new_session)
+            await db_session.commit()
+            active_sessions.add(new_session.id)
+
+        return JSONResponse({
+            'status': 'success',
+            'session_id': new_session.id,
+            'start_time': new_session.start_time.isoformat()
+        }, status_code=201)
+
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def end_session(request):
+    """Same payload as api_endpoint.end_session."""
+    if not verify_api_key(request):
+        return error('Unauthorized', 401)
+
+    try:
+        data = await read_json(request)
+        if not isinstance(data, dict) or 'session_id' not in data:
+            return error('session_id is required', 400)
+
+        if WRITE_BEHIND:
+            # Queued metrics (and their distance) land before the session is closed
+            await asyncio.to_thread(metric_writer.flush)
+
+        async with AsyncSessionLocal() as db_session:
+            session = await db_session.get(DrivingSession, data['session_id'])
+            if not session:
+                return error('Session not found', 404)
+
+            if not session.is_active:
+                active_sessions.invalidate(session.id)
+                return error('Session already ended', 400)
+
+            session.is_active = False
+            session.end_time = datetime.utcnow()
+            session.duration = (session.end_time - session.start_time).seconds
+            await db_session.commit()
+            active_sessions.invalidate(session.id)
+
+        return JSONResponse({
+            'status': 'success',
+            'session_id': session.id,
+            'end_time': session.end_time.isoformat(),
+            'duration': session.duration
+        })
+
+    except Exception as e:
+        return error(str(e), 500)
+
+
+async def ingest_stats(request):
+    if not verify_api_key(request):
+        return error('Unauthorized', 401)
+
+    return JSONResponse({
+        'write_behind': WRITE_BEHIND,
+        'writer': metric_writer.stats(),
+        'session_cache': active_sessions.stats()
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    if WRITE_BEHIND:
+        metric_writer.start()
+    try:
+        yield
+    finally:
+        if WRITE_BEHIND:
+            await asyncio.to_thread(metric_writer.stop)
+        await engine.dispose()
+
+
+app = Starlette(routes=[
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/driving/metric', submit_metric, methods=['POST']),
+    Route('/api/driving/metrics/batch', submit_metrics_batch, methods=['POST']),
+    Route('/api/driving/event', submit_event, methods=['POST']),
+    Route('/api/session/start', start_session, methods=['POST']),
+    Route('/api/session/end', end_session, methods=['POST']),
+    Route('/api/ingest/stats', ingest_stats, methods=['GET'])
+], lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('API_PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port, timeout_keep_alive=KEEPALIVE_SECONDS)
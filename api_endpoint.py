@@ -3,10 +3,21 @@ API endpoint for Arduino to send driving data.
 This is a simple Flask API that can run alongside Streamlit.
 
 To run: python api_endpoint.py
+
+With API_WRITE_BEHIND=1 the metric endpoints validate, queue the rows and
+answer 202 Accepted; a background writer group-commits them every
+API_WRITE_BEHIND_ROWS rows or API_WRITE_BEHIND_MS milliseconds (the window
+in which accepted metrics could be lost by a crash). GET /api/ingest/stats
+shows queue depth and commit latency.
 """
 from flask import Flask, request, jsonify
 from datetime import datetime
+from sqlalchemy import insert
 from database.models import db, DrivingMetric, DrivingEvent, DrivingSession
+from database.session_cache import ActiveSessionCache
+from database.metric_writer import GroupCommitWriter
+from database.metric_rows import metric_row, distance_increment, parse_metrics
+import atexit
 import os
 from dotenv import load_dotenv
 
@@ -17,6 +28,20 @@ app = Flask(__name__)
 # Simple API key authentication for Arduino
 API_KEY = os.getenv('ARDUINO_API_KEY', 'your_secret_api_key')
 
+# Largest upload accepted by /api/driving/metrics/batch (a minute at 50 Hz is 3000)
+MAX_BATCH_METRICS = int(os.getenv('API_MAX_BATCH_METRICS', 10000))
+
+# Active session IDs, shared by all request threads (kept exact by start_session/end_session)
+active_sessions = ActiveSessionCache()
+
+# Write-behind ingest: metric handlers queue rows and answer 202, a background
+# thread group-commits them (see database/metric_writer.py for the window)
+WRITE_BEHIND = os.getenv('API_WRITE_BEHIND', '0') == '1'
+metric_writer = GroupCommitWriter(db)
+if WRITE_BEHIND:
+    metric_writer.start()
+    atexit.register(metric_writer.stop)
+
 
 def verify_api_key():
     """Verify API key from request headers."""
@@ -24,6 +49,41 @@ def verify_api_key():
     return api_key == API_KEY
 
 
+def active_session_ids(db_session, session_ids) -> set:
+    """Active sessions among `session_ids`, checked through the cache (one query for the misses)."""
+    def load(missing):
+        return [row.id for row in db_session.query(DrivingSession.id).filter(
+            DrivingSession.id.in_(missing),
+            DrivingSession.is_active.is_(True)
+        )]
+    return active_sessions.get_active(session_ids, load)
+
+
+def add_distance(db_session, session_id, distance: float):
+    """Increment a session's distance in place, without loading the session first."""
+    if distance:
+        db_session.query(DrivingSession).filter_by(id=session_id).update(
+            {DrivingSession.distance: DrivingSession.distance + distance},
+            synchronize_session=False
+        )
+
+
+def queue_metrics(rows: list):
+    """Hand rows to the write-behind writer; the response for the handler to return."""
+    if not metric_writer.enqueue(rows, [distance_increment(row) for row in rows]):
+        return jsonify({'error': 'Ingest queue full, retry later'}), 503
+    return jsonify({
+        'status': 'accepted',
+        'queued': len(rows),
+        'timestamp': datetime.utcnow().isoformat()
+    }), 202
+
+
+def parse_metrics_body() -> list:
+    """Metrics from a JSON array or an NDJSON stream (one JSON object per line)."""
+    return parse_metrics(request.get_data(as_text=True))
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
@@ -47,6 +107,8 @@ def submit_metric():
         "fuel_level": 75.5,
         "engine_temp": 90.0
     }
+
+    Answers 202 Accepted instead of 201 in write-behind mode.
     """
     if not verify_api_key():
         return jsonify({'error': 'Unauthorized'}), 401
@@ -58,46 +120,114 @@ def submit_metric():
         if 'session_id' not in data:
             return jsonify({'error': 'session_id is required'}), 400
 
-        # Get session to verify it exists and is active
+        # Verify the session is active (cached - usually no query)
         db_session = db.get_session()
-        session = db_session.query(DrivingSession).filter_by(
-            id=data['session_id'],
-            is_active=True
-        ).first()
-
-        if not session:
+        if not active_session_ids(db_session, [data['session_id']]):
             db_session.close()
             return jsonify({'error': 'Invalid or inactive session'}), 400
 
+        try:
+            row = metric_row(data, datetime.utcnow())
+        except ValueError as e:
+            db_session.close()
+            return jsonify({'error': f'Invalid metric: {e}'}), 400
+
+        if WRITE_BEHIND:
+            db_session.close()
+            return queue_metrics([row])
+
         # Create metric record
-        metric = DrivingMetric(
-            session_id=data['session_id'],
-            timestamp=datetime.utcnow(),
-            speed=data.get('speed', 0.0),
-            acceleration=data.get('acceleration', 0.0),
-            latitude=data.get('latitude'),
-            longitude=data.get('longitude'),
-            heading=data.get('heading'),
-            rpm=data.get('rpm'),
-            fuel_level=data.get('fuel_level'),
-            engine_temp=data.get('engine_temp')
-        )
+        metric = DrivingMetric(**row)
 
         db_session.add(metric)
 
         # Update session distance if GPS data available
-        if data.get('latitude') and data.get('longitude'):
-            # Simple distance calculation (you'd want to use proper GPS distance in production)
-            # This is a placeholder - implement haversine formula for accurate distance
-            session.distance += data.get('speed', 0) / 3600  # rough estimate
+        add_distance(db_session, data['session_id'], distance_increment(row))
 
         db_session.commit()
+        metric_id, timestamp = metric.id, metric.timestamp
         db_session.close()
 
         return jsonify({
             'status': 'success',
-            'metric_id': metric.id,
-            'timestamp': metric.timestamp.isoformat()
+            'metric_id': metric_id,
+            'timestamp': timestamp.isoformat()
+        }), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/driving/metrics/batch', methods=['POST'])
+def submit_metrics_batch():
+    """
+    Submit many driving metrics in one request (e.g. a minute of buffered data).
+
+    Body: a JSON array of metric objects (same fields as /api/driving/metric,
+    plus an optional ISO "timestamp" per metric), or NDJSON with one metric
+    object per line (Content-Type: application/x-ndjson). Metrics may belong
+    to several sessions.
+
+    Sessions are validated once per batch and all rows are inserted in one
+    transaction - either the whole batch is stored or none of it.
+    """
+    if not verify_api_key():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    try:
+        try:
+            metrics = parse_metrics_body()
+        except ValueError as e:
+            return jsonify({'error': f'Invalid JSON: {e}'}), 400
+
+        if not isinstance(metrics, list) or not metrics:
+            return jsonify({'error': 'Expected a non-empty JSON array or NDJSON body'}), 400
+        if len(metrics) > MAX_BATCH_METRICS:
+            return jsonify({'error': f'Batch too large (max {MAX_BATCH_METRICS} metrics)'}), 413
+
+        missing = [i for i, data in enumerate(metrics) if not isinstance(data, dict) or 'session_id' not in data]
+        if missing:
+            return jsonify({'error': 'session_id is required', 'indexes': missing[:100]}), 400
+
+        db_session = db.get_session()
+        try:
+            # One cache lookup (at most one query) for every session in the batch
+            session_ids = {data['session_id'] for data in metrics}
+            sessions = active_session_ids(db_session, session_ids)
+
+            invalid = sorted(session_ids - sessions, key=str)
+            if invalid:
+                return jsonify({'error': 'Invalid or inactive session', 'session_ids': invalid}), 400
+
+            received_at = datetime.utcnow()
+            rows = []
+            for index, data in enumerate(metrics):
+                try:
+                    rows.append(metric_row(data, received_at))
+                except ValueError as e:
+                    return jsonify({'error': f'Invalid metric: {e}', 'index': index}), 400
+
+            distances = dict.fromkeys(sessions, 0.0)
+            for row in rows:
+                distances[row['session_id']] += distance_increment(row)
+
+            if WRITE_BEHIND:
+                return queue_metrics(rows)
+
+            # executemany-style bulk insert instead of one ORM object per row
+            db_session.execute(insert(DrivingMetric), rows)
+            for session_id, distance in distances.items():
+                add_distance(db_session, session_id, distance)
+
+            db_session.commit()
+        finally:
+            db_session.close()
+
+        return jsonify({
+            'status': 'success',
+            'inserted': len(rows),
+            'sessions': len(sessions),
+            'timestamp': received_at.isoformat()
         }), 201
 
     except Exception as e:
@@ -130,14 +260,9 @@ def submit_event():
         if 'session_id' not in data or 'event_type' not in data:
             return jsonify({'error': 'session_id and event_type are required'}), 400
 
-        # Get session to verify it exists and is active
+        # Verify the session is active (cached - usually no query)
         db_session = db.get_session()
-        session = db_session.query(DrivingSession).filter_by(
-            id=data['session_id'],
-            is_active=True
-        ).first()
-
-        if not session:
+        if not active_session_ids(db_session, [data['session_id']]):
             db_session.close()
             return jsonify({'error': 'Invalid or inactive session'}), 400
 
@@ -155,12 +280,13 @@ def submit_event():
 
         db_session.add(event)
         db_session.commit()
+        event_id, timestamp = event.id, event.timestamp
         db_session.close()
 
         return jsonify({
             'status': 'success',
-            'event_id': event.id,
-            'timestamp': event.timestamp.isoformat()
+            'event_id': event_id,
+            'timestamp': timestamp.isoformat()
         }), 201
 
     except Exception as e:
@@ -195,6 +321,7 @@ def start_session():
         ).first()
 
         if active:
+            active_sessions.add(active.id)
             db_session.close()
             return jsonify({
                 'status': 'already_active',
@@ -212,6 +339,7 @@ def start_session():
         db_session.commit()
 
         session_id = new_session.id
+        active_sessions.add(session_id)
         db_session.close()
 
         return jsonify({
@@ -243,6 +371,10 @@ def end_session():
         if 'session_id' not in data:
             return jsonify({'error': 'session_id is required'}), 400
 
+        if WRITE_BEHIND:
+            # Queued metrics (and their distance) land before the session is closed
+            metric_writer.flush()
+
         db_session = db.get_session()
 
         session = db_session.query(DrivingSession).filter_by(
@@ -254,6 +386,7 @@ def end_session():
             return jsonify({'error': 'Session not found'}), 404
 
         if not session.is_active:
+            active_sessions.invalidate(session.id)
             db_session.close()
             return jsonify({'error': 'Session already ended'}), 400
 
@@ -263,6 +396,7 @@ def end_session():
         session.duration = (session.end_time - session.start_time).seconds
 
         db_session.commit()
+        active_sessions.invalidate(session.id)
         db_session.close()
 
         return jsonify({
@@ -276,6 +410,19 @@ def end_session():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/ingest/stats', methods=['GET'])
+def ingest_stats():
+    """Write-behind queue depth and commit latency, plus session cache hit rates."""
+    if not verify_api_key():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    return jsonify({
+        'write_behind': WRITE_BEHIND,
+        'writer': metric_writer.stats(),
+        'session_cache': active_sessions.stats()
+    }), 200
+
+
 if __name__ == '__main__':
     # Initialize database
     db.create_tables()
@@ -3,15 +3,26 @@
 Attention Monitoring with Supabase Integration
 Monitors driver attention using facial recognition and saves events to Supabase
 """
+from startup_profile import profile
+
 import cv2
 import time
-import asyncio
+import threading
 from datetime import datetime, timezone
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-import os
 import sys
 
+from supabase_client import get_supabase
+
+from outbox import Outbox
+from driver_state import DriverStateWriter
+from child_health import Heartbeat
+from shared_state import SharedSessionState
+
+if TYPE_CHECKING:
+    from supabase import Client
+
 # Force unbuffered output so logs show in real-time
 sys.stdout.reconfigure(line_buffering=True)
 sys.stderr.reconfigure(line_buffering=True)
@@ -19,11 +30,44 @@ sys.stderr.reconfigure(line_buffering=True)
 # Load environment variables
 load_dotenv()
 
+_cascades = None
+_cascades_lock = threading.Lock()
+
+
+def load_cascades():
+    """Face/eye classifiers, parsed once per process and reused by camera restarts"""
+    global _cascades
+    with _cascades_lock:
+        if _cascades is None:
+            with profile.phase('cascades'):
+                _cascades = (
+                    cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'),
+                    cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+                )
+            print(f"✅ Face/eye detection models loaded")
+    return _cascades
+
+
 class AttentionMonitor:
-    def __init__(self, driver_arduino_id: str = "642B8DC2-D778-8A47-20C2-B91C64716DBF", iphone_camera_index: int = None):
+    def __init__(self, driver_arduino_id: str = "642B8DC2-D778-8A47-20C2-B91C64716DBF", iphone_camera_index: int = None,
+                 supabase: 'Client' = None, outbox: Outbox = None, session_link=None, heartbeat: Heartbeat = None,
+                 shared_state: SharedSessionState = None):
+        """
+        Args:
+            supabase: Shared client (run_monitoring.py passes the BLE pipeline's)
+            outbox: Shared outbox; when given, its owner drains it
+            session_link: In-process view of the BLE session (run_monitoring.SessionLink) -
+                session IDs and score come from memory instead of Supabase
+            heartbeat: Readiness/liveness reporting to run_monitoring.py (child_health.py)
+            shared_state: Shared-memory block of the BLE process (run_monitoring.py --subprocess) -
+                session IDs and score are read from it and penalties handed to BLE through it
+        """
         self.driver_arduino_id = driver_arduino_id
         self.driver_id = None
         self.session_id = None
+        self.session_link = session_link
+        self.shared_state = shared_state
+        self.heartbeat = heartbeat or Heartbeat('camera')
 
         # Attention tracking
         self.counter = 0
@@ -39,25 +83,25 @@ class AttentionMonitor:
         }
         self.EVENT_COOLDOWN_SECONDS = 5.0  # 5 seconds between same event type
 
-        # Initialize Supabase
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-
-        if not supabase_url or not supabase_key:
-            raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_KEY in .env file")
+        # Shared client (run_monitoring.py passes the BLE pipeline's), otherwise the process-wide one
+        self.supabase = supabase if supabase is not None else get_supabase()
 
-        self.supabase: Client = create_client(supabase_url, supabase_key)
-        print(f"✅ Connected to Supabase")
+        # Writes are queued in the shared durable outbox and drained from the main loop
+        self._owns_outbox = outbox is None
+        self.outbox = outbox or Outbox()
+        self.driver_state = DriverStateWriter(self.outbox)
 
         # Initialize CV2 - Use iPhone camera (index 1)
         IPHONE_CAMERA_INDEX = iphone_camera_index if iphone_camera_index is not None else 1
 
         print(f"\n📱 Connecting to iPhone camera (index {IPHONE_CAMERA_INDEX})...")
 
-        self.cap = cv2.VideoCapture(IPHONE_CAMERA_INDEX)
+        with profile.phase('camera open'):
+            self.cap = cv2.VideoCapture(IPHONE_CAMERA_INDEX)
+            opened = self.cap.isOpened()
+            ret, test_frame = self.cap.read() if opened else (False, None)
 
-        if self.cap.isOpened():
-            ret, test_frame = self.cap.read()
+        if opened:
             if ret and test_frame is not None:
                 print(f"✅ iPhone camera connected!")
                 print(f"   Resolution: {test_frame.shape[1]}x{test_frame.shape[0]}")
@@ -78,12 +122,27 @@ class AttentionMonitor:
             print("   3. Then restart the monitoring system")
             raise ValueError("No camera available - attention monitoring disabled")
 
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-        print(f"✅ Face/eye detection models loaded")
+        self.face_cascade, self.eye_cascade = load_cascades()
 
     def find_active_session(self):
         """Find the active driving session for this driver"""
+        if self.session_link is not None:
+            # Same process as the BLE pipeline - no need to ask the database
+            self.driver_id = self.session_link.driver_id
+            self.session_id = self.session_link.session_id
+            return self.session_id is not None
+
+        if self.shared_state is not None:
+            # The BLE process publishes its session in shared memory
+            session = self.shared_state.session()
+            if not session or not session['active']:
+                return False
+            if session['session_id'] != self.session_id:
+                print(f"✅ Found active session: {session['session_id']}")
+            self.driver_id = session['driver_id']
+            self.session_id = session['session_id']
+            return True
+
         try:
             # Find driver by Arduino ID
             driver_response = self.supabase.table('drivers').select('*').eq('arduino_id', self.driver_arduino_id).execute()
@@ -144,7 +203,7 @@ class AttentionMonitor:
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }
 
-            self.supabase.table('events').insert(event_data).execute()
+            self.outbox.enqueue('events', event_data, session_id=self.session_id)
 
             # Calculate penalty (doubled for faster demo)
             penalty_points = {
@@ -156,17 +215,31 @@ class AttentionMonitor:
             print(f"💾 {event_type} event | Safety score -{penalty_points}")
 
             # Update safety score
-            self.update_safety_score(penalty_points)
+            self.update_safety_score(penalty_points, event_type)
 
         except Exception as e:
             print(f"⚠️  Error saving event: {e}")
 
-    def update_safety_score(self, penalty_points: int):
+    def update_safety_score(self, penalty_points: int, event_type: str = None):
         """Update safety score by applying penalty"""
         try:
             if not self.session_id:
                 return
 
+            if self.session_link is not None:
+                # The BLE pipeline owns the score; it applies the penalty and writes it out
+                current_score = self.session_link.safety_score
+                new_score = self.session_link.apply_penalty(penalty_points)
+                print(f"📊 Safety score updated: {current_score} → {new_score}")
+                return
+
+            if self.shared_state is not None:
+                # The BLE process owns the score and applies our penalty within one poll interval
+                current_score = (self.shared_state.session() or {}).get('safety_score', 100)
+                self.shared_state.add_penalty(penalty_points, event_type)
+                print(f"📊 Safety score penalty handed to BLE: {current_score} → ~{max(0, current_score - penalty_points)}")
+                return
+
             # Get current session score
             session = self.supabase.table('driving_sessions').select('*').eq('id', self.session_id).execute()
 
@@ -175,15 +248,17 @@ class AttentionMonitor:
                 new_score = max(0, current_score - penalty_points)
 
                 # Update session
-                self.supabase.table('driving_sessions').update({
+                self.outbox.enqueue('driving_sessions', {
                     'safety_score': new_score
-                }).eq('id', self.session_id).execute()
+                }, op='update', match={'id': self.session_id}, session_id=self.session_id)
 
-                # Update driver
-                self.supabase.table('drivers').update({
-                    'safety_score': new_score,
-                    'last_active': datetime.now(timezone.utc).isoformat()
-                }).eq('id', self.driver_id).execute()
+                # Update driver (coalesced with other driver changes on the next tick)
+                self.driver_state.set(
+                    self.driver_id,
+                    session_id=self.session_id,
+                    safety_score=new_score,
+                    last_active=datetime.now(timezone.utc).isoformat()
+                )
 
                 print(f"📊 Safety score updated: {current_score} → {new_score}")
 
@@ -261,21 +336,33 @@ class AttentionMonitor:
                 self.save_attention_event('DISTRACTED', 'No face detected - looking away')
                 self.counter = 0
 
-    def run(self):
-        """Main monitoring loop"""
+    def run(self, stop_event=None, ready_event=None):
+        """Main monitoring loop
+
+        Args:
+            stop_event: threading.Event that ends the loop (in-process mode)
+            ready_event: threading.Event set once frames are being processed
+        """
         print("\n=== ATTENTION MONITOR WITH SUPABASE ===", flush=True)
         print("Monitoring driver attention and saving to Supabase", flush=True)
         print("Press Ctrl+C to stop\n", flush=True)
 
         # Wait for active session
         while not self.find_active_session():
+            if stop_event is not None and stop_event.is_set():
+                self.cap.release()
+                return
             print("⏳ Waiting for active driving session...", flush=True)
             time.sleep(3)
 
         print("\n🟢 Session found - starting attention monitoring!\n", flush=True)
+        if ready_event is not None:
+            ready_event.set()
+        self.heartbeat.ready()
+        profile.mark('camera_ready')
 
         try:
-            while True:
+            while stop_event is None or not stop_event.is_set():
                 ret, frame = self.cap.read()
                 if not ret:
                     continue
@@ -296,16 +383,30 @@ class AttentionMonitor:
                 faces = self.face_cascade.detectMultiScale(gray, 1.1, 2, minSize=(30, 30))
 
                 self.process_frame(frame, gray, faces)
+                # Only processed frames count as progress - a camera that stops delivering goes quiet
+                self.heartbeat.beat()
+
+                if self.session_link is not None:
+                    # A face in frame is as good a sign of life as a BLE notification
+                    self.session_link.touch('camera')
+
+                # Send queued writes; failures stay in the outbox and are retried with backoff
+                self.driver_state.flush_if_due()
+                if self._owns_outbox:
+                    self.outbox.drain(self.supabase)
 
                 time.sleep(0.5)
 
         except KeyboardInterrupt:
             print("\n\n🛑 Stopping attention monitoring...")
+        finally:
+            self.driver_state.flush()
             self.cap.release()
             print("✅ Camera released")
 
 def main():
-    monitor = AttentionMonitor()
+    # Shared-memory session state when started by run_monitoring.py --subprocess
+    monitor = AttentionMonitor(shared_state=SharedSessionState.from_env())
     monitor.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Side-by-side ingest benchmark: Flask (api_endpoint.py) vs ASGI (api_asgi.py)
+
+Starts each server on a scratch SQLite database and simulates --devices
+devices, each posting --requests metrics to /api/driving/metric over a
+keep-alive connection (reopened whenever the server closes it). Reports
+requests/sec, latency percentiles, TCP connections opened and the peak
+number of threads in the server process.
+
+    python3 bench_api.py [--devices 200] [--requests 50] [--servers flask,asgi]
+
+Set API_WRITE_BEHIND=1 to benchmark both servers in write-behind mode.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+API_KEY = 'bench-key'
+HOST = '127.0.0.1'
+PORTS = {'flask': 5101, 'asgi': 5102}
+
+SERVERS = {
+    # Werkzeug's threaded server: one thread per open connection
+    'flask': "import api_endpoint as api; api.db.create_tables(); "
+             "api.app.run(host='{host}', port={port}, threaded=True)",
+    'asgi': "import uvicorn, api_asgi; "
+            "uvicorn.run(api_asgi.app, host='{host}', port={port}, log_level='warning', "
+            "timeout_keep_alive=api_asgi.KEEPALIVE_SECONDS)"
+}
+
+
+def start_server(name: str, database_path: str) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database_path}', ARDUINO_API_KEY=API_KEY)
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVERS[name].format(host=HOST, port=PORTS[name])],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://{HOST}:{PORTS[name]}/api/health', timeout=1)
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{name} server exited with code {process.returncode}')
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{name} server did not start')
+
+
+def post_json(port: int, path: str, payload: dict) -> dict:
+    request = urllib.request.Request(f'http://{HOST}:{port}{path}', data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json', 'X-API-Key': API_KEY})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def server_threads(pid: int):
+    """Thread count of the server process (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+async def device(port: int, body: bytes, requests: int, latencies: list, errors: list, reconnects: list):
+    """One device posting metrics back to back, reusing its connection while the server allows"""
+    request = (f'POST /api/driving/metric HTTP/1.1\r\nHost: {HOST}\r\nX-API-Key: {API_KEY}\r\n'
+               f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n').encode() + body
+    reader = writer = None
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(HOST, port)
+                reconnects.append(1)
+            writer.write(request)
+            status = (await reader.readline()).split(b' ', 2)[1]
+            length, close = 0, False
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.partition(b':')
+                if name.lower() == b'content-length':
+                    length = int(value)
+                elif name.lower() == b'connection' and value.strip().lower() == b'close':
+                    close = True
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if status not in (b'201', b'202'):
+                errors.append(status.decode())
+            if close:
+                # No keep-alive (Werkzeug's dev server): a new TCP connection per request
+                writer.close()
+                writer = None
+    except (OSError, asyncio.IncompleteReadError, IndexError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def peak_threads(pid: int, peak: list):
+    while True:
+        threads = server_threads(pid)
+        if threads is None:
+            return
+        peak[0] = max(peak[0], threads)
+        await asyncio.sleep(0.05)
+
+
+async def load(port: int, pid: int, session_id: int, devices: int, requests: int):
+    body = json.dumps({'session_id': session_id, 'speed': 50.0, 'acceleration': 0.3,
+                       'latitude': 32.7767, 'longitude': -96.7970}).encode()
+    latencies, errors, reconnects, peak = [], [], [], [0]
+    sampler = asyncio.create_task(peak_threads(pid, peak))
+    started = time.perf_counter()
+    await asyncio.gather(*(device(port, body, requests, latencies, errors, reconnects) for _ in range(devices)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    return elapsed, sorted(latencies), errors, len(reconnects), peak[0] or None
+
+
+def bench(name: str, devices: int, requests: int) -> dict:
+    with tempfile.TemporaryDirectory() as scratch:
+        process = start_server(name, os.path.join(scratch, 'bench.db'))
+        try:
+            port = PORTS[name]
+            session_id = post_json(port, '/api/session/start', {'driver_id': 'bench-driver'})['session_id']
+            elapsed, latencies, errors, connects, threads = asyncio.run(
+                load(port, process.pid, session_id, devices, requests))
+        finally:
+            process.terminate()
+            process.wait(10)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float('nan')
+
+    return {
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'errors': len(errors),
+        'connections_opened': connects,
+        'threads': threads
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    if '--help' in args or '-h' in args:
+        print(__doc__)
+        return
+    devices = int(args[args.index('--devices') + 1]) if '--devices' in args else 200
+    requests = int(args[args.index('--requests') + 1]) if '--requests' in args else 50
+    servers = args[args.index('--servers') + 1].split(',') if '--servers' in args else list(SERVERS)
+
+    mode = 'write-behind' if os.getenv('API_WRITE_BEHIND') == '1' else 'synchronous'
+    print(f"🏁 {devices} devices x {requests} metrics each ({mode} commits)")
+    results = {}
+    for name in servers:
+        print(f"   running {name}...")
+        results[name] = bench(name, devices, requests)
+
+    print(f"\n   {'server':8s} {'req/s':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'errors':>7s} {'conns':>7s} {'peak threads':>13s}")
+    for name, result in results.items():
+        print(f"   {name:8s} {result['requests_per_sec']:9.0f} {result['p50_ms']:9.1f} {result['p99_ms']:9.1f} "
+              f"{result['errors']:7d} {result['connections_opened']:7d} {result['threads'] if result['threads'] is not None else '-':>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+BLE link tuning and device control channel
+The bridge negotiates the largest ATT MTU the platform allows, then tells
+the Arduino over a writable control characteristic how many samples to
+pack into each notification and how fast to sample.
+
+Control protocol (ASCII writes to CONTROL_CHARACTERISTIC, one command each):
+    PACK:<n>     send n CSV samples per notification, newline separated (1-8)
+    RATE:<hz>    sample the IMU at <hz> samples per second (1-100)
+    DECIM:<n>    send only every nth sample (1-50); detection still runs on every
+                 sample, event samples are always sent together with the skipped
+                 samples just before them
+Reading the characteristic returns the active config: CFG:<pack>:<rate>:<decimation>
+
+DeviceControl switches a device between idle streaming (decimated) and
+burst mode (full rate) around detected events.
+
+EVENT: and STATUS: messages are never held back - the device flushes any
+partly filled pack before sending them, so message order is preserved.
+Firmware without the control characteristic keeps its defaults (one
+sample per notification at ~50 Hz).
+"""
+import asyncio
+import importlib.metadata
+import os
+import time
+
+# Writable characteristic next to the driving data one (see driving_monitor.ino)
+CONTROL_CHARACTERISTIC = "87654321-4321-4321-4321-cba987654322"
+
+# What the firmware accepts
+MAX_PACKED_SAMPLES = 8
+MIN_SAMPLE_RATE_HZ, MAX_SAMPLE_RATE_HZ = 1, 100
+MAX_DECIMATION = 50
+
+# Longest CSV sample line incl. separator: "-1.23,-1.23,-1.23,HARSH_BRAKE,99,4294967295\n"
+SAMPLE_LINE_BYTES = 48
+# ATT notification header
+ATT_HEADER_BYTES = 3
+DEFAULT_MTU = 23
+# Private bleak API: on BlueZ the MTU is only exchanged through BleakClientBlueZDBus._acquire_mtu(),
+# which exists in these bleak releases [first, last) - anything else just reads client.mtu_size
+BLUEZ_ACQUIRE_MTU_VERSIONS = ((0, 19), (2, 0))
+
+# Idle: sample (and detect) at SAMPLE_RATE_HZ but only send every IDLE_DECIMATION-th sample
+SAMPLE_RATE_HZ = int(os.getenv('BLE_SAMPLE_RATE_HZ', 50))
+IDLE_DECIMATION = int(os.getenv('BLE_IDLE_DECIMATION', 5))
+# Burst: full resolution for BURST_SECONDS after the last detected event
+BURST_SAMPLE_RATE_HZ = int(os.getenv('BLE_BURST_SAMPLE_RATE_HZ', 100))
+BURST_DECIMATION = int(os.getenv('BLE_BURST_DECIMATION', 1))
+BURST_SECONDS = float(os.getenv('BLE_BURST_SECONDS', 10))
+# 0 keeps the device at the idle settings
+ADAPTIVE_SAMPLING = os.getenv('BLE_ADAPTIVE_SAMPLING', '1') == '1'
+# Fixed pack size; unset means "as many as fit in the negotiated MTU"
+SAMPLES_PER_NOTIFICATION = os.getenv('BLE_SAMPLES_PER_NOTIFICATION')
+THROUGHPUT_LOG_SECONDS = float(os.getenv('BLE_THROUGHPUT_LOG_SECONDS', 30))
+
+
+def samples_per_notification(mtu: int) -> int:
+    """How many worst-case sample lines fit in one notification at this MTU"""
+    if SAMPLES_PER_NOTIFICATION:
+        return max(1, min(MAX_PACKED_SAMPLES, int(SAMPLES_PER_NOTIFICATION)))
+    return max(1, min(MAX_PACKED_SAMPLES, (mtu - ATT_HEADER_BYTES) // SAMPLE_LINE_BYTES))
+
+
+def split_notification(data: bytes) -> list:
+    """Messages in one notification (packed samples are newline separated)"""
+    return [line for line in data.decode('utf-8').split('\n') if line.strip()]
+
+
+def bleak_version():
+    """(major, minor) of the installed bleak, or None"""
+    try:
+        return tuple(int(part) for part in importlib.metadata.version('bleak').split('.')[:2])
+    except (importlib.metadata.PackageNotFoundError, ValueError):
+        return None
+
+
+def can_acquire_mtu(backend) -> bool:
+    """Whether `backend` is BlueZ on a bleak release known to have _acquire_mtu()"""
+    if type(backend).__name__ != 'BleakClientBlueZDBus' or not hasattr(backend, '_acquire_mtu'):
+        return False
+    version = bleak_version()
+    first, last = BLUEZ_ACQUIRE_MTU_VERSIONS
+    return version is not None and first <= version < last
+
+
+async def negotiate_mtu(client) -> int:
+    """Ask for the largest MTU the platform supports and return what we got.
+
+    macOS and Windows negotiate automatically on connect; BlueZ only does
+    it on request, through a private bleak call (see BLUEZ_ACQUIRE_MTU_VERSIONS).
+    """
+    backend = getattr(client, '_backend', None)
+    if can_acquire_mtu(backend):
+        try:
+            await backend._acquire_mtu()
+        except Exception as e:
+            print(f"   ⚠️  MTU exchange failed, using default: {e}")
+    return getattr(client, 'mtu_size', DEFAULT_MTU) or DEFAULT_MTU
+
+
+def has_control_channel(client) -> bool:
+    services = getattr(client, 'services', None)
+    return services is not None and services.get_characteristic(CONTROL_CHARACTERISTIC) is not None
+
+
+async def send_command(client, command: str) -> bool:
+    """Write one control command; False when the firmware has no control channel"""
+    if not has_control_channel(client):
+        return False
+    await client.write_gatt_char(CONTROL_CHARACTERISTIC, command.encode('utf-8'), response=True)
+    return True
+
+
+async def read_config(client):
+    """(pack, rate_hz, decimation) the device reports, or None"""
+    if not has_control_channel(client):
+        return None
+    value = (await client.read_gatt_char(CONTROL_CHARACTERISTIC)).decode('utf-8')
+    parts = value.split(':')
+    if len(parts) >= 3 and parts[0] == 'CFG':
+        # Firmware from before decimation reports no 4th field
+        return int(parts[1]), int(parts[2]), int(parts[3]) if len(parts) > 3 else 1
+    return None
+
+
+def clamp_rate(rate_hz) -> int:
+    return max(MIN_SAMPLE_RATE_HZ, min(MAX_SAMPLE_RATE_HZ, int(rate_hz)))
+
+
+def clamp_decimation(decimation) -> int:
+    return max(1, min(MAX_DECIMATION, int(decimation)))
+
+
+async def configure_link(client, rate_hz: int = SAMPLE_RATE_HZ, decimation: int = 1) -> dict:
+    """Negotiate the MTU and push pack size, sample rate and decimation to the device"""
+    mtu = await negotiate_mtu(client)
+    pack = samples_per_notification(mtu)
+    rate_hz, decimation = clamp_rate(rate_hz), clamp_decimation(decimation)
+
+    link = {'mtu': mtu, 'pack': 1, 'rate_hz': None, 'decimation': 1, 'controlled': False}
+    try:
+        if (await send_command(client, f"PACK:{pack}") and await send_command(client, f"RATE:{rate_hz}")
+                and await send_command(client, f"DECIM:{decimation}")):
+            link['controlled'] = True
+            link['pack'], link['rate_hz'], link['decimation'] = (await read_config(client)
+                                                                 or (pack, rate_hz, decimation))
+    except Exception as e:
+        print(f"   ⚠️  Could not configure device: {e}")
+
+    if link['controlled']:
+        print(f"📡 MTU {mtu}: {link['pack']} sample(s) per notification at {link['rate_hz']} Hz, "
+              f"sending 1 in {link['decimation']}")
+    else:
+        print(f"📡 MTU {mtu}: firmware has no control channel - using device defaults")
+    return link
+
+
+class DeviceControl:
+    """Sampling settings of one device, kept across reconnects.
+
+    Settings changed while the link is down are applied on the next
+    attach(). Calls are no-ops for firmware without the control channel.
+    """
+
+    def __init__(self, label: str = 'device'):
+        self.label = label
+        self.client = None
+        self.link = None
+        self.mode = 'idle'
+        self.rate_hz = SAMPLE_RATE_HZ
+        self.decimation = IDLE_DECIMATION if ADAPTIVE_SAMPLING else 1
+        self.burst_until = 0.0
+        self._revert_task = None
+        # Stats
+        self.bursts = 0
+        self.commands_sent = 0
+
+    @property
+    def controllable(self) -> bool:
+        return self.client is not None and bool(self.link and self.link['controlled'])
+
+    async def attach(self, client) -> dict:
+        """New connection: negotiate the link and push the current settings"""
+        self.client = client
+        self.link = await configure_link(client, self.rate_hz, self.decimation)
+        return self.link
+
+    def detach(self):
+        self.client = None
+
+    async def apply(self, rate_hz: int = None, decimation: int = None) -> bool:
+        """Change sample rate and/or decimation; True when the device took it now"""
+        commands = []
+        if rate_hz is not None and clamp_rate(rate_hz) != self.rate_hz:
+            self.rate_hz = clamp_rate(rate_hz)
+            commands.append(f"RATE:{self.rate_hz}")
+        if decimation is not None and clamp_decimation(decimation) != self.decimation:
+            self.decimation = clamp_decimation(decimation)
+            commands.append(f"DECIM:{self.decimation}")
+
+        if not self.controllable:
+            return False
+        try:
+            for command in commands:
+                await send_command(self.client, command)
+                self.commands_sent += 1
+            self.link['rate_hz'], self.link['decimation'] = self.rate_hz, self.decimation
+            return True
+        except Exception as e:
+            print(f"   ⚠️  {self.label}: control write failed: {e}")
+            return False
+
+    async def enter_burst(self, seconds: float = BURST_SECONDS):
+        """Full resolution for `seconds`; extends a burst already running"""
+        self.burst_until = max(self.burst_until, time.time() + seconds)
+        if self.mode == 'burst':
+            return
+        self.mode = 'burst'
+        self.bursts += 1
+        await self.apply(BURST_SAMPLE_RATE_HZ, BURST_DECIMATION)
+        print(f"🔬 {self.label}: burst mode ({self.rate_hz} Hz, 1 in {self.decimation}) for {seconds:g}s")
+        if self._revert_task is None or self._revert_task.done():
+            self._revert_task = asyncio.create_task(self._revert_when_quiet())
+
+    async def enter_idle(self):
+        """Back to decimated streaming"""
+        self.burst_until = 0.0
+        if self.mode == 'idle':
+            return
+        self.mode = 'idle'
+        await self.apply(SAMPLE_RATE_HZ, IDLE_DECIMATION)
+        print(f"💤 {self.label}: idle mode ({self.rate_hz} Hz, 1 in {self.decimation})")
+
+    def on_event(self):
+        """A driving event was detected - go (or stay) in burst mode without blocking the caller"""
+        if not ADAPTIVE_SAMPLING:
+            return
+        if self.mode == 'burst':
+            self.burst_until = max(self.burst_until, time.time() + BURST_SECONDS)
+        else:
+            asyncio.create_task(self.enter_burst())
+
+    async def _revert_when_quiet(self):
+        try:
+            while self.mode == 'burst':
+                remaining = self.burst_until - time.time()
+                if remaining <= 0:
+                    await self.enter_idle()
+                    return
+                await asyncio.sleep(remaining)
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self):
+        if self._revert_task:
+            self._revert_task.cancel()
+            self._revert_task = None
+        self.detach()
+
+
+class ThroughputMeter:
+    """Notification, message and byte rates of one link, logged periodically"""
+
+    def __init__(self, label: str, interval: float = THROUGHPUT_LOG_SECONDS):
+        self.label = label
+        self.interval = interval
+        self.link = None
+        self._reset(time.time())
+
+    def _reset(self, now: float):
+        self.window_started = now
+        self.notifications = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def record(self, nbytes: int, messages: int):
+        self.notifications += 1
+        self.messages += messages
+        self.bytes += nbytes
+
+        now = time.time()
+        if self.interval and now - self.window_started >= self.interval:
+            self.report(now)
+
+    def report(self, now: float = None):
+        now = now or time.time()
+        elapsed = max(now - self.window_started, 1e-6)
+        link = ""
+        if self.link:
+            link = f" (MTU {self.link['mtu']}, {self.link['pack']}/notification)"
+        print(f"📶 {self.label}: {self.notifications / elapsed:.1f} notif/s, {self.messages / elapsed:.1f} msg/s, "
+              f"{self.bytes / elapsed:.0f} B/s{link}")
+        self._reset(now)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Multi-device BLE hub
+Connects to every Arduino in the device registry from a single asyncio process.
+Each device gets its own SupabaseDrivingMonitor; all of them share one
+Supabase client and one batched writer.
+
+Manage devices while the hub runs:
+    python3 device_registry.py add <address> [arduino_id]
+    python3 device_registry.py remove <address>
+
+A device's session is opened when it first connects, not when it is
+registered. A device that is out of range (or gave up reconnecting) is
+tried again every BLE_HUB_RETRY_SECONDS, so a vehicle returning to the
+depot is picked up without touching the registry.
+"""
+from startup_profile import preload
+
+import asyncio
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+from ble_supabase import SupabaseDrivingMonitor, stream_with_reconnect
+from device_registry import DeviceRegistry
+from supabase_writer import BatchedWriter
+from driver_state import DriverStateWriter
+from session_timeouts import LivenessMonitor
+from notification_service import NotificationService
+from ingest_tracing import get_tracer
+from supabase_client import get_supabase
+from session_lifecycle import sweep_forever, SWEEP_INTERVAL_SECONDS
+
+# Force unbuffered output so logs show in real-time
+sys.stdout.reconfigure(line_buffering=True)
+sys.stderr.reconfigure(line_buffering=True)
+
+load_dotenv()
+
+REGISTRY_POLL_SECONDS = float(os.getenv('BLE_HUB_REGISTRY_POLL_SECONDS', 5))
+STATS_INTERVAL_SECONDS = float(os.getenv('BLE_HUB_STATS_INTERVAL_SECONDS', 30))
+# Pause before an enabled device whose connection loop ended is tried again
+RETRY_SECONDS = float(os.getenv('BLE_HUB_RETRY_SECONDS', 30))
+
+
+class DeviceConnection:
+    """One registered Arduino: its monitor, connection task and throughput"""
+
+    def __init__(self, address: str, monitor: SupabaseDrivingMonitor):
+        self.address = address
+        self.monitor = monitor
+        self.task = None
+        self.started_at = time.time()
+        self._last_stats = (time.time(), 0, 0, 0)
+
+    def throughput(self):
+        """Notifications/sec, messages/sec and bytes/sec since the previous call"""
+        now = time.time()
+        last_time, last_notifications, last_messages, last_bytes = self._last_stats
+        monitor = self.monitor
+        notifications, messages, total_bytes = (monitor.notifications_received, monitor.messages_received,
+                                                monitor.bytes_received)
+        self._last_stats = (now, notifications, messages, total_bytes)
+
+        elapsed = max(now - last_time, 1e-6)
+        return ((notifications - last_notifications) / elapsed, (messages - last_messages) / elapsed,
+                (total_bytes - last_bytes) / elapsed)
+
+
+class BleHub:
+    def __init__(self, registry: DeviceRegistry = None):
+        self.registry = registry or DeviceRegistry()
+        self.connections = {}
+        # Address -> when its connection loop last ended, for RETRY_SECONDS
+        self.ended_at = {}
+
+        # One client, one writer and one coalesced driver-state writer for every device
+        self.supabase = get_supabase()
+        self.writer = BatchedWriter(self.supabase)
+        self.driver_state = DriverStateWriter(self.writer)
+        # One timeout heap for every session instead of a polling task per device
+        self.liveness = LivenessMonitor()
+        # One notification worker (and SMTP connection) for the whole fleet
+        self.notifier = NotificationService(self.supabase)
+
+    def add_device(self, address: str, arduino_id: str):
+        """Start monitoring a device"""
+        if address in self.connections:
+            return
+
+        monitor = SupabaseDrivingMonitor(
+            arduino_id=arduino_id,
+            supabase=self.supabase,
+            writer=self.writer,
+            driver_state=self.driver_state,
+            liveness=self.liveness,
+            notifier=self.notifier
+        )
+        connection = DeviceConnection(address, monitor)
+        connection.task = asyncio.create_task(self.run_device(connection))
+        self.connections[address] = connection
+        print(f"➕ Added device {arduino_id} ({address})")
+
+    async def remove_device(self, address: str):
+        """Stop monitoring a device and end its session"""
+        connection = self.connections.pop(address, None)
+        if not connection:
+            return
+
+        connection.task.cancel()
+        try:
+            await connection.task
+        except asyncio.CancelledError:
+            pass
+        print(f"➖ Removed device {connection.monitor.arduino_id} ({address})")
+
+    async def run_device(self, connection: DeviceConnection):
+        """Session lifecycle for one device - mirrors ble_supabase.main, but the
+        session (and the supervisor's 'online' email) waits for the first connection"""
+        monitor = connection.monitor
+        opened = False
+
+        async def open_session():
+            nonlocal opened
+            opened = await monitor.initialize_session()
+            return opened
+
+        try:
+            await stream_with_reconnect(monitor, connection.address, on_first_connect=open_session)
+        finally:
+            if opened:
+                await monitor.end_session()
+            # A device that gave up on its own is tried again by sync_devices after RETRY_SECONDS
+            if self.connections.get(connection.address) is connection:
+                del self.connections[connection.address]
+                self.ended_at[connection.address] = time.time()
+
+    async def sync_devices(self):
+        """Bring running connections in line with the registry; enabled devices
+        whose connection loop ended are started again once RETRY_SECONDS have passed"""
+        wanted = self.registry.enabled_devices()
+
+        for address in list(self.connections):
+            if address not in wanted:
+                await self.remove_device(address)
+
+        now = time.time()
+        for address, arduino_id in wanted.items():
+            if address not in self.connections and now - self.ended_at.get(address, 0.0) >= RETRY_SECONDS:
+                self.ended_at.pop(address, None)
+                self.add_device(address, arduino_id)
+
+    def report_stats(self):
+        print("\n📈 Hub throughput:")
+        for address, connection in self.connections.items():
+            notifications_per_sec, messages_per_sec, bytes_per_sec = connection.throughput()
+            link = connection.monitor.link
+            control = connection.monitor.control
+            link_info = (f", MTU {link['mtu']}, {link['pack']}/notification, {control.mode} "
+                         f"{control.rate_hz} Hz 1 in {control.decimation}, {control.bursts} bursts") if link else ""
+            print(f"   {connection.monitor.arduino_id}: {notifications_per_sec:.1f} notif/s, {messages_per_sec:.1f} msg/s, "
+                  f"{bytes_per_sec:.0f} B/s ({connection.monitor.messages_received} total{link_info})")
+        print(f"   Writer: {self.writer.rows_written} rows in {self.writer.batches_written} batches, "
+              f"{self.writer.pending_count()} pending, {self.writer.failed_batches} failed")
+        print(f"   Driver state: {self.driver_state.updates_emitted} updates for "
+              f"{self.driver_state.changes_received} changes ({self.driver_state.changes_suppressed} suppressed)")
+        notifications = self.notifier.stats()
+        if notifications['latency_p50'] is not None:
+            print(f"   Notifications: {notifications['sent']} sent, p50 latency {notifications['latency_p50']:.2f}s, "
+                  f"max {notifications['latency_max']:.2f}s, {notifications['pending']} pending")
+        get_tracer().print_report()
+
+    async def run(self):
+        print(f"\n🛰️  BLE hub watching {self.registry.path}")
+        self.writer.start()
+        self.driver_state.start()
+        self.liveness.start()
+        self.notifier.start()
+        # Sessions other processes left open are closed in bulk (ours keep their heartbeat fresh)
+        sweeper = asyncio.create_task(sweep_forever(self.supabase)) if SWEEP_INTERVAL_SECONDS > 0 else None
+        await self.sync_devices()
+
+        last_stats = time.time()
+        try:
+            while True:
+                await asyncio.sleep(REGISTRY_POLL_SECONDS)
+
+                if self.registry.reload_if_changed():
+                    print("🔄 Device registry changed")
+                    # Registry edits apply right away, even to devices waiting out RETRY_SECONDS
+                    self.ended_at.clear()
+                # Also brings back devices that dropped out of range
+                await self.sync_devices()
+
+                if time.time() - last_stats >= STATS_INTERVAL_SECONDS:
+                    self.report_stats()
+                    last_stats = time.time()
+        finally:
+            print("\n🛑 Stopping hub...")
+            if sweeper:
+                sweeper.cancel()
+            for address in list(self.connections):
+                await self.remove_device(address)
+            await self.liveness.stop()
+            await self.notifier.stop()
+            await self.driver_state.stop()
+            await self.writer.stop()
+            get_tracer().close()
+            print("✅ Hub stopped")
+
+
+async def main():
+    # Import bleak while the shared services come up
+    preload('bleak')
+    hub = BleHub()
+    if not hub.registry.enabled_devices():
+        print("⚠️  No devices registered - add one with: python3 device_registry.py add <address> [arduino_id]")
+    await hub.run()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+BLE notification recorder and replay harness
+
+Record raw notifications from a live Arduino:
+    BLE_RECORD_PATH=trip.blerec python3 ble_supabase.py
+    python3 ble_replay.py record <address> trip.blerec [seconds]
+
+Replay them through SupabaseDrivingMonitor.process_data against an
+in-memory fake backend (no Arduino or network needed):
+    python3 ble_replay.py replay trip.blerec [--speed 1|10|max] [--latency 0.05] [--verbose]
+
+Recording format: the magic header below, then one record per
+notification - little-endian float64 receive time, uint16 payload
+length, raw payload bytes.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import struct
+import sys
+import tempfile
+import time
+
+MAGIC = b'BLEREC1\n'
+RECORD_HEADER = struct.Struct('<dH')
+
+
+class NotificationRecorder:
+    """Appends raw notification payloads with their receive time to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new_file:
+            self._file.write(MAGIC)
+        self.count = 0
+
+    def record(self, data: bytes, received_at: float = None):
+        received_at = time.time() if received_at is None else received_at
+        self._file.write(RECORD_HEADER.pack(received_at, len(data)))
+        self._file.write(data)
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path: str):
+    """Yield (received_at, payload bytes) from a recording"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a BLE recording")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            received_at, length = RECORD_HEADER.unpack(header)
+            yield received_at, f.read(length)
+
+
+class NullSender:
+    """Email sender for replays - records instead of sending"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, subject: str, message: str, recipient: str):
+        self.sent.append((subject, recipient))
+
+    def close(self):
+        pass
+
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def build_fake_pipeline(arduino_id: str = 'REPLAY-001', latency: float = 0.0, workdir: str = None):
+    """A SupabaseDrivingMonitor wired to an in-memory backend and a scratch outbox
+
+    Without a `workdir` the outbox goes in a temporary directory that is
+    removed once the monitor is garbage collected, or at exit.
+    """
+    from ble_supabase import SupabaseDrivingMonitor
+    from fake_supabase import FakeSupabase
+    from notification_service import NotificationService
+    from outbox import Outbox
+    from supabase_writer import BatchedWriter
+
+    scratch = None
+    if workdir is None:
+        scratch = tempfile.TemporaryDirectory(prefix='ble_replay_')
+        workdir = scratch.name
+    outbox_path = os.path.join(workdir, 'outbox.db')
+
+    supabase = FakeSupabase(latency=latency)
+    supabase.seed('drivers', [{'id': f'driver-{arduino_id}', 'name': f'Replay {arduino_id}',
+                               'email': 'replay@example.com', 'arduino_id': arduino_id}])
+    supabase.seed('supervisors', [{'email': 'supervisor@example.com'}])
+
+    monitor = SupabaseDrivingMonitor(
+        arduino_id=arduino_id,
+        supabase=supabase,
+        writer=BatchedWriter(supabase, Outbox(outbox_path)),
+        notifier=NotificationService(supabase, path=outbox_path, sender=NullSender())
+    )
+    # Keeps the scratch directory alive exactly as long as the monitor using it
+    monitor.replay_workdir = scratch
+    return monitor, supabase
+
+
+async def replay(path: str, speed: float = 1.0, latency: float = 0.0, verbose: bool = False):
+    """Feed a recording into process_data; speed 0 means as fast as possible"""
+    from ble_control import split_notification
+
+    records = list(read_recording(path))
+    if not records:
+        print("❌ Recording is empty")
+        return
+
+    monitor, supabase = build_fake_pipeline(latency=latency)
+
+    output = sys.stdout if verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        # Writer and notifier were passed in, so the harness runs them
+        monitor.writer.start()
+        monitor.notifier.start()
+        await monitor.initialize_session()
+    calls_after_setup = supabase.total_calls
+
+    loop = asyncio.get_running_loop()
+    lags = []
+    pending = set()
+    first_recorded = records[0][0]
+    replay_started = loop.time()
+    # Shift recorded receive times so the device clock model sees a consistent timeline
+    time_shift = time.time() - first_recorded
+
+    async def handle(message: str, received_at: float, scheduled: float):
+        await monitor.process_data(message, received_at=received_at)
+        lags.append(loop.time() - scheduled)
+
+    with contextlib.redirect_stdout(output):
+        for received_at, payload in records:
+            scheduled = replay_started
+            if speed > 0:
+                scheduled += (received_at - first_recorded) / speed
+                delay = scheduled - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                scheduled = loop.time()
+
+            # Same dispatch as the live notification handler
+            monitor.touch('ble')
+            for message in split_notification(payload):
+                task = asyncio.create_task(handle(message, received_at + time_shift, scheduled))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if speed <= 0:
+                await asyncio.sleep(0)
+
+        if pending:
+            await asyncio.gather(*pending)
+        elapsed = loop.time() - replay_started
+
+        # Let queued writes reach the (fake) database so they're counted
+        await monitor.end_session()
+        await monitor.notifier.stop()
+        await monitor.writer.stop()
+
+    messages = len(lags)
+    db_calls = supabase.total_calls - calls_after_setup
+    print("\n" + "=" * 60)
+    print(f"📼 REPLAY: {path} ({'max' if speed <= 0 else f'{speed:g}x'} speed)")
+    print("=" * 60)
+    print(f"Notifications:  {len(records)}")
+    print(f"Messages:       {messages}")
+    print(f"Elapsed:        {elapsed:.2f}s")
+    print(f"Throughput:     {messages / max(elapsed, 1e-9):.1f} msg/s")
+    print(f"Lag p50/p95/max: {percentile(lags, 0.5) * 1000:.1f} / {percentile(lags, 0.95) * 1000:.1f} / "
+          f"{max(lags, default=0.0) * 1000:.1f} ms")
+    print(f"DB calls:       {db_calls} ({db_calls / max(messages, 1):.3f} per message)")
+    for (table, op), count in sorted(supabase.calls.items()):
+        print(f"   {table:18s} {op:7s} {count}")
+    monitor.tracer.print_report()
+    monitor.tracer.close()
+    print("=" * 60)
+
+
+async def record(address: str, path: str, seconds: float):
+    """Record notifications from a live device without touching Supabase"""
+    from bleak import BleakClient
+    from ble_control import configure_link
+    from ble_supabase import DRIVING_DATA_CHARACTERISTIC
+
+    recorder = NotificationRecorder(path)
+
+    def notification_handler(sender, data):
+        recorder.record(bytes(data))
+
+    print(f"🔴 Recording {address} → {path} for {seconds:g}s...")
+    try:
+        async with BleakClient(address, timeout=10.0) as client:
+            # Record with the same link settings the bridge uses
+            await configure_link(client)
+            await client.start_notify(DRIVING_DATA_CHARACTERISTIC, notification_handler)
+            await asyncio.sleep(seconds)
+    finally:
+        recorder.close()
+        print(f"✅ Recorded {recorder.count} notifications")
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) >= 3 and args[0] == 'record':
+        seconds = float(args[3]) if len(args) > 3 else 60.0
+        asyncio.run(record(args[1], args[2], seconds))
+    elif len(args) >= 2 and args[0] == 'replay':
+        speed, latency = 1.0, 0.0
+        if '--speed' in args:
+            value = args[args.index('--speed') + 1]
+            speed = 0.0 if value == 'max' else float(value)
+        if '--latency' in args:
+            latency = float(args[args.index('--latency') + 1])
+        asyncio.run(replay(args[1], speed=speed, latency=latency, verbose='--verbose' in args))
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
+from startup_profile import profile, preload
+
 import asyncio
+import random
 import time
+import uuid
 from datetime import datetime, timezone
-from bleak import BleakClient, BleakScanner
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 import os
 import sys
 
+from supabase_client import get_supabase
+from clock_sync import ClockSync
+from supabase_writer import BatchedWriter
+from driver_state import DriverStateWriter
+from session_timeouts import LivenessMonitor, SESSION_TIMEOUT_SECONDS
+from notification_service import NotificationService
+from telemetry_rollups import TelemetryRollups
+import ingest_tracing
+from ble_control import DeviceControl, ThroughputMeter, split_notification
+from impact_detection import ImpactDetector, IMPACT_SLO_MS
+from child_health import Heartbeat
+from shared_state import SharedSessionState, SHARED_STATE_POLL_SECONDS
+from ingest_tracing import Tracer, get_tracer, span, traced
+
+if TYPE_CHECKING:
+    from supabase import Client
+
 # Force unbuffered output so logs show in real-time
 sys.stdout.reconfigure(line_buffering=True)
 sys.stderr.reconfigure(line_buffering=True)
@@ -14,16 +34,36 @@ sys.stderr.reconfigure(line_buffering=True)
 # Load environment variables
 load_dotenv()
 
+# BLE characteristic the Arduino sends driving data on
+DRIVING_DATA_CHARACTERISTIC = "87654321-4321-4321-4321-cba987654321"
+
+# Reconnect policy - how long a dropped link may stay down before the trip ends
+RECONNECT_GRACE_SECONDS = float(os.getenv('BLE_RECONNECT_GRACE_SECONDS', 120))
+RECONNECT_BASE_DELAY = float(os.getenv('BLE_RECONNECT_BASE_DELAY', 0.5))
+RECONNECT_MAX_DELAY = float(os.getenv('BLE_RECONNECT_MAX_DELAY', 15))
+# Longest a score read from Supabase may take before the local score is used instead
+SUPABASE_READ_TIMEOUT = float(os.getenv('SUPABASE_READ_TIMEOUT_SECONDS', 2))
+
 class SupabaseDrivingMonitor:
-    def __init__(self, arduino_id: str = "ARD-001"):
+    def __init__(self, arduino_id: str = "ARD-001", supabase: 'Client' = None, writer=None, driver_state=None,
+                 liveness: LivenessMonitor = None, notifier: NotificationService = None, tracer: Tracer = None,
+                 shared_state: SharedSessionState = None):
         self.arduino_id = arduino_id
         self.event_count = 0
         self.last_event_time = 0
         self.aggressive_events = []
         self.session_id = None
         self.driver_id = None
+        self.driver = None
         self.heartbeat_task = None
-        self.session_timeout_task = None
+        self.shared_state_task = None
+
+        # Idle timeout driven by local BLE/camera activity (shared across devices in the hub)
+        self._owns_liveness = liveness is None
+        self.liveness = liveness or LivenessMonitor()
+
+        # Set once end_session() has run, so it only runs once and the BLE loop can stop
+        self.session_closed = asyncio.Event()
 
         # Track last event timestamp for each event type (time-based cooldown)
         self.last_event_timestamps = {
@@ -35,18 +75,58 @@ class SupabaseDrivingMonitor:
         # Cooldown period in seconds - same event type must wait this long before saving again
         self.EVENT_COOLDOWN_SECONDS = 3.0
 
+        # Local copy of the session safety score (the database may lag behind the outbox)
+        self.safety_score = 100
+
         # Track last score update time for gradual recovery
         self.last_score_recovery_time = time.time()
 
-        # Initialize Supabase client
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_KEY")  # Use service key for backend operations
+        # BLE link gaps ({'started_at', 'ended_at', 'duration'}) kept for the session summary
+        self.connection_gaps = []
+
+        # Maps the Arduino's millis() onto UTC so queued/buffered samples keep their real time
+        self.clock = ClockSync()
+
+        # Per-second/per-minute aggregates of the raw stream (raw samples aren't stored)
+        self.rollups = TelemetryRollups()
+
+        # Notification throughput counters (read by the hub's stats report);
+        # one notification can carry several packed messages
+        self.notifications_received = 0
+        self.messages_received = 0
+        self.bytes_received = 0
+
+        # High-g impacts skip the batched path (see handle_impact)
+        self.impacts = ImpactDetector()
 
-        if not supabase_url or not supabase_key:
-            raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_KEY in .env file")
+        # Sample rate / decimation on the device: decimated while cruising, full rate around events
+        self.control = DeviceControl(arduino_id)
 
-        self.supabase: Client = create_client(supabase_url, supabase_key)
-        print(f"✅ Connected to Supabase")
+        # Session/score shared with the camera process (run_monitoring.py --subprocess); we are its
+        # only writer and apply the penalties the camera adds up
+        self.shared_state = shared_state
+        self.camera_penalties_applied = 0
+
+        # Reuse a shared Supabase client when one is provided (e.g. by ble_hub.py),
+        # otherwise the process-wide one
+        self.supabase = supabase if supabase is not None else get_supabase()
+
+        # All writes go through the durable outbox; a shared writer is batched with other monitors
+        self._owns_writer = writer is None
+        self.writer = writer or BatchedWriter(self.supabase)
+
+        # `drivers` row changes are merged into at most one UPDATE per tick
+        self._owns_driver_state = driver_state is None
+        self.driver_state = driver_state or DriverStateWriter(self.writer)
+
+        # Supervisor emails are sent by an in-process worker, not a child interpreter
+        self._owns_notifier = notifier is None
+        self.notifier = notifier or NotificationService(self.supabase)
+
+        # Per-notification latency traces, closed when the outbox commits their rows
+        self.tracer = tracer or get_tracer()
+        self.tracer.watch(self.writer.outbox)
+        self.tracer.set_slo('impact', IMPACT_SLO_MS)
 
     async def initialize_session(self):
         """Find or create driver and start a new driving session"""
@@ -60,6 +140,7 @@ class SupabaseDrivingMonitor:
                 return False
 
             driver = response.data[0]
+            self.driver = driver
             self.driver_id = driver['id']
             print(f"✅ Found driver: {driver['name']} ({driver['email']})")
 
@@ -76,24 +157,44 @@ class SupabaseDrivingMonitor:
             self.session_id = session_response.data[0]['id']
             print(f"✅ Started new driving session: {self.session_id}")
 
-            # Update driver status to active and online
-            self.supabase.table('drivers').update({
-                'status': 'active',
-                'connection_status': 'online',
-                'last_active': datetime.now(timezone.utc).isoformat(),
-                'last_heartbeat': datetime.now(timezone.utc).isoformat()
-            }).eq('id', self.driver_id).execute()
+            # Start draining the outbox (also replays anything left from a previous run)
+            if self._owns_writer:
+                self.writer.start()
+            if self._owns_driver_state:
+                self.driver_state.start()
+
+            # Update driver status to active and online - written immediately, not on the next tick
+            self._set_driver_state(
+                status='active',
+                connection_status='online',
+                last_active=datetime.now(timezone.utc).isoformat(),
+                last_heartbeat=datetime.now(timezone.utc).isoformat()
+            )
+            self.driver_state.flush()
 
             print(f"🟢 Driver is now ONLINE")
 
             # Send email notification to supervisor
-            self.send_supervisor_notification()
+            if self._owns_notifier:
+                self.notifier.start()
+            self.send_supervisor_notification(driver)
 
-            # Start heartbeat, score recovery, and timeout tasks
+            # Start heartbeat and score recovery tasks
             self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
             self.score_recovery_task = asyncio.create_task(self.score_recovery_loop())
-            self.session_timeout_task = asyncio.create_task(self.session_timeout_monitor())
 
+            # The camera process reads the session from shared memory instead of querying for it
+            if self.shared_state is not None:
+                self.shared_state.publish_session(self.session_id, self.driver_id, self.safety_score)
+                self.camera_penalties_applied = (self.shared_state.camera() or {}).get('penalty_total', 0)
+                self.shared_state_task = asyncio.create_task(self.shared_state_loop())
+
+            # Watch for inactivity locally - no database reads needed
+            self.liveness.register(self.session_id, self.on_session_timeout)
+            if self._owns_liveness:
+                self.liveness.start()
+
+            profile.mark('session_ready')
             return True
 
         except Exception as e:
@@ -105,25 +206,31 @@ class SupabaseDrivingMonitor:
         try:
             while True:
                 await asyncio.sleep(10)
-                self.supabase.table('drivers').update({
-                    'last_heartbeat': datetime.now(timezone.utc).isoformat()
-                }).eq('id', self.driver_id).execute()
+                self._set_driver_state(last_heartbeat=datetime.now(timezone.utc).isoformat())
         except asyncio.CancelledError:
             print("Heartbeat stopped")
 
-    def send_supervisor_notification(self):
-        """Send email notification to supervisor when driver goes online"""
+    async def shared_state_loop(self):
+        """Apply penalties the camera process added to the shared block"""
         try:
-            import subprocess
-            print(f"📧 Sending supervisor notification for driver {self.driver_id}...")
+            while True:
+                await asyncio.sleep(SHARED_STATE_POLL_SECONDS)
+                camera = self.shared_state.camera()
+                if camera is None:
+                    continue
+                pending = camera['penalty_total'] - self.camera_penalties_applied
+                if pending > 0:
+                    self.camera_penalties_applied = camera['penalty_total']
+                    await self.update_session_score(penalty_points=pending)
+        except asyncio.CancelledError:
+            pass
 
-            # Run notification script in background
-            subprocess.Popen(
-                [sys.executable, 'notify_supervisor.py', self.driver_id],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            print("   ✓ Notification triggered")
+    def send_supervisor_notification(self, driver: dict):
+        """Queue an email notification to supervisors that the driver went online"""
+        try:
+            print(f"📧 Sending supervisor notification for driver {self.driver_id}...")
+            self.notifier.notify_driver_online(driver)
+            print("   ✓ Notification queued")
         except Exception as e:
             print(f"   ⚠️  Could not send notification: {e}")
 
@@ -138,25 +245,14 @@ class SupabaseDrivingMonitor:
         except asyncio.CancelledError:
             print("Score recovery stopped")
 
-    async def session_timeout_monitor(self):
-        """Auto-end session after 5 minutes of inactivity"""
-        try:
-            while True:
-                await asyncio.sleep(60)  # Check every minute
-
-                # Get last heartbeat time
-                driver = self.supabase.table('drivers').select('last_heartbeat').eq('id', self.driver_id).execute()
-                if driver.data:
-                    last_heartbeat = datetime.fromisoformat(driver.data[0]['last_heartbeat'].replace('Z', '+00:00'))
-                    time_since_heartbeat = (datetime.now(last_heartbeat.tzinfo) - last_heartbeat).total_seconds()
-
-                    # If no heartbeat for 5 minutes, end session
-                    if time_since_heartbeat > 300:  # 5 minutes
-                        print("⏱️  No activity for 5 minutes, ending session...")
-                        await self.end_session()
-                        break
-        except asyncio.CancelledError:
-            print("Timeout monitor stopped")
+    def touch(self, source: str = 'ble'):
+        """Record a liveness signal (BLE notification, camera frame) for this session"""
+        self.liveness.touch(self.session_id, source)
+
+    async def on_session_timeout(self):
+        """Auto-end session after SESSION_TIMEOUT_SECONDS without BLE or camera activity"""
+        print(f"⏱️  No activity for {SESSION_TIMEOUT_SECONDS / 60:.0f} minutes, ending session...")
+        await self.end_session()
 
     def calculate_severity(self, event_type: str, x: float, y: float, z: float) -> str:
         """Calculate severity based on event type and sensor values"""
@@ -171,7 +267,8 @@ class SupabaseDrivingMonitor:
         else:
             return 'low'
 
-    async def save_sensor_reading(self, x: float, y: float, z: float, event_type: str, count: int):
+    @traced('save_sensor_reading')
+    async def save_sensor_reading(self, x: float, y: float, z: float, event_type: str, count: int, timestamp: str = None):
         """Save raw sensor reading to Supabase - ONLY when there's an event"""
         try:
             # Only save sensor readings if there's an actual event
@@ -186,15 +283,16 @@ class SupabaseDrivingMonitor:
                 'z': z,
                 'event_type': event_type,
                 'count_at_time': count,
-                'timestamp': datetime.now(timezone.utc).isoformat()
+                'timestamp': timestamp or datetime.now(timezone.utc).isoformat()
             }
 
-            self.supabase.table('sensor_readings').insert(sensor_data).execute()
+            self._insert('sensor_readings', sensor_data)
 
         except Exception as e:
             print(f"⚠️  Error saving sensor reading: {e}")
 
-    async def save_event(self, event_type: str, x: float, y: float, z: float, count: int):
+    @traced('save_event')
+    async def save_event(self, event_type: str, x: float, y: float, z: float, count: int, timestamp: str = None):
         """Save driving event to Supabase"""
         try:
             severity = self.calculate_severity(event_type, x, y, z)
@@ -209,10 +307,12 @@ class SupabaseDrivingMonitor:
                 'z': z,
                 'count_at_time': count,
                 'severity': severity,
-                'timestamp': datetime.now(timezone.utc).isoformat()
+                'timestamp': timestamp or datetime.now(timezone.utc).isoformat()
             }
 
-            self.supabase.table('events').insert(event_data).execute()
+            self._insert('events', event_data)
+            if self.shared_state is not None:
+                self.shared_state.publish_event(event_type)
 
             # Calculate penalty points based on event type (doubled for faster demo)
             penalty_points = {
@@ -228,13 +328,131 @@ class SupabaseDrivingMonitor:
 
             # Update driver status based on event count
             if count >= 5:
-                self.supabase.table('drivers').update({
-                    'status': 'warning'
-                }).eq('id', self.driver_id).execute()
+                self._set_driver_state(status='warning')
 
         except Exception as e:
             print(f"⚠️  Error saving event: {e}")
 
+    @traced('impact')
+    async def handle_impact(self, x: float, y: float, z: float, magnitude: float, sample_time: float):
+        """Fast path for a possible crash: alert supervisors first, persist now, full-rate data"""
+        ingest_tracing.set_kind('impact')
+        timestamp = datetime.fromtimestamp(sample_time, timezone.utc).isoformat()
+        print(f"💥 IMPACT: {magnitude:.1f} g at {time.strftime('%H:%M:%S', time.localtime(sample_time))}")
+
+        # Bookkeeping that doesn't wait on the network goes before the write
+        self.aggressive_events.append({
+            'type': 'CRASH',
+            'time': time.strftime('%H:%M:%S', time.localtime(sample_time)),
+            'count': self.event_count
+        })
+        if self.shared_state is not None:
+            self.shared_state.publish_event('CRASH', sample_time)
+        self._set_driver_state(status='warning')
+        self.driver_state.flush()
+        if self.driver:
+            self.notifier.notify_impact(self.driver, magnitude, timestamp)
+        self.control.on_event()
+
+        try:
+            event_data = {
+                'session_id': self.session_id,
+                'driver_id': self.driver_id,
+                'arduino_id': self.arduino_id,
+                'event_type': 'CRASH',
+                'x': x,
+                'y': y,
+                'z': z,
+                'count_at_time': self.event_count,
+                'severity': 'high',
+                'timestamp': timestamp
+            }
+            # Straight to Supabase; stays in the outbox if that fails. The key is
+            # attached to the trace first because the commit can land before insert_now returns
+            key = str(uuid.uuid4())
+            ingest_tracing.note_write(key)
+            await self.writer.insert_now('events', event_data, session_id=self.session_id, idempotency_key=key)
+        except Exception as e:
+            print(f"⚠️  Error saving impact: {e}")
+
+    def _insert(self, table: str, data: dict):
+        """Queue a row insert in the outbox"""
+        ingest_tracing.note_write(self.writer.insert(table, data, session_id=self.session_id))
+
+    def _update(self, table: str, fields: dict, row_id: str):
+        """Queue an update of one row (by id) in the outbox"""
+        ingest_tracing.note_write(self.writer.update(table, fields, {'id': row_id}, session_id=self.session_id))
+
+    def _set_driver_state(self, **fields):
+        """Merge changes to this driver's row into the next coalesced UPDATE"""
+        self.driver_state.set(self.driver_id, session_id=self.session_id, **fields)
+
+    @property
+    def link(self):
+        """Negotiated MTU, pack size and sampling settings of the current connection"""
+        return self.control.link
+
+    async def set_sample_rate(self, rate_hz: int) -> bool:
+        """Change how fast the device samples (and detects); applied on reconnect if offline"""
+        return await self.control.apply(rate_hz=rate_hz)
+
+    async def set_decimation(self, decimation: int) -> bool:
+        """Send only every nth sample; event samples are always sent"""
+        return await self.control.apply(decimation=decimation)
+
+    async def enter_burst(self, seconds: float = None):
+        """Full-resolution streaming for a while (e.g. while a supervisor is watching)"""
+        if seconds is None:
+            await self.control.enter_burst()
+        else:
+            await self.control.enter_burst(seconds)
+
+    async def enter_idle(self):
+        """Back to decimated streaming"""
+        await self.control.enter_idle()
+
+    def _save_rollups(self, rows: list):
+        """Queue closed telemetry windows as telemetry_rollups rows"""
+        for row in rows:
+            row.update(session_id=self.session_id, driver_id=self.driver_id, arduino_id=self.arduino_id)
+            self._insert('telemetry_rollups', row)
+
+    def flush_pending_writes(self):
+        """Kick the outbox sender, e.g. right after the link comes back"""
+        pending = self.writer.pending_count()
+        if pending:
+            print(f"📤 Flushing {pending} queued write(s)...")
+            asyncio.create_task(self.writer.flush())
+
+    def record_connection_gap(self, started_at: float, ended_at: float):
+        """Remember a BLE outage that was bridged without ending the session"""
+        gap = {
+            'started_at': datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+            'ended_at': datetime.fromtimestamp(ended_at, timezone.utc).isoformat(),
+            'duration': ended_at - started_at
+        }
+        self.connection_gaps.append(gap)
+        print(f"🔗 Link restored after {gap['duration']:.1f}s gap (session {self.session_id} kept)")
+
+    def sample_time(self, device_ms: int = None, received_at: float = None) -> float:
+        """Epoch seconds at which a sample was taken.
+
+        Uses the device clock when the message carries millis(), falling back
+        to the notification receive time, then to now.
+        """
+        if device_ms is not None:
+            self.clock.observe(device_ms, received_at)
+            sample_time = self.clock.to_host_time(device_ms)
+        else:
+            sample_time = received_at if received_at is not None else time.time()
+        ingest_tracing.note_sample_time(sample_time)
+        return sample_time
+
+    async def _read(self, query):
+        """Run a Supabase select in a worker thread so a slow link never stalls BLE handling"""
+        return (await asyncio.wait_for(asyncio.to_thread(query.execute), SUPABASE_READ_TIMEOUT)).data
+
+    @traced('update_session_score')
     async def update_session_score(self, penalty_points=0):
         """Update safety score for current session
 
@@ -242,113 +460,174 @@ class SupabaseDrivingMonitor:
             penalty_points: Points to deduct (0 for recovery check only)
         """
         try:
-            # Get current session
-            session = self.supabase.table('driving_sessions').select('*').eq('id', self.session_id).execute()
-
-            if session.data:
-                session_data = session.data[0]
-                current_score = session_data.get('safety_score', 100)
-
-                # Apply penalty if event occurred
-                if penalty_points > 0:
-                    current_score -= penalty_points
-                    self.last_score_recovery_time = time.time()  # Reset recovery timer
+            # The database only reflects our score once the outbox has drained;
+            # until then (or while offline) the local copy is the newer one
+            current_score = self.safety_score
+            if not self.writer.pending_count():
+                try:
+                    session = await self._read(
+                        self.supabase.table('driving_sessions').select('safety_score').eq('id', self.session_id))
+                    if session:
+                        current_score = session[0].get('safety_score', 100)
+                except Exception as e:
+                    print(f"   Using local score, session read failed: {str(e) or 'timed out'}")
+
+            # Apply penalty if event occurred
+            if penalty_points > 0:
+                current_score -= penalty_points
+                self.last_score_recovery_time = time.time()  # Reset recovery timer
+            else:
+                # Check MOST RECENT event from BOTH BLE and attention monitoring
+                if self.shared_state is not None:
+                    # Both pipelines record their event times in shared memory
+                    last_event_at = self.shared_state.last_event_time()
+                    recent_events = [last_event_at] if last_event_at else []
                 else:
-                    # Check MOST RECENT event from BOTH BLE and attention monitoring
-                    recent_events = self.supabase.table('events').select('timestamp').eq('session_id', self.session_id).order('timestamp', desc=True).limit(1).execute()
-
-                    if recent_events.data:
-                        # Get time since last event (from ANY source - driving or attention)
-                        last_event_timestamp = datetime.fromisoformat(recent_events.data[0]['timestamp'].replace('Z', '+00:00'))
-                        time_since_last_event = (datetime.now(timezone.utc) - last_event_timestamp).total_seconds()
-
-                        print(f"   Time since LAST EVENT (any type): {time_since_last_event:.1f}s | Current score: {current_score}")
-
-                        if time_since_last_event >= 5:
-                            recovery_cycles = int(time_since_last_event / 5)
-                            recovery_points = recovery_cycles * 2  # 2 points per 5 seconds
-                            new_score = min(100, current_score + recovery_points)
-                            current_score = new_score
-                            if recovery_points > 0:
-                                print(f"✨ Good driving! Safety score +{recovery_points} → {current_score}")
-                        else:
-                            print(f"   Not enough time passed for recovery (need 5s, have {time_since_last_event:.1f}s)")
+                    try:
+                        recent_events = await self._read(
+                            self.supabase.table('events').select('timestamp').eq('session_id', self.session_id)
+                            .order('timestamp', desc=True).limit(1))
+                    except Exception as e:
+                        # Fall back to our own last event time
+                        print(f"   Using local event time, events read failed: {str(e) or 'timed out'}")
+                        recent_events = []
+                    recent_events = [datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00')).timestamp()
+                                     for event in recent_events]
+
+                if recent_events:
+                    # Get time since last event (from ANY source - driving or attention)
+                    time_since_last_event = time.time() - recent_events[0]
+                    # Our own latest event may still be waiting in the outbox
+                    time_since_last_event = min(time_since_last_event, time.time() - self.last_score_recovery_time)
+
+                    print(f"   Time since LAST EVENT (any type): {time_since_last_event:.1f}s | Current score: {current_score}")
+
+                    if time_since_last_event >= 5:
+                        recovery_cycles = int(time_since_last_event / 5)
+                        recovery_points = recovery_cycles * 2  # 2 points per 5 seconds
+                        new_score = min(100, current_score + recovery_points)
+                        current_score = new_score
+                        if recovery_points > 0:
+                            print(f"✨ Good driving! Safety score +{recovery_points} → {current_score}")
                     else:
-                        # No events yet, use time since session start
-                        time_since_recovery = time.time() - self.last_score_recovery_time
-                        if time_since_recovery >= 5:
-                            recovery_points = int(time_since_recovery / 5) * 2  # 2 points per 5 seconds
-                            current_score = min(100, current_score + recovery_points)
-                            if recovery_points > 0:
-                                print(f"✨ Good driving! Safety score +{recovery_points} → {current_score}")
-
-                # Clamp score between 0 and 100
-                current_score = max(0, min(100, current_score))
-
-                # Update session
-                self.supabase.table('driving_sessions').update({
-                    'safety_score': current_score
-                }).eq('id', self.session_id).execute()
-
-                # Update driver's overall safety score
-                self.supabase.table('drivers').update({
-                    'safety_score': current_score,
-                    'last_active': datetime.now(timezone.utc).isoformat()
-                }).eq('id', self.driver_id).execute()
+                        print(f"   Not enough time passed for recovery (need 5s, have {time_since_last_event:.1f}s)")
+                else:
+                    # No events yet, use time since session start
+                    time_since_recovery = time.time() - self.last_score_recovery_time
+                    if time_since_recovery >= 5:
+                        recovery_points = int(time_since_recovery / 5) * 2  # 2 points per 5 seconds
+                        current_score = min(100, current_score + recovery_points)
+                        if recovery_points > 0:
+                            print(f"✨ Good driving! Safety score +{recovery_points} → {current_score}")
+
+            # Clamp score between 0 and 100
+            current_score = max(0, min(100, current_score))
+            self.safety_score = current_score
+            if self.shared_state is not None:
+                self.shared_state.publish_score(current_score)
+
+            # Update session
+            self._update('driving_sessions', {
+                'safety_score': current_score
+            }, self.session_id)
+
+            # Update driver's overall safety score
+            self._set_driver_state(
+                safety_score=current_score,
+                last_active=datetime.now(timezone.utc).isoformat()
+            )
 
         except Exception as e:
             print(f"⚠️  Error updating session score: {e}")
 
-    async def process_data(self, message: str):
-        """Process incoming driving data and save to Supabase"""
+    async def process_data(self, message: str, received_at: float = None, trace: ingest_tracing.Trace = None):
+        """Process incoming driving data and save to Supabase
+
+        Args:
+            message: One notification payload from the Arduino
+            received_at: Host time the notification arrived (defaults to now)
+            trace: Latency trace started by the notification handler (one is created if omitted)
+        """
+        trace = trace or self.tracer.start_trace(self.arduino_id, received_at)
+        with self.tracer.activate(trace):
+            await self._handle_message(message, received_at)
+
+    async def _handle_message(self, message: str, received_at: float = None):
         try:
             if message.startswith("EVENT:"):
-                # Event notification: EVENT:HARSH_BRAKE:3
-                parts = message.split(":")
-                event_type = parts[1]
-                count = int(parts[2])
+                # Event notification: EVENT:HARSH_BRAKE:3[:millis]
+                ingest_tracing.set_kind('event')
+                with span('parse'):
+                    parts = message.split(":")
+                    event_type = parts[1]
+                    count = int(parts[2])
+                    device_ms = int(parts[3]) if len(parts) > 3 else None
+                    sample_time = self.sample_time(device_ms, received_at)
                 self.event_count = count
-                self.last_event_time = time.time()
+                self.last_event_time = sample_time
+                self.control.on_event()
                 self.aggressive_events.append({
                     'type': event_type,
-                    'time': time.strftime('%H:%M:%S'),
+                    'time': time.strftime('%H:%M:%S', time.localtime(sample_time)),
                     'count': count
                 })
                 print(f"🚨 EVENT: {event_type} (Total: {count})")
 
             elif message.startswith("STATUS:"):
-                # Status update: STATUS:AGGRESSIVE:3
-                parts = message.split(":")
-                status = parts[1]
-                count = int(parts[2])
+                # Status update: STATUS:AGGRESSIVE:3[:millis]
+                ingest_tracing.set_kind('status')
+                with span('parse'):
+                    parts = message.split(":")
+                    status = parts[1]
+                    count = int(parts[2])
+                    if len(parts) > 3:
+                        self.sample_time(int(parts[3]), received_at)
                 print(f"📊 STATUS: {status} driving (Events: {count})")
 
                 # Check for score recovery (no penalty)
                 await self.update_session_score(penalty_points=0)
 
             else:
-                # Raw sensor data: ax,ay,az,event_type,count
+                # Raw sensor data: ax,ay,az,event_type,count[,millis]
+                ingest_tracing.set_kind('sample')
                 parts = message.split(",")
                 if len(parts) >= 5:
-                    x, y, z = float(parts[0]), float(parts[1]), float(parts[2])
-                    event_type = parts[3].strip()
-                    count = int(parts[4])
+                    with span('parse'):
+                        x, y, z = float(parts[0]), float(parts[1]), float(parts[2])
+                        event_type = parts[3].strip()
+                        count = int(parts[4])
+                        device_ms = int(parts[5]) if len(parts) > 5 and parts[5].strip() else None
+                        sample_time = self.sample_time(device_ms, received_at)
+
+                    # Possible crash: detected before anything else touches this sample, but
+                    # rolled up first - later samples move the window on while the write is in flight
+                    magnitude = self.impacts.check(sample_time, x, y, z)
+                    self._save_rollups(self.rollups.add(sample_time, x, y, z))
+                    if magnitude is not None:
+                        await self.handle_impact(x, y, z, magnitude, sample_time)
 
                     # Only process if there's an actual event
                     if event_type and event_type in ['SWERVING', 'HARSH_BRAKE', 'AGGRESSIVE']:
-                        current_time = time.time()
-                        time_since_last_event = current_time - self.last_event_timestamps[event_type]
+                        # Keep full resolution around the incident
+                        self.control.on_event()
+
+                        with span('cooldown'):
+                            # Cooldown is measured in sample time so queued notifications don't skew it
+                            time_since_last_event = sample_time - self.last_event_timestamps[event_type]
+                            cooled_down = time_since_last_event >= self.EVENT_COOLDOWN_SECONDS
 
                         # Only save if cooldown period has passed (prevents duplicate events)
-                        if time_since_last_event >= self.EVENT_COOLDOWN_SECONDS:
+                        if cooled_down:
                             # Update the last event timestamp
-                            self.last_event_timestamps[event_type] = current_time
+                            self.last_event_timestamps[event_type] = sample_time
+                            timestamp = datetime.fromtimestamp(sample_time, timezone.utc).isoformat()
 
                             # Save sensor reading with event data
-                            await self.save_sensor_reading(x, y, z, event_type, count)
+                            await self.save_sensor_reading(x, y, z, event_type, count, timestamp)
 
                             # Save the event
-                            await self.save_event(event_type, x, y, z, count)
+                            await self.save_event(event_type, x, y, z, count, timestamp)
+                            self.rollups.count_event(sample_time, event_type)
 
                             # Print event
                             print(f"🎯 {event_type}: X={x:.2f}, Y={y:.2f}, Z={z:.2f} (cooldown: {time_since_last_event:.1f}s)")
@@ -358,6 +637,10 @@ class SupabaseDrivingMonitor:
 
     async def end_session(self):
         """End the current driving session"""
+        if self.session_closed.is_set():
+            return
+        self.session_closed.set()
+
         try:
             print("\n🛑 Ending session and setting driver offline...")
 
@@ -368,26 +651,42 @@ class SupabaseDrivingMonitor:
             if hasattr(self, 'score_recovery_task') and self.score_recovery_task:
                 self.score_recovery_task.cancel()
                 print("   ✓ Score recovery stopped")
-            if self.session_timeout_task:
-                self.session_timeout_task.cancel()
+            if self.shared_state_task:
+                self.shared_state_task.cancel()
+            if self.shared_state is not None:
+                self.shared_state.end_session()
+            self.liveness.unregister(self.session_id)
+            await self.control.stop()
+            if self._owns_liveness:
+                await self.liveness.stop()
                 print("   ✓ Timeout monitor stopped")
 
             if self.session_id:
+                # Persist the partial windows still open
+                self._save_rollups(self.rollups.flush())
+
                 # Update session status
-                self.supabase.table('driving_sessions').update({
+                self._update('driving_sessions', {
                     'status': 'completed',
                     'ended_at': datetime.now(timezone.utc).isoformat()
-                }).eq('id', self.session_id).execute()
+                }, self.session_id)
                 print(f"   ✓ Session completed: {self.session_id}")
 
-                # Update driver status to inactive and offline
-                result = self.supabase.table('drivers').update({
-                    'status': 'inactive',
-                    'connection_status': 'offline'
-                }).eq('id', self.driver_id).execute()
+                # Update driver status to inactive and offline - the final transition goes out now
+                self._set_driver_state(status='inactive', connection_status='offline')
+                self.driver_state.flush()
+                self.driver_state.forget(self.driver_id)
                 print(f"   ✓ Driver set to OFFLINE: {self.driver_id}")
-                print(f"   ✓ Database update result: {result.data}")
 
+            # Drain the outbox before exiting; leftovers are replayed on next start
+            if self._owns_notifier:
+                await self.notifier.stop()
+            if self._owns_driver_state:
+                await self.driver_state.stop()
+            if self._owns_writer:
+                await self.writer.stop()
+
+            if self.session_id:
                 print(f"\n✅ Session ended successfully")
                 print(f"🔴 Driver is now OFFLINE")
 
@@ -395,58 +694,183 @@ class SupabaseDrivingMonitor:
             print(f"⚠️  Error ending session: {e}")
 
 
+def reconnect_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given reconnect attempt"""
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** attempt))
+    # Equal jitter: keep half the delay, randomize the rest so retries don't sync up
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def stream_with_reconnect(monitor: SupabaseDrivingMonitor, address: str, recorder=None,
+                                on_first_connect=None):
+    """Stream notifications from the Arduino, reconnecting on link loss.
+
+    The driving session stays open while the link is down. If the device does
+    not come back within RECONNECT_GRACE_SECONDS the loop returns and the
+    caller ends the session. Pass a ble_replay.NotificationRecorder to also
+    save every raw notification for later replay.
+
+    on_first_connect: coroutine function awaited once the device first
+    connects, before notifications are subscribed (e.g. to open the
+    session); returning False ends the stream.
+    """
+    disconnected = asyncio.Event()
+    ever_connected = False
+    gap_started = time.time()
+    attempt = 0
+
+    throughput = ThroughputMeter(monitor.arduino_id)
+
+    def notification_handler(sender, data):
+        received_at = time.time()
+        if not monitor.notifications_received:
+            profile.mark('first_notification')
+        if recorder:
+            recorder.record(bytes(data), received_at)
+        monitor.touch('ble')
+        messages = split_notification(data)
+        monitor.notifications_received += 1
+        monitor.messages_received += len(messages)
+        monitor.bytes_received += len(data)
+        throughput.record(len(data), len(messages))
+        for message in messages:
+            trace = monitor.tracer.start_trace(monitor.arduino_id, received_at)
+            asyncio.create_task(monitor.process_data(message, received_at=received_at, trace=trace))
+
+    def on_disconnect(client):
+        disconnected.set()
+
+    # Imported on first connect (preloaded in the background by the entry points)
+    from bleak import BleakClient
+
+    while True:
+        try:
+            async with BleakClient(address, timeout=10.0, disconnected_callback=on_disconnect) as client:
+                disconnected.clear()
+                if ever_connected:
+                    monitor.record_connection_gap(gap_started, time.time())
+                    print("✅ Reconnected to Driving Monitor!")
+                else:
+                    print("✅ Connected to Driving Monitor!")
+                    if on_first_connect is not None and not await on_first_connect():
+                        return
+                    print("📱 Receiving driving data and syncing to Supabase...")
+                    print("Press Ctrl+C to disconnect")
+                    print("-" * 50)
+                ever_connected = True
+                attempt = 0
+                profile.mark('ble_connected')
+
+                # Link settings are per connection, so they're pushed again after every reconnect
+                throughput.link = await monitor.control.attach(client)
+
+                # Only the notification subscription is re-run when the device returns
+                await client.start_notify(DRIVING_DATA_CHARACTERISTIC, notification_handler)
+                monitor.flush_pending_writes()
+
+                # Wait for link loss, or for the session to end (e.g. idle timeout)
+                link_lost = asyncio.create_task(disconnected.wait())
+                session_over = asyncio.create_task(monitor.session_closed.wait())
+                await asyncio.wait({link_lost, session_over}, return_when=asyncio.FIRST_COMPLETED)
+                link_lost.cancel()
+                session_over.cancel()
+                if monitor.session_closed.is_set():
+                    return
+                gap_started = time.time()
+                print("\n📴 BLE link lost - keeping session open while reconnecting...")
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            print(f"❌ Connection attempt failed: {e}")
+        finally:
+            # Control writes wait for the next connection
+            monitor.control.detach()
+
+        if monitor.session_closed.is_set():
+            return
+
+        elapsed = time.time() - gap_started
+        remaining = RECONNECT_GRACE_SECONDS - elapsed
+        if remaining <= 0:
+            print(f"⏱️  Device not back after {elapsed:.0f}s - giving up")
+            return
+
+        delay = min(reconnect_delay(attempt), remaining)
+        attempt += 1
+        print(f"🔄 Reconnect attempt {attempt} in {delay:.1f}s ({remaining:.0f}s of grace left)")
+        await asyncio.sleep(delay)
+
+
+async def supervisor_heartbeat(heartbeat: Heartbeat):
+    """Beat while the event loop is responsive - reconnect gaps are not a liveness failure"""
+    while True:
+        heartbeat.beat()
+        await asyncio.sleep(heartbeat.interval)
+
+
 async def main():
     # Use the Bluetooth address as Arduino ID
     arduino_id = "642B8DC2-D778-8A47-20C2-B91C64716DBF"
     print(f"Using Arduino ID: {arduino_id}")
 
-    monitor = SupabaseDrivingMonitor(arduino_id=arduino_id)
+    # Import bleak while the session is being created
+    preload('bleak')
+
+    # Shared-memory session state when started by run_monitoring.py --subprocess
+    shared_state = SharedSessionState.from_env()
+    monitor = SupabaseDrivingMonitor(arduino_id=arduino_id, shared_state=shared_state)
 
     # Initialize session
     if not await monitor.initialize_session():
         return
 
+    # Readiness/liveness for run_monitoring.py --subprocess (no-op when run on its own)
+    heartbeat = Heartbeat('ble')
+    heartbeat.ready()
+    heartbeat_task = asyncio.create_task(supervisor_heartbeat(heartbeat)) if heartbeat.enabled else None
+
     # Connect directly to the known Arduino address
     print(f"\n🔍 Connecting to Arduino...")
     driving_monitor_address = arduino_id  # The address IS the arduino_id now
 
-    try:
-        async with BleakClient(driving_monitor_address) as client:
-            print("✅ Connected to Driving Monitor!")
-            print("📱 Receiving driving data and syncing to Supabase...")
-            print("Press Ctrl+C to disconnect")
-            print("-" * 50)
-
-            def notification_handler(sender, data):
-                message = data.decode('utf-8')
-                asyncio.create_task(monitor.process_data(message))
-
-            await client.start_notify("87654321-4321-4321-4321-cba987654321", notification_handler)
-
-            try:
-                while True:
-                    await asyncio.sleep(1)
-            except (KeyboardInterrupt, asyncio.CancelledError):
-                pass  # Handle gracefully
-            finally:
-                # Always end session when exiting loop
-                print("\n📊 Summary:")
-                print(f"Total aggressive events: {monitor.event_count}")
-                if monitor.aggressive_events:
-                    print("Recent events:")
-                    for event in monitor.aggressive_events[-5:]:  # Last 5 events
-                        print(f"  - {event['time']}: {event['type']}")
-
-                await monitor.end_session()
-                print("Disconnected!")
+    # Optionally keep a raw copy of the trip for ble_replay.py
+    recorder = None
+    if os.getenv('BLE_RECORD_PATH'):
+        from ble_replay import NotificationRecorder
+        recorder = NotificationRecorder(os.getenv('BLE_RECORD_PATH'))
+        print(f"🔴 Recording notifications to {recorder.path}")
 
+    try:
+        await stream_with_reconnect(monitor, driving_monitor_address, recorder)
     except (KeyboardInterrupt, asyncio.CancelledError):
-        # Handle Ctrl+C at outer level
         print("\n⚠️  Interrupted - ending session...")
+    finally:
+        # Always end session when exiting
+        print("\n📊 Summary:")
+        print(f"Total aggressive events: {monitor.event_count}")
+        if monitor.aggressive_events:
+            print("Recent events:")
+            for event in monitor.aggressive_events[-5:]:  # Last 5 events
+                print(f"  - {event['time']}: {event['type']}")
+        if monitor.connection_gaps:
+            total_gap = sum(gap['duration'] for gap in monitor.connection_gaps)
+            print(f"Connection gaps bridged: {len(monitor.connection_gaps)} ({total_gap:.1f}s total)")
+        if monitor.clock.is_synced:
+            clock = monitor.clock.stats()
+            print(f"Device clock drift: {clock['drift_ppm']:.1f} ppm over {clock['samples']} samples")
+        for impact in monitor.impacts.impacts:
+            print(f"💥 Impact at {time.strftime('%H:%M:%S', time.localtime(impact['time']))}: {impact['peak_g']:.1f} g peak")
+
+        if heartbeat_task:
+            heartbeat_task.cancel()
         await monitor.end_session()
-    except Exception as e:
-        print(f"❌ Connection failed: {e}")
-        await monitor.end_session()
+        if recorder:
+            recorder.close()
+        monitor.tracer.print_report()
+        monitor.tracer.close()
+        if shared_state is not None:
+            shared_state.close()
+        print("Disconnected!")
 
 if __name__ == "__main__":
     asyncio.run(main())
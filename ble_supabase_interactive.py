@@ -5,7 +5,7 @@ Interactive version of ble_supabase.py - lets you choose which device to connect
 import asyncio
 import time
 from datetime import datetime
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
@@ -17,26 +17,24 @@ load_dotenv()
 import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from ble_supabase import SupabaseDrivingMonitor
+from ble_control import split_notification
+from device_registry import DeviceRegistry, BackgroundScanner
 
-async def main():
-    # Get Arduino ID from user or use default
-    arduino_id = input("Enter Arduino ID (default: ARD-001): ").strip() or "ARD-001"
-
-    monitor = SupabaseDrivingMonitor(arduino_id=arduino_id)
-
-    # Initialize session
-    if not await monitor.initialize_session():
-        return
-
+async def choose_scanned_device(registry: DeviceRegistry):
+    """Scan, list what was seen and let the user pick; returns (address, entry) or (None, None)"""
     print("\n🔍 Scanning for Bluetooth devices...")
     print("=" * 60)
 
-    # Scan for devices
-    devices = await BleakScanner.discover(timeout=10.0)
+    scan_started = time.time()
+    await BackgroundScanner(registry, inspect_unknown=False).scan_for(10.0)
+    devices = [
+        (address, entry) for address, entry in registry.devices.items()
+        if entry.get('last_seen', 0) >= scan_started
+    ]
 
     # Categorize devices
-    named_devices = [d for d in devices if d.name and d.name != "Unknown"]
-    unnamed_devices = [d for d in devices if not d.name or d.name == "Unknown"]
+    named_devices = [d for d in devices if d[1].get('name') and d[1]['name'] != "Unknown"]
+    unnamed_devices = [d for d in devices if not d[1].get('name') or d[1]['name'] == "Unknown"]
 
     print(f"\nFound {len(devices)} Bluetooth devices:\n")
 
@@ -45,19 +43,17 @@ async def main():
     if named_devices:
         print("📱 NAMED DEVICES:")
         print("-" * 60)
-        for i, device in enumerate(named_devices):
-            idx = len(all_devices) + 1
-            all_devices.append(device)
-            print(f"{idx}. {device.name} ({device.address})")
+        for address, entry in named_devices:
+            all_devices.append((address, entry))
+            print(f"{len(all_devices)}. {entry['name']} ({address})")
         print()
 
     if unnamed_devices:
         print("❓ UNNAMED DEVICES (your Arduino might be here):")
         print("-" * 60)
-        for i, device in enumerate(unnamed_devices):
-            idx = len(all_devices) + 1
-            all_devices.append(device)
-            print(f"{idx}. Unnamed ({device.address})")
+        for address, entry in unnamed_devices:
+            all_devices.append((address, entry))
+            print(f"{len(all_devices)}. Unnamed ({address})")
         print()
 
     print("=" * 60)
@@ -67,24 +63,56 @@ async def main():
         choice = input(f"\nEnter device number to connect (1-{len(all_devices)}) or 'q' to quit: ").strip()
 
         if choice.lower() == 'q':
-            await monitor.end_session()
-            return
+            return None, None
 
         try:
             device_idx = int(choice) - 1
             if 0 <= device_idx < len(all_devices):
-                selected_device = all_devices[device_idx]
-                break
+                return all_devices[device_idx]
             else:
                 print(f"❌ Please enter a number between 1 and {len(all_devices)}")
         except ValueError:
             print("❌ Invalid input. Please enter a number or 'q'")
 
-    device_name = selected_device.name if selected_device.name else "Unnamed"
-    print(f"\n✅ Connecting to: {device_name} ({selected_device.address})")
+async def main():
+    # Get Arduino ID from user or use default
+    arduino_id = input("Enter Arduino ID (default: ARD-001): ").strip() or "ARD-001"
+
+    monitor = SupabaseDrivingMonitor(arduino_id=arduino_id)
+
+    # Initialize session
+    if not await monitor.initialize_session():
+        return
+
+    # Offer devices from the registry cache first - connecting to a known Arduino needs no scan
+    registry = DeviceRegistry()
+    known = registry.known_arduinos()
+    selected_address = None
+
+    if known:
+        print("\n⚡ KNOWN ARDUINOS (from device registry):")
+        print("-" * 60)
+        for i, (address, entry) in enumerate(known, 1):
+            print(f"{i}. {entry.get('name', 'Unnamed')} ({address}) RSSI {entry.get('rssi', '?')}")
+
+        choice = input(f"\nEnter device number (1-{len(known)}), Enter for 1, or 's' to scan: ").strip()
+        if choice.lower() != 's':
+            try:
+                selected_address, selected_entry = known[int(choice or 1) - 1]
+            except (ValueError, IndexError):
+                print("❌ Invalid choice - scanning instead")
+
+    if selected_address is None:
+        selected_address, selected_entry = await choose_scanned_device(registry)
+        if selected_address is None:
+            await monitor.end_session()
+            return
+
+    device_name = selected_entry.get('name') or "Unnamed"
+    print(f"\n✅ Connecting to: {device_name} ({selected_address})")
 
     try:
-        async with BleakClient(selected_device.address, timeout=10.0) as client:
+        async with BleakClient(selected_address, timeout=10.0) as client:
             print("✅ Connected!")
 
             # Show available services
@@ -104,6 +132,10 @@ async def main():
                         print(f"\n🎯 Found driving monitor characteristic!")
                         break
 
+            if char_found:
+                # Remember the address -> Arduino ID mapping for instant startup next time
+                registry.merge({selected_address: {'arduino_id': arduino_id, 'is_arduino': True}})
+
             if not char_found:
                 print(f"\n⚠️  WARNING: Characteristic {target_char} not found!")
                 print("This device might not be your Arduino, or it's using a different UUID.")
@@ -117,8 +149,9 @@ async def main():
             print("-" * 50)
 
             def notification_handler(sender, data):
-                message = data.decode('utf-8')
-                asyncio.create_task(monitor.process_data(message))
+                received_at = time.time()
+                for message in split_notification(data):
+                    asyncio.create_task(monitor.process_data(message, received_at=received_at))
 
             # Try to start notifications
             try:
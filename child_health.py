@@ -0,0 +1,176 @@
+"""
+Health probes and restart policy for the monitoring pipelines
+run_monitoring.py watches each pipeline with two probes:
+
+    readiness   the pipeline can do its job (BLE: session created,
+                camera: camera open and session found)
+    liveness    the pipeline is still making progress (BLE: event loop
+                responsive, camera: frames being processed)
+
+In --subprocess mode the children report over their stdout pipe with
+protocol lines the supervisor swallows instead of printing:
+
+    @@READY <component>
+    @@HEARTBEAT <component>
+
+They are only printed when MONITORING_SUPERVISED=1 (set by the runner),
+so the scripts behave the same when started on their own. In-process the
+camera thread reports through a callback instead.
+
+A camera that exits, never becomes ready or stops beating is restarted
+with exponential backoff while BLE carries on alone; the session is never
+closed for it. BLE owns the session, so BLE exiting still ends the trip.
+"""
+import os
+import random
+import time
+
+HEARTBEAT_SECONDS = float(os.getenv('CHILD_HEARTBEAT_SECONDS', 2))
+# No heartbeat for this long means the component is stuck
+LIVENESS_TIMEOUT_SECONDS = float(os.getenv('CHILD_LIVENESS_TIMEOUT_SECONDS', 15))
+# Not ready this long after (re)start means it won't be
+READINESS_TIMEOUT_SECONDS = float(os.getenv('CHILD_READINESS_TIMEOUT_SECONDS', 30))
+RESTART_BASE_DELAY = float(os.getenv('CHILD_RESTART_BASE_DELAY', 2))
+RESTART_MAX_DELAY = float(os.getenv('CHILD_RESTART_MAX_DELAY', 120))
+# Backoff starts over once a restarted component has stayed ready this long
+RESTART_RESET_SECONDS = float(os.getenv('CHILD_RESTART_RESET_SECONDS', 60))
+
+SUPERVISED = os.getenv('MONITORING_SUPERVISED') == '1'
+PROBE_PREFIX = '@@'
+READY, HEARTBEAT = 'READY', 'HEARTBEAT'
+
+
+def parse_probe(line: str):
+    """(kind, component) for a probe line, else None"""
+    if not line.startswith(PROBE_PREFIX):
+        return None
+    parts = line[len(PROBE_PREFIX):].split()
+    if len(parts) == 2 and parts[0] in (READY, HEARTBEAT):
+        return parts[0], parts[1]
+    return None
+
+
+class Heartbeat:
+    """Child side: report readiness and progress to the supervisor.
+
+    Without a sink, probes go to stdout (only when supervised); with one,
+    sink(kind) is called directly (in-process, from any thread).
+    """
+
+    def __init__(self, component: str, sink=None, interval: float = HEARTBEAT_SECONDS):
+        self.component = component
+        self.sink = sink
+        self.interval = interval
+        self.enabled = sink is not None or SUPERVISED
+        self._last_beat = 0.0
+
+    def _send(self, kind: str):
+        if self.sink is not None:
+            self.sink(kind)
+        else:
+            print(f"{PROBE_PREFIX}{kind} {self.component}", flush=True)
+
+    def ready(self):
+        if self.enabled:
+            self._send(READY)
+            self._last_beat = time.monotonic()
+
+    def beat(self):
+        """Called on every unit of progress; sends at most one heartbeat per interval"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self._last_beat >= self.interval:
+            self._last_beat = now
+            self._send(HEARTBEAT)
+
+
+class RestartPolicy:
+    """Exponential backoff with jitter between restarts of one component"""
+
+    def __init__(self, base_delay: float = RESTART_BASE_DELAY, max_delay: float = RESTART_MAX_DELAY,
+                 reset_after: float = RESTART_RESET_SECONDS):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reset_after = reset_after
+        self.failures = 0
+
+    def next_delay(self) -> float:
+        """Delay before the next restart; each call counts one more failure"""
+        delay = min(self.max_delay, self.base_delay * (2 ** self.failures))
+        self.failures += 1
+        # Equal jitter, same as the BLE reconnect backoff
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def healthy_for(self, seconds: float):
+        if seconds >= self.reset_after:
+            self.failures = 0
+
+
+class ComponentHealth:
+    """Supervisor side: probe state of one component.
+
+    States: starting -> ready, and down (waiting for a restart) after a
+    failure. All times are time.monotonic().
+    """
+
+    def __init__(self, component: str, policy: RestartPolicy = None,
+                 liveness_timeout: float = LIVENESS_TIMEOUT_SECONDS,
+                 readiness_timeout: float = READINESS_TIMEOUT_SECONDS):
+        self.component = component
+        self.policy = policy or RestartPolicy()
+        self.liveness_timeout = liveness_timeout
+        self.readiness_timeout = readiness_timeout
+        self.state = 'down'
+        self.started_at = None
+        self.ready_at = None
+        self.last_heartbeat = None
+        self.restart_at = None
+        # Stats
+        self.starts = 0
+        self.failures = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def on_start(self):
+        now = time.monotonic()
+        self.state = 'starting'
+        self.started_at = now
+        self.ready_at = None
+        self.last_heartbeat = now
+        self.restart_at = None
+        self.starts += 1
+
+    def on_probe(self, kind: str):
+        """Probe from the component (subprocess line or in-process callback)"""
+        now = time.monotonic()
+        self.last_heartbeat = now
+        if kind == READY and self.state == 'starting':
+            self.state = 'ready'
+            self.ready_at = now
+        elif self.ready:
+            self.policy.healthy_for(now - self.ready_at)
+
+    def check(self):
+        """Why the running component should be considered failed, or None"""
+        if self.state == 'down':
+            return None
+        now = time.monotonic()
+        if self.state == 'starting' and now - self.started_at > self.readiness_timeout:
+            return f"not ready after {self.readiness_timeout:.0f}s"
+        if now - self.last_heartbeat > self.liveness_timeout:
+            return f"no heartbeat for {now - self.last_heartbeat:.0f}s"
+        return None
+
+    def on_failure(self) -> float:
+        """Mark the component down and schedule its restart; returns the delay"""
+        delay = self.policy.next_delay()
+        self.state = 'down'
+        self.failures += 1
+        self.restart_at = time.monotonic() + delay
+        return delay
+
+    def restart_due(self) -> bool:
+        return self.state == 'down' and self.restart_at is not None and time.monotonic() >= self.restart_at
@@ -0,0 +1,131 @@
+"""
+Device clock synchronization
+Maps the Arduino's millis() counter onto host UTC time.
+
+Every notification gives one (device_ms, host receive time) pair. The
+host time is always the device time plus an unknown offset plus a
+positive transport/queueing delay, so the *lowest* observed difference is
+the best estimate of the offset. We keep the minimum per time bucket and
+fit a line through the bucket minima to also track crystal drift.
+
+A reboot restarts millis() from zero. When the counter goes far backwards
+that is obvious; when it lands close to the last value it looks like
+reordering, so a sample whose host-minus-device difference jumps well
+above the current estimate (the device "lost" time) also resets the model.
+"""
+import os
+import time
+from datetime import datetime, timezone
+
+BUCKET_SECONDS = float(os.getenv('CLOCK_SYNC_BUCKET_SECONDS', 10))
+MAX_BUCKETS = int(os.getenv('CLOCK_SYNC_MAX_BUCKETS', 60))
+
+# millis() is an unsigned 32-bit counter and wraps after ~49.7 days
+MILLIS_WRAP = 2 ** 32
+
+# A counter going backwards by more than this means the device rebooted
+REORDER_TOLERANCE_MS = 5000
+# A difference this far above the estimated offset means the device restarted
+REBOOT_OFFSET_JUMP_SECONDS = float(os.getenv('CLOCK_SYNC_REBOOT_JUMP_SECONDS', 2))
+
+
+class ClockSync:
+    """Running offset and drift estimate for one device clock"""
+
+    def __init__(self, bucket_seconds: float = BUCKET_SECONDS, max_buckets: int = MAX_BUCKETS):
+        self.bucket_seconds = bucket_seconds
+        self.max_buckets = max_buckets
+        self.reset()
+
+    def reset(self):
+        """Forget the model (called when the device reboots)"""
+        self.buckets = {}
+        self.offset = None
+        self.drift = 0.0
+        self.samples = 0
+        self.resets = getattr(self, 'resets', -1) + 1
+        self._wraps = 0
+        self._last_raw_ms = None
+
+    def _unwrap(self, device_ms: int) -> float:
+        """Device time in seconds, continuous across millis() wrap-around"""
+        if self._last_raw_ms is not None and device_ms < self._last_raw_ms:
+            if self._last_raw_ms - device_ms > MILLIS_WRAP // 2:
+                self._wraps += 1
+            elif self._last_raw_ms - device_ms <= REORDER_TOLERANCE_MS:
+                # Slightly out-of-order delivery, not a restart
+                return (device_ms + self._wraps * MILLIS_WRAP) / 1000.0
+            else:
+                # Counter went backwards without wrapping - the device restarted
+                print("⏱️  Device clock restarted - resetting clock sync")
+                self.reset()
+        self._last_raw_ms = device_ms
+        return (device_ms + self._wraps * MILLIS_WRAP) / 1000.0
+
+    def observe(self, device_ms: int, host_time: float = None):
+        """Record one sample received at host_time (epoch seconds)"""
+        host_time = time.time() if host_time is None else host_time
+        device_seconds = self._unwrap(device_ms)
+        difference = host_time - device_seconds
+        if self.offset is not None and difference - self._predicted_offset(device_seconds) > REBOOT_OFFSET_JUMP_SECONDS:
+            # Transport delay only ever adds a little; the device clock restarted
+            print("⏱️  Device clock jumped back against host time - resetting clock sync")
+            self.reset()
+            device_seconds = self._unwrap(device_ms)
+            difference = host_time - device_seconds
+
+        bucket = int(device_seconds // self.bucket_seconds)
+        best = self.buckets.get(bucket)
+        if best is None or difference < best[1]:
+            self.buckets[bucket] = (device_seconds, difference)
+
+        if len(self.buckets) > self.max_buckets:
+            for old in sorted(self.buckets)[:len(self.buckets) - self.max_buckets]:
+                del self.buckets[old]
+
+        self.samples += 1
+        self._fit()
+
+    def _fit(self):
+        """Least-squares line through the per-bucket minimum differences"""
+        points = list(self.buckets.values())
+        if len(points) < 2:
+            self.drift = 0.0
+            self.offset = points[0][1]
+            self._anchor = points[0][0]
+            return
+
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        if var_x == 0:
+            self.drift = 0.0
+        else:
+            self.drift = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+        self.offset = mean_y
+        self._anchor = mean_x
+
+    def _predicted_offset(self, device_seconds: float) -> float:
+        return self.offset + self.drift * (device_seconds - self._anchor)
+
+    def to_host_time(self, device_ms: int) -> float:
+        """Host epoch seconds at which the device took the sample"""
+        device_seconds = (device_ms + self._wraps * MILLIS_WRAP) / 1000.0
+        return device_seconds + self._predicted_offset(device_seconds)
+
+    def to_utc(self, device_ms: int) -> datetime:
+        return datetime.fromtimestamp(self.to_host_time(device_ms), timezone.utc)
+
+    @property
+    def is_synced(self) -> bool:
+        return self.offset is not None
+
+    def stats(self) -> dict:
+        return {
+            'offset_seconds': self.offset,
+            'drift_ppm': self.drift * 1e6,
+            'samples': self.samples,
+            'buckets': len(self.buckets),
+            'resets': self.resets
+        }
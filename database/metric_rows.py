@@ -0,0 +1,78 @@
+"""Metric payloads shared by the Flask and ASGI ingest servers."""
+import json
+import math
+from datetime import datetime, timezone
+
+# Numeric columns of DrivingMetric and the type each value is coerced to
+NUMERIC_FIELDS = {
+    'speed': float,
+    'acceleration': float,
+    'latitude': float,
+    'longitude': float,
+    'heading': float,
+    'rpm': int,
+    'fuel_level': float,
+    'engine_temp': float
+}
+
+
+def _number(data: dict, field: str, default=None):
+    """A numeric field coerced to its column type; ValueError if it isn't a finite number."""
+    value = data.get(field, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'{field} must be a number')
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f'{field} must be a number') from None
+    if not math.isfinite(number):
+        raise ValueError(f'{field} must be a finite number')
+    return NUMERIC_FIELDS[field](number)
+
+
+def metric_row(data: dict, received_at: datetime) -> dict:
+    """Column values of a DrivingMetric from one submitted metric.
+
+    Raises ValueError for a bad timestamp or a non-numeric value, so a row
+    is rejected by the handler rather than failing a later commit.
+    """
+    timestamp = received_at
+    if data.get('timestamp'):
+        # Buffered uploads carry the time each sample was taken
+        timestamp = datetime.fromisoformat(str(data['timestamp']).replace('Z', '+00:00'))
+        if timestamp.tzinfo is not None:
+            # Stored as naive UTC, like received_at
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        'session_id': data['session_id'],
+        'timestamp': timestamp,
+        'speed': _number(data, 'speed', 0.0),
+        'acceleration': _number(data, 'acceleration', 0.0),
+        'latitude': _number(data, 'latitude'),
+        'longitude': _number(data, 'longitude'),
+        'heading': _number(data, 'heading'),
+        'rpm': _number(data, 'rpm'),
+        'fuel_level': _number(data, 'fuel_level'),
+        'engine_temp': _number(data, 'engine_temp')
+    }
+
+
+def distance_increment(row: dict) -> float:
+    """Distance a metric row (from metric_row) adds to its session (only when GPS data is present)."""
+    if row.get('latitude') and row.get('longitude'):
+        # Simple distance calculation (you'd want to use proper GPS distance in production)
+        # This is a placeholder - implement haversine formula for accurate distance
+        return (row.get('speed') or 0) / 3600  # rough estimate
+    return 0.0
+
+
+def parse_metrics(body: str) -> list:
+    """Metrics from a JSON array or an NDJSON stream (one JSON object per line)."""
+    body = body.strip()
+    if not body:
+        return []
+    if body.startswith('['):
+        return json.loads(body)
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
@@ -0,0 +1,198 @@
+"""Write-behind group commit for driving metrics."""
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from database.models import DrivingMetric, DrivingSession
+
+# Commit once this many rows are queued...
+GROUP_COMMIT_ROWS = int(os.getenv('API_WRITE_BEHIND_ROWS', 500))
+# ...or when the oldest queued row is this old: the window in which accepted rows live only in memory
+GROUP_COMMIT_MS = float(os.getenv('API_WRITE_BEHIND_MS', 50))
+# Queued rows beyond which handlers refuse new metrics (503) instead of growing memory
+MAX_QUEUED_ROWS = int(os.getenv('API_WRITE_BEHIND_MAX_QUEUE', 50000))
+COMMIT_ATTEMPTS = 3
+
+
+class GroupCommitWriter:
+    """Background thread that commits queued metric rows in groups.
+
+    Handlers enqueue() validated rows and answer right away; the writer
+    inserts everything queued (and the sessions' distance increments) in
+    one transaction every `batch_size` rows or `window_ms` milliseconds,
+    so SQLite pays one fsync per group instead of one per data point.
+
+    Operational errors (database locked, disk) retry the whole group. Any
+    other failure splits the group until the rows that can't be stored are
+    isolated; only those are dropped and counted.
+    """
+
+    def __init__(self, database, batch_size: int = GROUP_COMMIT_ROWS, window_ms: float = GROUP_COMMIT_MS,
+                 max_queued: int = MAX_QUEUED_ROWS):
+        self.database = database
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self.max_queued = max_queued
+        self._rows = []
+        # Distance each queued row adds to its session, parallel to _rows
+        self._increments = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        # enqueue() calls handed out / fully committed (or dropped), for flush()
+        self._enqueued = 0
+        self._done = 0
+
+        # Stats
+        self.rows_committed = 0
+        self.commits = 0
+        self.rows_dropped = 0
+        self._latencies = deque(maxlen=1000)
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='metric-writer', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, rows: list, increments: list = None) -> bool:
+        """Queue rows (and the distance each adds to its session); False when the queue is full."""
+        with self._condition:
+            if self._stopping or len(self._rows) + len(rows) > self.max_queued:
+                return False
+            self._rows.extend(rows)
+            self._increments.extend(increments or [0.0] * len(rows))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._enqueued += 1
+            if len(self._rows) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is committed, e.g. before a session ends."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            target = self._enqueued
+            self._oldest = time.monotonic() - self.window if self._rows else self._oldest
+            self._condition.notify_all()
+            while self._done < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """Drain the queue and stop the writer thread (registered with atexit by the API)."""
+        with self._condition:
+            thread = self._thread
+            self._stopping = True
+            self._condition.notify_all()
+        if thread is None:
+            return
+        thread.join(timeout)
+        self._thread = None
+        with self._condition:
+            left = len(self._rows)
+        if left:
+            print(f"⚠️  Metric writer stopped with {left} row(s) not committed")
+        else:
+            print(f"💾 Metric writer drained: {self.rows_committed} rows in {self.commits} commits")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._due():
+                    if self._stopping and not self._rows:
+                        return
+                    wait = None if self._oldest is None else self._oldest + self.window - time.monotonic()
+                    self._condition.wait(wait)
+                rows, increments, calls = self._rows, self._increments, self._enqueued - self._done
+                self._rows, self._increments, self._oldest = [], [], None
+
+            self._commit(rows, increments)
+
+            with self._condition:
+                self._done += calls
+                self._condition.notify_all()
+
+    def _due(self) -> bool:
+        if not self._rows:
+            return False
+        return (self._stopping or len(self._rows) >= self.batch_size
+                or time.monotonic() - self._oldest >= self.window)
+
+    def _commit(self, rows: list, increments: list):
+        for attempt in range(1, COMMIT_ATTEMPTS + 1):
+            started = time.perf_counter()
+            try:
+                self._write(rows, increments)
+            except OperationalError as e:
+                print(f"⚠️  Group commit of {len(rows)} metric(s) failed (attempt {attempt}): {e}")
+                time.sleep(self.window * attempt)
+                continue
+            except Exception as e:
+                if len(rows) == 1:
+                    self._drop(rows, f"can't be stored: {e}")
+                    return
+                # Some row is bad - split so the rest of the group still lands
+                middle = len(rows) // 2
+                self._commit(rows[:middle], increments[:middle])
+                self._commit(rows[middle:], increments[middle:])
+                return
+
+            with self._condition:
+                self._latencies.append(time.perf_counter() - started)
+                self.rows_committed += len(rows)
+                self.commits += 1
+            return
+
+        self._drop(rows, f"after {COMMIT_ATTEMPTS} failed commits")
+
+    def _write(self, rows: list, increments: list):
+        distances = {}
+        for row, increment in zip(rows, increments):
+            if increment:
+                distances[row['session_id']] = distances.get(row['session_id'], 0.0) + increment
+
+        db_session = self.database.get_session()
+        try:
+            db_session.execute(insert(DrivingMetric), rows)
+            for session_id, distance in distances.items():
+                db_session.query(DrivingSession).filter_by(id=session_id).update(
+                    {DrivingSession.distance: DrivingSession.distance + distance},
+                    synchronize_session=False
+                )
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+    def _drop(self, rows: list, reason: str):
+        with self._condition:
+            self.rows_dropped += len(rows)
+        print(f"❌ Dropped {len(rows)} metric(s) {reason}")
+
+    def stats(self) -> dict:
+        with self._condition:
+            latencies = sorted(self._latencies)
+            return {
+                'queue_depth': len(self._rows),
+                'rows_committed': self.rows_committed,
+                'commits': self.commits,
+                'rows_dropped': self.rows_dropped,
+                'rows_per_commit': round(self.rows_committed / self.commits, 1) if self.commits else None,
+                'commit_latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+                'commit_latency_max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+                'window_ms': self.window * 1000,
+                'batch_size': self.batch_size
+            }
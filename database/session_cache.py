@@ -0,0 +1,99 @@
+"""In-process cache of active driving session IDs."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Set
+
+ACTIVE_SESSION_CACHE_TTL = float(os.getenv('ACTIVE_SESSION_CACHE_TTL', 30))
+ACTIVE_SESSION_CACHE_SIZE = int(os.getenv('ACTIVE_SESSION_CACHE_SIZE', 10000))
+
+
+class ActiveSessionCache:
+    """Thread-safe TTL/LRU set of session IDs known to be active.
+
+    Only positive answers are cached: an unknown or inactive ID always goes
+    to the loader. start_session/end_session keep this process exact; the
+    TTL bounds how long a session ended by another process can still be
+    accepted here.
+    """
+
+    def __init__(self, ttl: float = ACTIVE_SESSION_CACHE_TTL, max_size: int = ACTIVE_SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(session_id) -> str:
+        # Request bodies may send the ID as a number or a string
+        return str(session_id)
+
+    def get_active(self, session_ids: Iterable, load: Callable[[list], Iterable]) -> Set:
+        """The subset of `session_ids` that is active.
+
+        `load(ids)` is only called for IDs not cached and returns the active ones.
+        """
+        active, missing = self.lookup(session_ids)
+        if missing:
+            active |= self.add_loaded(missing, load(missing))
+        return active
+
+    def lookup(self, session_ids: Iterable):
+        """(cached active IDs, IDs to load) - for callers whose loader is async."""
+        now = time.monotonic()
+        active, missing = set(), []
+        with self._lock:
+            for session_id in session_ids:
+                key = self._key(session_id)
+                expires = self._expires.get(key)
+                if expires is not None and expires > now:
+                    self._expires.move_to_end(key)
+                    active.add(session_id)
+                    self.hits += 1
+                else:
+                    missing.append(session_id)
+                    self.misses += 1
+        return active, missing
+
+    def add_loaded(self, missing: list, loaded: Iterable) -> Set:
+        """Cache the loader's answer for `missing`; returns the active ones as requested."""
+        loaded = {self._key(session_id) for session_id in loaded}
+        now = time.monotonic()
+        active = set()
+        with self._lock:
+            for session_id in missing:
+                key = self._key(session_id)
+                if key in loaded:
+                    self._store(key, now)
+                    active.add(session_id)
+        return active
+
+    def is_active(self, session_id, load: Callable[[list], Iterable]) -> bool:
+        return bool(self.get_active([session_id], load))
+
+    def add(self, session_id):
+        """A session was started (or found active) by this process."""
+        with self._lock:
+            self._store(self._key(session_id), time.monotonic())
+
+    def invalidate(self, session_id):
+        """A session was ended by this process."""
+        with self._lock:
+            self._expires.pop(self._key(session_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._expires.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._expires), 'hits': self.hits, 'misses': self.misses}
+
+    def _store(self, key: str, now: float):
+        self._expires[key] = now + self.ttl
+        self._expires.move_to_end(key)
+        while len(self._expires) > self.max_size:
+            self._expires.popitem(last=False)
@@ -0,0 +1,271 @@
+"""
+BLE device registry and scan cache
+Persists every BLE device we've seen - address, Arduino ID, services,
+last RSSI and last-seen time - so scripts can connect to a known Arduino
+immediately instead of running a full scan first.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+REGISTRY_PATH = os.getenv('BLE_REGISTRY_PATH', 'ble_devices.json')
+
+# UUIDs from driving_monitor.ino
+DRIVING_SERVICE_UUID = "12345678-1234-1234-1234-123456789abc"
+DRIVING_DATA_CHARACTERISTIC = "87654321-4321-4321-4321-cba987654321"
+
+# Sightings are written to disk at most this often
+SAVE_INTERVAL_SECONDS = float(os.getenv('BLE_REGISTRY_SAVE_INTERVAL', 5))
+# Unknown devices inspected in parallel (each needs its own connection)
+MAX_CONCURRENT_INSPECTIONS = int(os.getenv('BLE_MAX_CONCURRENT_INSPECTIONS', 3))
+
+
+class DeviceRegistry:
+    """JSON-file registry keyed by BLE address.
+
+    Entries look like:
+        {"arduino_id": ..., "enabled": true, "name": ..., "rssi": -60,
+         "last_seen": 1700000000.0, "services": [...], "is_arduino": true}
+
+    `enabled` marks devices the hub should connect to; devices the scanner
+    merely saw are cached with enabled=false. The file is re-read whenever
+    it changes on disk, so devices can be added or removed while the hub runs.
+    """
+
+    def __init__(self, path: str = REGISTRY_PATH):
+        self.path = path
+        self.devices = {}
+        self._mtime = None
+        self.load()
+
+    def load(self):
+        """Load the registry from disk (empty if the file doesn't exist yet)"""
+        if not os.path.exists(self.path):
+            self.devices = {}
+            self._mtime = None
+            return
+
+        with open(self.path) as f:
+            self.devices = json.load(f).get('devices', {})
+        self._mtime = os.path.getmtime(self.path)
+
+    def reload_if_changed(self) -> bool:
+        """Re-read the file if it was modified; returns True when it was"""
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self._mtime:
+            return False
+        self.load()
+        return True
+
+    def save(self):
+        """Write the registry atomically so a running hub never sees a partial file"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'devices': self.devices}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    def merge(self, updates: dict):
+        """Apply per-address field updates on top of the latest file and save.
+
+        Re-reading first keeps edits made by other processes (e.g. the CLI
+        adding a device while the scanner runs).
+        """
+        self.reload_if_changed()
+        for address, fields in updates.items():
+            entry = self.devices.setdefault(address, {'enabled': False})
+            entry.update(fields)
+        self.save()
+
+    def add(self, address: str, arduino_id: str = None):
+        """Register a device; the Arduino ID defaults to the BLE address"""
+        self.reload_if_changed()
+        entry = self.devices.setdefault(address, {})
+        entry['arduino_id'] = arduino_id or entry.get('arduino_id') or address
+        entry['enabled'] = True
+        self.save()
+
+    def remove(self, address: str) -> bool:
+        """Unregister a device; returns False if it wasn't registered"""
+        self.reload_if_changed()
+        if address not in self.devices:
+            return False
+        del self.devices[address]
+        self.save()
+        return True
+
+    def enabled_devices(self) -> dict:
+        """Address -> Arduino ID for every device the hub should connect to"""
+        return {
+            address: entry.get('arduino_id', address)
+            for address, entry in self.devices.items()
+            if entry.get('enabled', True)
+        }
+
+    def known_arduinos(self, max_age: float = None) -> list:
+        """(address, entry) for devices identified as Arduinos, most recently seen first"""
+        now = time.time()
+        arduinos = [
+            (address, entry) for address, entry in self.devices.items()
+            if entry.get('is_arduino')
+            and (max_age is None or now - entry.get('last_seen', 0) <= max_age)
+        ]
+        return sorted(arduinos, key=lambda item: item[1].get('last_seen', 0), reverse=True)
+
+    def needs_inspection(self, address: str) -> bool:
+        """True if we've never looked at this device's services"""
+        return 'services' not in self.devices.get(address, {})
+
+
+class BackgroundScanner:
+    """Keeps the registry current from a continuously running BleakScanner.
+
+    Every advertisement updates name/RSSI/last-seen. Devices advertising the
+    driving service are marked as Arduinos straight away; other unknown
+    devices are connected to and inspected concurrently (bounded by
+    MAX_CONCURRENT_INSPECTIONS) so their services are cached for next time.
+    """
+
+    def __init__(self, registry: DeviceRegistry, inspect_unknown: bool = True):
+        self.registry = registry
+        self.inspect_unknown = inspect_unknown
+        self.pending = {}
+        self.inspecting = set()
+        self.inspection_tasks = set()
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_INSPECTIONS)
+        self._scanner = None
+        self._save_task = None
+
+    def on_advertisement(self, device, advertisement_data):
+        service_uuids = [uuid.lower() for uuid in (advertisement_data.service_uuids or [])]
+        update = self.pending.setdefault(device.address, {})
+        update['last_seen'] = time.time()
+        update['rssi'] = advertisement_data.rssi
+        if device.name:
+            update['name'] = device.name
+        if DRIVING_SERVICE_UUID in service_uuids:
+            update['is_arduino'] = True
+
+        if (self.inspect_unknown
+                and device.address not in self.inspecting
+                and self.registry.needs_inspection(device.address)):
+            self.inspecting.add(device.address)
+            task = asyncio.create_task(self.inspect(device))
+            self.inspection_tasks.add(task)
+            task.add_done_callback(self.inspection_tasks.discard)
+
+    async def inspect(self, device):
+        """Connect once to cache the device's services"""
+        from bleak import BleakClient
+
+        async with self._semaphore:
+            try:
+                async with BleakClient(device, timeout=3.0) as client:
+                    services = [str(service.uuid).lower() for service in client.services]
+                    characteristics = [
+                        str(char.uuid).lower()
+                        for service in client.services
+                        for char in service.characteristics
+                    ]
+                update = self.pending.setdefault(device.address, {})
+                update['services'] = services
+                update['is_arduino'] = DRIVING_DATA_CHARACTERISTIC in characteristics
+                if update['is_arduino']:
+                    print(f"⭐ Identified Arduino at {device.address}")
+            except Exception:
+                # Not connectable - remember that so we don't retry on every advertisement
+                self.pending.setdefault(device.address, {})['services'] = []
+
+    def flush(self):
+        """Persist accumulated sightings"""
+        if not self.pending:
+            return
+        updates, self.pending = self.pending, {}
+        self.registry.merge(updates)
+
+    async def save_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(SAVE_INTERVAL_SECONDS)
+                self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def start(self):
+        from bleak import BleakScanner
+
+        self._scanner = BleakScanner(detection_callback=self.on_advertisement)
+        await self._scanner.start()
+        self._save_task = asyncio.create_task(self.save_loop())
+
+    async def stop(self):
+        if self._scanner:
+            await self._scanner.stop()
+        if self._save_task:
+            self._save_task.cancel()
+        if self.inspection_tasks:
+            await asyncio.gather(*self.inspection_tasks, return_exceptions=True)
+        self.flush()
+
+    async def scan_for(self, seconds: float):
+        """Run the scanner for a fixed time (for one-shot scripts)"""
+        await self.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await self.stop()
+
+
+async def find_known_arduino(registry: DeviceRegistry = None, scan_seconds: float = 5.0):
+    """Address of the most recently seen Arduino, scanning only on a cache miss"""
+    registry = registry or DeviceRegistry()
+    known = registry.known_arduinos()
+    if known:
+        return known[0][0]
+
+    await BackgroundScanner(registry).scan_for(scan_seconds)
+    known = registry.known_arduinos()
+    return known[0][0] if known else None
+
+
+def main():
+    registry = DeviceRegistry()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+
+    if command == 'add' and len(sys.argv) > 2:
+        address = sys.argv[2]
+        arduino_id = sys.argv[3] if len(sys.argv) > 3 else None
+        registry.add(address, arduino_id)
+        print(f"✅ Registered {address} → {registry.devices[address]['arduino_id']}")
+    elif command == 'remove' and len(sys.argv) > 2:
+        if registry.remove(sys.argv[2]):
+            print(f"✅ Removed {sys.argv[2]}")
+        else:
+            print(f"❌ {sys.argv[2]} is not registered")
+    elif command == 'scan':
+        # Keep the cache warm: python3 device_registry.py scan [seconds]
+        seconds = float(sys.argv[2]) if len(sys.argv) > 2 else float('inf')
+        print(f"🔍 Background scanning into {registry.path} (Ctrl+C to stop)...")
+        try:
+            asyncio.run(BackgroundScanner(registry).scan_for(seconds))
+        except KeyboardInterrupt:
+            pass
+        print(f"✅ {len(registry.devices)} device(s) cached, {len(registry.known_arduinos())} Arduino(s)")
+    elif command == 'list':
+        if not registry.devices:
+            print("No devices registered")
+        now = time.time()
+        for address, entry in registry.devices.items():
+            state = "enabled" if entry.get('enabled', True) else "cached"
+            marker = "⭐ " if entry.get('is_arduino') else ""
+            seen = f"{now - entry['last_seen']:.0f}s ago" if 'last_seen' in entry else "never seen"
+            print(f"{marker}{address}  {entry.get('arduino_id', entry.get('name', '-'))}  "
+                  f"RSSI {entry.get('rssi', '?')}  {seen}  ({state})")
+    else:
+        print("Usage: python3 device_registry.py [list | scan [seconds] | add <address> [arduino_id] | remove <address>]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Coalesced driver-state writer
+Merges changes to `drivers` rows (heartbeat, score, status, ...) and
+emits at most one UPDATE per driver per tick, skipping values that
+haven't changed since they were last written.
+"""
+import asyncio
+import os
+import time
+
+TICK_SECONDS = float(os.getenv('DRIVER_STATE_TICK_SECONDS', 5))
+# Liveness timestamps only need refreshing this often on their own;
+# they're always included when another field is written anyway
+TIMESTAMP_REFRESH_SECONDS = float(os.getenv('DRIVER_STATE_TIMESTAMP_REFRESH_SECONDS', 10))
+TIMESTAMP_FIELDS = ('last_heartbeat', 'last_active')
+
+
+class DriverStateWriter:
+    """Per-driver pending field changes, flushed once per tick.
+
+    `writer` is anything with update(table, fields, match, session_id):
+    a BatchedWriter in the async pipelines or an Outbox in sync code.
+    """
+
+    def __init__(self, writer, tick_seconds: float = TICK_SECONDS):
+        self.writer = writer
+        self.tick_seconds = tick_seconds
+        self.pending = {}
+        self.written = {}
+        self.session_ids = {}
+        self.flush_task = None
+        self._last_flush = 0.0
+
+        # Stats
+        self.updates_emitted = 0
+        self.changes_received = 0
+        self.changes_suppressed = 0
+
+    def set(self, driver_id: str, session_id: str = None, **fields):
+        """Record new values for a driver; later calls in the same tick win"""
+        if not driver_id:
+            return
+        self.pending.setdefault(driver_id, {}).update(fields)
+        self.changes_received += len(fields)
+        if session_id:
+            self.session_ids[driver_id] = session_id
+
+    def _changed_fields(self, driver_id: str, fields: dict, now: float) -> dict:
+        written = self.written.setdefault(driver_id, {})
+        changed = {
+            name: value for name, value in fields.items()
+            if name not in TIMESTAMP_FIELDS and written.get(name, (None, 0))[0] != value
+        }
+
+        for name in TIMESTAMP_FIELDS:
+            if name not in fields:
+                continue
+            last_written_at = written.get(name, (None, 0))[1]
+            if changed or now - last_written_at >= TIMESTAMP_REFRESH_SECONDS:
+                changed[name] = fields[name]
+
+        self.changes_suppressed += len(fields) - len(changed)
+        return changed
+
+    def flush(self):
+        """Emit one UPDATE per driver with pending changes"""
+        now = time.time()
+        pending, self.pending = self.pending, {}
+        self._last_flush = now
+
+        for driver_id, fields in pending.items():
+            changed = self._changed_fields(driver_id, fields, now)
+
+            # Timestamps held back by the refresh interval are retried next tick
+            deferred = {name: fields[name] for name in TIMESTAMP_FIELDS if name in fields and name not in changed}
+            if deferred:
+                self.pending.setdefault(driver_id, {}).update(deferred)
+
+            if not changed:
+                continue
+
+            self.writer.update('drivers', changed, {'id': driver_id}, session_id=self.session_ids.get(driver_id))
+            self.updates_emitted += 1
+            for name, value in changed.items():
+                self.written[driver_id][name] = (value, now)
+
+    def flush_if_due(self):
+        """Flush when a tick has elapsed (for sync loops like the camera monitor)"""
+        if time.time() - self._last_flush >= self.tick_seconds:
+            self.flush()
+
+    def forget(self, driver_id: str):
+        """Drop cached state for a driver whose session ended"""
+        self.written.pop(driver_id, None)
+        self.session_ids.pop(driver_id, None)
+
+    def start(self):
+        """Start the tick task (must be called inside the event loop)"""
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def stop(self):
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.flush()
+
+    async def flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.tick_seconds)
+                self.flush()
+        except asyncio.CancelledError:
+            pass
@@ -12,7 +12,10 @@ Adafruit_SSD1306 display(SCREEN_WIDTH, SCREEN_HEIGHT, &Wire, OLED_RESET);
 
 // BLE Service and Characteristic
 BLEService drivingService("12345678-1234-1234-1234-123456789abc");
-BLEStringCharacteristic drivingData("87654321-4321-4321-4321-cba987654321", BLERead | BLENotify, 100);
+BLEStringCharacteristic drivingData("87654321-4321-4321-4321-cba987654321", BLERead | BLENotify, 400);
+// Host control channel: "PACK:<n>" samples per notification, "RATE:<hz>" sample rate,
+// "DECIM:<n>" send every nth sample (see ble_control.py)
+BLEStringCharacteristic controlChar("87654321-4321-4321-4321-cba987654322", BLERead | BLEWrite, 32);
 
 const float HARSH_BRAKE_THRESHOLD = 0.5;
 const float HARSH_ACCEL_THRESHOLD = 0.4;
@@ -20,11 +23,37 @@ const float SWERVE_THRESHOLD = 0.6;
 const int TIME_WINDOW = 60000;
 const int AGGRESSIVE_EVENT_LIMIT = 3;
 const int EVENT_COOLDOWN = 3000;
+// Possible crash - never decimated or packed (host threshold: IMPACT_THRESHOLD_G)
+const float IMPACT_THRESHOLD = 3.0;
+
+const int MAX_PACKED_SAMPLES = 8;
+const int MIN_SAMPLE_RATE = 1;
+const int MAX_SAMPLE_RATE = 100;
+const int MAX_DECIMATION = 50;
+// Skipped samples kept so an event arrives with full-resolution lead-in
+const int PRETRIGGER_SAMPLES = 25;
 
 int aggressiveEventCount = 0;
 unsigned long windowStartTime = 0;
 unsigned long lastEventTime = 0;
 
+// Link settings (defaults match the original one-sample-per-notification stream)
+int samplesPerNotification = 1;
+int sampleRateHz = 50;
+unsigned long sampleIntervalMs = 20;
+unsigned long lastSampleTime = 0;
+int decimation = 1;
+unsigned long sampleCounter = 0;
+
+// Ring of samples skipped by decimation
+String pretrigger[PRETRIGGER_SAMPLES];
+int pretriggerStart = 0;
+int pretriggerCount = 0;
+
+// Samples waiting to be sent together
+String packedSamples = "";
+int packedCount = 0;
+
 void setup() {
   Serial.begin(115200);
   
@@ -58,7 +87,9 @@ void setup() {
   BLE.setLocalName("Driving Monitor");
   BLE.setAdvertisedService(drivingService);
   drivingService.addCharacteristic(drivingData);
+  drivingService.addCharacteristic(controlChar);
   BLE.addService(drivingService);
+  publishConfig();
   
   // Start advertising
   BLE.advertise();
@@ -109,6 +140,77 @@ void sendBLEData(String data) {
   }
 }
 
+// Send any packed samples now (before an EVENT/STATUS so order is kept)
+void flushSamples() {
+  if (packedCount > 0) {
+    sendBLEData(packedSamples);
+    packedSamples = "";
+    packedCount = 0;
+  }
+}
+
+// Queue one CSV sample; the notification goes out once the pack is full
+void sendSample(String sample) {
+  if (packedCount > 0) {
+    packedSamples += "\n";
+  }
+  packedSamples += sample;
+  packedCount++;
+  if (packedCount >= samplesPerNotification) {
+    flushSamples();
+  }
+}
+
+// Remember a sample that decimation skipped (oldest is overwritten when full)
+void keepPretrigger(String sample) {
+  int slot = (pretriggerStart + pretriggerCount) % PRETRIGGER_SAMPLES;
+  pretrigger[slot] = sample;
+  if (pretriggerCount < PRETRIGGER_SAMPLES) {
+    pretriggerCount++;
+  } else {
+    pretriggerStart = (pretriggerStart + 1) % PRETRIGGER_SAMPLES;
+  }
+}
+
+// Send the skipped lead-in samples, oldest first
+void sendPretrigger() {
+  for (int i = 0; i < pretriggerCount; i++) {
+    sendSample(pretrigger[(pretriggerStart + i) % PRETRIGGER_SAMPLES]);
+  }
+  pretriggerStart = 0;
+  pretriggerCount = 0;
+}
+
+void publishConfig() {
+  controlChar.writeValue("CFG:" + String(samplesPerNotification) + ":" + String(sampleRateHz) + ":" + String(decimation));
+}
+
+// Apply a command written by the host to the control characteristic
+void handleControl() {
+  if (!controlChar.written()) {
+    return;
+  }
+
+  String command = controlChar.value();
+  int value = command.substring(command.indexOf(':') + 1).toInt();
+
+  if (command.startsWith("PACK:")) {
+    flushSamples();
+    samplesPerNotification = constrain(value, 1, MAX_PACKED_SAMPLES);
+  } else if (command.startsWith("RATE:")) {
+    sampleRateHz = constrain(value, MIN_SAMPLE_RATE, MAX_SAMPLE_RATE);
+    sampleIntervalMs = 1000 / sampleRateHz;
+  } else if (command.startsWith("DECIM:")) {
+    decimation = constrain(value, 1, MAX_DECIMATION);
+    if (decimation == 1) {
+      sendPretrigger();
+    }
+  }
+
+  Serial.println("Control: " + command);
+  publishConfig();
+}
+
 void loop() {
   // Listen for BLE connections
   BLEDevice central = BLE.central();
@@ -122,8 +224,16 @@ void loop() {
     
     while (central.connected()) {
       float ax, ay, az;
-      
+
+      handleControl();
+
+      // Sample on the host-configured interval instead of a fixed delay
+      if (millis() - lastSampleTime < sampleIntervalMs) {
+        continue;
+      }
+
       if (IMU.accelerationAvailable()) {
+        lastSampleTime = millis();
         IMU.readAcceleration(ax, ay, az);
         
         bool aggressiveEvent = false;
@@ -144,9 +254,26 @@ void loop() {
           aggressiveEvent = true;
         }
         
-        // Send data via BLE
-        String dataString = String(ax) + "," + String(ay) + "," + String(az) + "," + eventType + "," + String(aggressiveEventCount);
-        sendBLEData(dataString);
+        // Timestamp every message with millis() so the host can place it on its own clock
+        unsigned long sampleTime = millis();
+
+        // Send data via BLE: ax,ay,az,event_type,count,millis (packed several per notification when asked)
+        String dataString = String(ax) + "," + String(ay) + "," + String(az) + "," + eventType + "," + String(aggressiveEventCount) + "," + String(sampleTime);
+
+        bool impact = sqrt(ax * ax + ay * ay + az * az) >= IMPACT_THRESHOLD;
+
+        // Detection always runs at the full sample rate; decimation only thins what is sent.
+        // Event samples always go out at once, preceded by the samples skipped just before them.
+        if (aggressiveEvent || impact) {
+          sendPretrigger();
+          sendSample(dataString);
+          flushSamples();
+        } else if (sampleCounter % decimation == 0) {
+          sendSample(dataString);
+        } else {
+          keepPretrigger(dataString);
+        }
+        sampleCounter++;
         
         // Only count events once per cooldown period
         if (aggressiveEvent && (millis() - lastEventTime > EVENT_COOLDOWN)) {
@@ -155,18 +282,20 @@ void loop() {
           lastEventTime = millis();
           
           // Send event notification
-          sendBLEData("EVENT:" + eventType + ":" + String(aggressiveEventCount));
+          flushSamples();
+          sendBLEData("EVENT:" + eventType + ":" + String(aggressiveEventCount) + ":" + String(sampleTime));
           updateDisplay(eventType, aggressiveEventCount, "Event Detected");
         }
         
         if (millis() - windowStartTime > TIME_WINDOW) {
           String status;
+          flushSamples();
           if (aggressiveEventCount >= AGGRESSIVE_EVENT_LIMIT) {
             status = "AGGRESSIVE";
-            sendBLEData("STATUS:AGGRESSIVE:" + String(aggressiveEventCount));
+            sendBLEData("STATUS:AGGRESSIVE:" + String(aggressiveEventCount) + ":" + String(sampleTime));
           } else {
             status = "SAFE";
-            sendBLEData("STATUS:SAFE:" + String(aggressiveEventCount));
+            sendBLEData("STATUS:SAFE:" + String(aggressiveEventCount) + ":" + String(sampleTime));
           }
           
           updateDisplay("", aggressiveEventCount, status);
@@ -181,10 +310,18 @@ void loop() {
           lastDisplayUpdate = millis();
         }
       }
-      
-      delay(20);
     }
-    
+
+    // Drop anything packed for the old connection and go back to defaults for the next one
+    packedSamples = "";
+    packedCount = 0;
+    samplesPerNotification = 1;
+    sampleRateHz = 50;
+    sampleIntervalMs = 20;
+    decimation = 1;
+    pretriggerCount = 0;
+    publishConfig();
+
     Serial.println("Disconnected");
   }
 }
@@ -0,0 +1,141 @@
+"""
+In-memory stand-in for the Supabase client
+Implements the subset of the query builder the monitors use and counts
+every request, so replays and load tests can run without a network and
+report database calls per message.
+"""
+import time
+import uuid
+from collections import Counter
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client, table: str):
+        self.client = client
+        self.table_name = table
+        self.op = 'select'
+        self.payload = None
+        self.filters = []
+        self.order_by = None
+        self.limit_count = None
+        self.single_row = False
+
+    # Query builder ---------------------------------------------------------
+    def select(self, *columns):
+        self.op = 'select'
+        return self
+
+    def insert(self, payload):
+        self.op, self.payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = None, ignore_duplicates: bool = False):
+        self.op, self.payload = 'upsert', payload
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, payload):
+        self.op, self.payload = 'update', payload
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, lambda row_value: row_value == value))
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append((column, lambda row_value: row_value in values))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append((column, lambda row_value: row_value is not None and row_value < value))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append((column, lambda row_value: row_value is not None and row_value > value))
+        return self
+
+    def order(self, column, desc: bool = False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count: int):
+        self.limit_count = count
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    # Execution ---------------------------------------------------------------
+    def _matches(self, row):
+        return all(check(row.get(column)) for column, check in self.filters)
+
+    def execute(self):
+        return self.client._execute(self)
+
+
+class FakeSupabase:
+    """Drop-in for supabase.Client backed by dicts.
+
+    `latency` adds a fixed delay per request to mimic network round trips.
+    `calls` counts requests per (table, op).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {}
+        self.calls = Counter()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict = None):
+        raise NotImplementedError(f"FakeSupabase has no RPC {name}")
+
+    def seed(self, table: str, rows: list):
+        self.tables.setdefault(table, []).extend(dict(row) for row in rows)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _execute(self, query: FakeQuery) -> FakeResponse:
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls[(query.table_name, query.op)] += 1
+        rows = self.tables.setdefault(query.table_name, [])
+
+        if query.op in ('insert', 'upsert'):
+            payload = query.payload if isinstance(query.payload, list) else [query.payload]
+            inserted = []
+            for item in payload:
+                row = dict(item)
+                row.setdefault('id', str(uuid.uuid4()))
+                key = row.get('idempotency_key')
+                if query.op == 'upsert' and key and any(r.get('idempotency_key') == key for r in rows):
+                    continue
+                rows.append(row)
+                inserted.append(row)
+            return FakeResponse(inserted)
+
+        matched = [row for row in rows if query._matches(row)]
+
+        if query.op == 'update':
+            for row in matched:
+                row.update(query.payload)
+            return FakeResponse(matched)
+
+        if query.order_by:
+            column, desc = query.order_by
+            matched.sort(key=lambda row: row.get(column) or '', reverse=desc)
+        if query.limit_count is not None:
+            matched = matched[:query.limit_count]
+        if query.single_row:
+            return FakeResponse(matched[0] if matched else None)
+        return FakeResponse([dict(row) for row in matched])
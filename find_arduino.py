@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
 """
-Enhanced Bluetooth scanner to find Arduino by trying to connect to unknown devices
+Enhanced Bluetooth scanner to find Arduino by trying to connect to unknown devices.
+Unknown devices are inspected in parallel and cached in the device registry.
 """
 import asyncio
-from bleak import BleakScanner, BleakClient
+import time
+from device_registry import DeviceRegistry, BackgroundScanner
 
 async def scan_and_inspect():
     print("\n" + "="*60)
     print("ENHANCED BLUETOOTH SCANNER - Finding Your Arduino")
     print("="*60)
-    print("\nScanning for 15 seconds...")
+    print("\nScanning for 15 seconds (inspecting unknown devices in parallel)...")
 
-    devices = await BleakScanner.discover(timeout=15.0)
+    registry = DeviceRegistry()
+    scan_started = time.time()
+    await BackgroundScanner(registry).scan_for(15.0)
+
+    # Only report what was seen during this scan
+    devices = {
+        address: entry for address, entry in registry.devices.items()
+        if entry.get('last_seen', 0) >= scan_started
+    }
 
     print(f"\n✅ Found {len(devices)} total Bluetooth devices\n")
 
@@ -19,19 +29,21 @@ async def scan_and_inspect():
     named_devices = []
     unnamed_devices = []
 
-    for device in devices:
-        if device.name and device.name != "Unknown":
-            named_devices.append(device)
+    for address, entry in devices.items():
+        if entry.get('name') and entry['name'] != "Unknown":
+            named_devices.append((address, entry))
         else:
-            unnamed_devices.append(device)
+            unnamed_devices.append((address, entry))
 
     # Show named devices
     if named_devices:
         print(f"📱 NAMED DEVICES ({len(named_devices)}):")
         print("-" * 60)
-        for i, device in enumerate(named_devices, 1):
-            print(f"{i}. {device.name}")
-            print(f"   Address: {device.address}")
+        for i, (address, entry) in enumerate(named_devices, 1):
+            print(f"{i}. {entry['name']}")
+            print(f"   Address: {address}")
+            if entry.get('is_arduino'):
+                print(f"   ⭐ FOUND DRIVING MONITOR CHARACTERISTIC!")
             print()
 
     # Show unnamed devices
@@ -39,39 +51,29 @@ async def scan_and_inspect():
     print("-" * 60)
     print("These could be your Arduino if it's not setting a device name.\n")
 
-    for i, device in enumerate(unnamed_devices, 1):
-        print(f"{i}. Address: {device.address}")
-
-        # Try to get more details by attempting connection
-        try:
-            async with BleakClient(device.address, timeout=2.0) as client:
-                if client.is_connected:
-                    print(f"   ✅ CONNECTABLE!")
+    for i, (address, entry) in enumerate(unnamed_devices, 1):
+        print(f"{i}. Address: {address}  (RSSI {entry.get('rssi', '?')})")
 
-                    # Try to get services
-                    services = client.services
-                    if services:
-                        print(f"   Services found: {len(services.services)}")
-                        for service in services:
-                            print(f"      - {service.uuid}")
-                            # Check if it has our characteristic
-                            if "87654321-4321-4321-4321-cba987654321" in [str(char.uuid) for char in service.characteristics]:
-                                print(f"      ⭐ FOUND DRIVING MONITOR CHARACTERISTIC!")
-                                print(f"      🎯 THIS IS LIKELY YOUR ARDUINO!")
-        except Exception as e:
-            print(f"   ❌ Cannot connect: {str(e)[:50]}")
+        services = entry.get('services')
+        if services:
+            print(f"   ✅ CONNECTABLE!")
+            print(f"   Services found: {len(services)}")
+            for service in services:
+                print(f"      - {service}")
+            if entry.get('is_arduino'):
+                print(f"      ⭐ FOUND DRIVING MONITOR CHARACTERISTIC!")
+                print(f"      🎯 THIS IS LIKELY YOUR ARDUINO!")
+        elif services is not None:
+            print(f"   ❌ Cannot connect")
 
         print()
 
-        # Rate limit to avoid overwhelming Bluetooth
-        await asyncio.sleep(0.5)
-
     print("\n" + "="*60)
     print("INSTRUCTIONS:")
     print("="*60)
     print("1. Look for devices marked with ⭐ or ✅ CONNECTABLE")
     print("2. If you found your Arduino, note its address")
-    print("3. You can manually connect using the address in ble_supabase.py")
+    print("3. Register it for the hub: python3 device_registry.py add <address> [arduino_id]")
     print("="*60 + "\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+"""
+Crash / high-g impact detection
+Flags a sample whose acceleration magnitude reaches IMPACT_THRESHOLD_G so
+the monitor can take its fast path: the CRASH event is written straight to
+Supabase (not on the next outbox batch) and supervisors are alerted ahead of
+any other queued email.
+
+The Nano 33 BLE's LSM9DS1 runs at its default ±4 g range, so readings clip
+at 4 g and the threshold should stay below that.
+"""
+import math
+import os
+
+IMPACT_THRESHOLD_G = float(os.getenv('IMPACT_THRESHOLD_G', 3.0))
+# Samples within this window of a trigger belong to the same impact (only its peak is kept)
+IMPACT_WINDOW_SECONDS = float(os.getenv('IMPACT_WINDOW_MS', 200)) / 1000
+# A new impact can't trigger again this soon after the previous one
+IMPACT_COOLDOWN_SECONDS = float(os.getenv('IMPACT_COOLDOWN_SECONDS', 10))
+# Target for sample -> CRASH row committed, checked by ingest_tracing
+IMPACT_SLO_MS = float(os.getenv('IMPACT_SLO_MS', 500))
+
+
+class ImpactDetector:
+    """Per-device impact trigger"""
+
+    def __init__(self, threshold_g: float = IMPACT_THRESHOLD_G, window: float = IMPACT_WINDOW_SECONDS,
+                 cooldown: float = IMPACT_COOLDOWN_SECONDS):
+        self.threshold_g = threshold_g
+        self.window = window
+        self.cooldown = cooldown
+        self.triggered_at = None
+        self.peak_g = 0.0
+        self.impacts = []
+
+    def check(self, sample_time: float, x: float, y: float, z: float):
+        """Magnitude in g when this sample starts a new impact, else None"""
+        magnitude = math.sqrt(x * x + y * y + z * z)
+
+        if self.triggered_at is not None and sample_time - self.triggered_at < max(self.window, self.cooldown):
+            # Part of (or too close after) the last impact - only track its peak
+            if sample_time - self.triggered_at < self.window and magnitude > self.peak_g:
+                self.peak_g = magnitude
+                self.impacts[-1]['peak_g'] = magnitude
+            return None
+
+        if magnitude < self.threshold_g:
+            return None
+
+        self.triggered_at = sample_time
+        self.peak_g = magnitude
+        self.impacts.append({'time': sample_time, 'peak_g': magnitude})
+        return magnitude
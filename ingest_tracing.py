@@ -0,0 +1,323 @@
+"""
+End-to-end ingest latency tracing
+One trace per BLE notification, from the notification handler to the
+moment its rows are committed in Supabase.
+
+Stages (milliseconds):
+    transport             device sample time -> notification received (needs millis() in the message)
+    queued                notification received -> process_data starts running
+    parse                 message parsing and device clock mapping
+    cooldown              per-event-type cooldown check
+    save_sensor_reading   queueing the sensor_readings row
+    save_event            queueing the event (includes update_session_score)
+    update_session_score  score read/compute and queued updates
+    impact                crash fast path: immediate CRASH write and alert queueing
+    process               whole of process_data
+    commit                process_data done -> last of its writes committed by the outbox
+    end_to_end            sample time (or receive time) -> committed
+    <kind>_end_to_end     end_to_end of trace kinds with a latency objective (set_slo)
+(commit and end_to_end only exist for messages that queued writes)
+
+Traces are aggregated in memory for the per-stage report and, when
+INGEST_TRACE_PATH is set, exported as JSON lines. Traces that wrote
+nothing (routine samples) are only exported at INGEST_TRACE_ROUTINE_SAMPLE_RATE.
+
+Summarize an exported file:
+    python3 ingest_tracing.py traces.jsonl
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+
+TRACE_PATH = os.getenv('INGEST_TRACE_PATH', '')
+ROUTINE_SAMPLE_RATE = float(os.getenv('INGEST_TRACE_ROUTINE_SAMPLE_RATE', 0.01))
+# Durations kept per stage for the in-memory report
+REPORT_WINDOW = int(os.getenv('INGEST_TRACE_REPORT_WINDOW', 10000))
+# Traces waiting for their writes to commit (oldest are dropped while offline)
+MAX_PENDING_TRACES = 10000
+
+STAGE_ORDER = ['transport', 'queued', 'parse', 'impact', 'cooldown', 'save_sensor_reading', 'save_event',
+               'update_session_score', 'process', 'commit', 'end_to_end', 'impact_end_to_end']
+
+_current_trace = contextvars.ContextVar('ingest_trace', default=None)
+
+
+class Trace:
+    """Stage timings of one notification"""
+
+    def __init__(self, arduino_id: str, received_at: float = None, tracer=None):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.arduino_id = arduino_id
+        self.received_at = received_at if received_at is not None else time.time()
+        self.started = time.perf_counter()
+        self.kind = None
+        self.sample_time = None
+        self.spans = {}
+        self.write_keys = set()
+        self.writes = 0
+        self.processed = None
+        self.last_commit = None
+        self.completed = False
+
+    def record(self, name: str, start: float, end: float):
+        """Add a span from perf_counter start/end"""
+        self.spans[name] = ((start - self.started) * 1000, (end - start) * 1000)
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def durations(self) -> dict:
+        return {name: duration for name, (_, duration) in self.spans.items()}
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'arduino_id': self.arduino_id,
+            'kind': self.kind,
+            'received_at': self.received_at,
+            'sample_time': self.sample_time,
+            'writes': self.writes,
+            'spans': {name: {'offset_ms': round(offset, 3), 'duration_ms': round(duration, 3)}
+                      for name, (offset, duration) in self.spans.items()}
+        }
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a stage of the current trace (no-op outside a trace)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def traced(name: str):
+    """Decorator: time an async method as a stage of the current trace"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_kind(kind: str):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.kind = kind
+
+
+def note_sample_time(sample_time: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.sample_time = sample_time
+
+
+def note_write(key: str):
+    """Attach a queued outbox write (by idempotency key) to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None and key:
+        trace.write_keys.add(key)
+        trace.writes += 1
+        if trace.tracer is not None:
+            trace.tracer.expect_commit(key, trace)
+
+
+class Tracer:
+    """Collects finished traces, aggregates them per stage and exports them"""
+
+    def __init__(self, path: str = TRACE_PATH, routine_sample_rate: float = ROUTINE_SAMPLE_RATE,
+                 window: int = REPORT_WINDOW):
+        self.path = path
+        self.routine_sample_rate = routine_sample_rate
+        self.stages = defaultdict(lambda: deque(maxlen=window))
+        self.traces = 0
+        self.exported = 0
+        self.dropped = 0
+        # Latency objectives per trace kind: {kind: {'ms', 'met', 'missed'}}
+        self.slos = {}
+        self._pending = OrderedDict()
+        self._watched = set()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def start_trace(self, arduino_id: str, received_at: float = None) -> Trace:
+        return Trace(arduino_id, received_at, tracer=self)
+
+    def set_slo(self, kind: str, end_to_end_ms: float):
+        """Count how many traces of `kind` commit within `end_to_end_ms`"""
+        self.slos.setdefault(kind, {'met': 0, 'missed': 0})['ms'] = end_to_end_ms
+
+    @contextlib.contextmanager
+    def activate(self, trace: Trace):
+        """Make `trace` current for the block (one process_data call) and finish it afterwards"""
+        token = _current_trace.set(trace)
+        trace.record('queued', trace.started, time.perf_counter())
+        try:
+            with trace.span('process'):
+                yield trace
+        finally:
+            _current_trace.reset(token)
+            self.finish(trace)
+
+    def watch(self, outbox):
+        """Get commit notifications from an outbox (once per outbox)"""
+        if id(outbox) not in self._watched:
+            self._watched.add(id(outbox))
+            outbox.commit_listeners.append(self.on_commit)
+
+    def expect_commit(self, key: str, trace: Trace):
+        """Register a queued write; its commit may land before the trace finishes"""
+        with self._lock:
+            self._pending[key] = trace
+            while len(self._pending) > MAX_PENDING_TRACES:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+
+    def finish(self, trace: Trace):
+        processed = time.perf_counter()
+        if trace.sample_time is not None and trace.sample_time <= trace.received_at:
+            trace.spans['transport'] = (0.0, (trace.received_at - trace.sample_time) * 1000)
+        with self._lock:
+            # Set under the lock: on_commit completes the trace once it sees `processed`
+            trace.processed = processed
+            if not trace.write_keys:
+                # Nothing written, or everything already committed (immediate writes)
+                self._complete(trace, trace.last_commit or trace.processed)
+
+    def on_commit(self, keys: list):
+        """Outbox callback (from the writer thread) with the keys just committed"""
+        committed = time.perf_counter()
+        with self._lock:
+            for key in keys:
+                trace = self._pending.pop(key, None)
+                if trace is None:
+                    continue
+                trace.write_keys.discard(key)
+                trace.last_commit = committed
+                if not trace.write_keys and trace.processed is not None:
+                    self._complete(trace, committed)
+
+    def _complete(self, trace: Trace, committed: float):
+        # Called with the lock held, from finish() or on_commit() - whichever comes last, once
+        if trace.completed:
+            return
+        trace.completed = True
+        # Only traces that wrote rows have a commit to wait for
+        if trace.writes:
+            trace.record('commit', trace.processed, max(committed, trace.processed))
+            origin = trace.sample_time if trace.sample_time is not None else trace.received_at
+            committed_wall = trace.received_at + (committed - trace.started)
+            end_to_end = max(0.0, committed_wall - origin) * 1000
+            trace.spans['end_to_end'] = (0.0, end_to_end)
+
+            slo = self.slos.get(trace.kind)
+            if slo is not None:
+                self.stages[f'{trace.kind}_end_to_end'].append(end_to_end)
+                slo['met' if end_to_end <= slo['ms'] else 'missed'] += 1
+
+        self.traces += 1
+        for name, duration in trace.durations().items():
+            self.stages[name].append(duration)
+
+        if self.path and (trace.writes or random.random() < self.routine_sample_rate):
+            if self._file is None:
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(json.dumps(trace.to_dict()) + '\n')
+            self.exported += 1
+
+    def report(self) -> dict:
+        """Per-stage count and p50/p95/p99/max in milliseconds"""
+        with self._lock:
+            return summarize(self.stages)
+
+    def print_report(self):
+        if self.traces:
+            print(f"⏱️  Ingest latency ({self.traces} traces, ms):")
+            print_stage_table(self.report())
+            for kind, slo in self.slos.items():
+                total = slo['met'] + slo['missed']
+                if total:
+                    print(f"   SLO {kind}: {slo['met']}/{total} within {slo['ms']:.0f} ms end to end")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(stages: dict) -> dict:
+    report = {}
+    for name in sorted(stages, key=lambda n: STAGE_ORDER.index(n) if n in STAGE_ORDER else len(STAGE_ORDER)):
+        values = sorted(stages[name])
+        if values:
+            report[name] = {
+                'count': len(values),
+                'p50': _percentile(values, 0.50),
+                'p95': _percentile(values, 0.95),
+                'p99': _percentile(values, 0.99),
+                'max': values[-1]
+            }
+    return report
+
+
+def print_stage_table(report: dict):
+    print(f"   {'stage':22s} {'count':>7s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for name, stats in report.items():
+        print(f"   {name:22s} {stats['count']:7d} {stats['p50']:9.2f} {stats['p95']:9.2f} "
+              f"{stats['p99']:9.2f} {stats['max']:9.2f}")
+
+
+_default_tracer = None
+
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer shared by every monitor"""
+    global _default_tracer
+    if _default_tracer is None:
+        _default_tracer = Tracer()
+    return _default_tracer
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+
+    stages = defaultdict(list)
+    by_kind = defaultdict(int)
+    with open(sys.argv[1]) as f:
+        for line in f:
+            trace = json.loads(line)
+            by_kind[trace.get('kind')] += 1
+            for name, timing in trace['spans'].items():
+                stages[name].append(timing['duration_ms'])
+
+    print(f"⏱️  {sum(by_kind.values())} traces ({', '.join(f'{k}: {v}' for k, v in by_kind.items())}), ms:")
+    print_stage_table(summarize(stages))
+
+
+if __name__ == "__main__":
+    main()
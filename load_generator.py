@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Virtual Arduino fleet load generator
+Simulates N devices speaking the driving_monitor.ino message grammar
+(CSV samples, EVENT: and STATUS:) and measures how much one ingest host
+can take.
+
+Targets:
+    inproc  - SupabaseDrivingMonitor pipelines in this process, sharing one
+              fake backend/writer like ble_hub.py does (default)
+    http    - the Flask api_endpoint over localhost (start it first)
+
+Examples:
+    python3 load_generator.py --devices 20 --seconds 30
+    python3 load_generator.py --ramp 1,5,10,25,50,100 --seconds 15 --latency 0.02
+    python3 load_generator.py --target http --url http://localhost:5000 --devices 10
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from ble_replay import NullSender, percentile
+
+# Event mix and thresholds mirror driving_monitor.ino
+EVENT_WEIGHTS = {'SWERVING': 0.5, 'HARSH_BRAKE': 0.3, 'AGGRESSIVE': 0.2}
+EVENT_COOLDOWN_MS = 3000
+STATUS_WINDOW_MS = 60000
+AGGRESSIVE_EVENT_LIMIT = 3
+
+
+class VirtualDevice:
+    """Generates one device's notification stream"""
+
+    def __init__(self, index: int, event_rate: float = 0.1, seed: int = None):
+        self.arduino_id = f"VIRTUAL-{index:04d}"
+        self.event_rate = event_rate  # events per second of driving
+        self.random = random.Random(seed if seed is not None else index)
+        self.millis = self.random.randint(0, 10000)
+        self.event_count = 0
+        self.last_event_ms = -EVENT_COOLDOWN_MS
+        self.window_start_ms = self.millis
+
+    def _pick_event(self) -> str:
+        roll = self.random.random()
+        for event_type, weight in EVENT_WEIGHTS.items():
+            roll -= weight
+            if roll <= 0:
+                return event_type
+        return 'SWERVING'
+
+    def step(self, dt_ms: int) -> list:
+        """Messages emitted for the next sample, dt_ms after the previous one"""
+        self.millis += dt_ms
+        event_type = ''
+        if self.random.random() < self.event_rate * dt_ms / 1000:
+            event_type = self._pick_event()
+
+        # Plausible accelerations for the chosen event (thresholds from the sketch)
+        ax = self.random.gauss(0, 0.1)
+        ay = self.random.gauss(0, 0.1)
+        az = 1.0 + self.random.gauss(0, 0.05)
+        if event_type == 'HARSH_BRAKE':
+            ax = -self.random.uniform(0.55, 1.5)
+        elif event_type == 'AGGRESSIVE':
+            ax = self.random.uniform(0.45, 1.2)
+        elif event_type == 'SWERVING':
+            ay = self.random.choice([-1, 1]) * self.random.uniform(0.65, 1.4)
+
+        messages = [f"{ax:.2f},{ay:.2f},{az:.2f},{event_type},{self.event_count},{self.millis}"]
+
+        if event_type and self.millis - self.last_event_ms > EVENT_COOLDOWN_MS:
+            self.event_count += 1
+            self.last_event_ms = self.millis
+            messages.append(f"EVENT:{event_type}:{self.event_count}:{self.millis}")
+
+        if self.millis - self.window_start_ms > STATUS_WINDOW_MS:
+            status = 'AGGRESSIVE' if self.event_count >= AGGRESSIVE_EVENT_LIMIT else 'SAFE'
+            messages.append(f"STATUS:{status}:{self.event_count}:{self.millis}")
+            self.event_count = 0
+            self.window_start_ms = self.millis
+
+        return messages
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.sent = 0
+        self.completed = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.sent += 1
+
+    def done(self, latency: float, ok: bool = True):
+        with self._lock:
+            self.completed += 1
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+
+    def report(self, devices: int, offered: float, elapsed: float) -> dict:
+        return {
+            'devices': devices,
+            'offered_msgs_per_sec': offered,
+            'achieved_msgs_per_sec': self.completed / max(elapsed, 1e-9),
+            'sent': self.sent,
+            'completed': self.completed,
+            'errors': self.errors,
+            'p50_ms': percentile(self.latencies, 0.50) * 1000,
+            'p95_ms': percentile(self.latencies, 0.95) * 1000,
+            'p99_ms': percentile(self.latencies, 0.99) * 1000,
+        }
+
+
+async def run_inproc(devices: int, seconds: float, rate_hz: float, event_rate: float, latency: float) -> dict:
+    """Drive N monitor pipelines in this process against a shared fake backend"""
+    from ble_supabase import SupabaseDrivingMonitor
+    from driver_state import DriverStateWriter
+    from fake_supabase import FakeSupabase
+    from notification_service import NotificationService
+    from outbox import Outbox
+    from session_timeouts import LivenessMonitor
+    from supabase_writer import BatchedWriter
+
+    workdir = tempfile.mkdtemp(prefix='load_generator_')
+    outbox_path = os.path.join(workdir, 'outbox.db')
+    supabase = FakeSupabase(latency=latency)
+    supabase.seed('supervisors', [{'email': 'supervisor@example.com'}])
+
+    # Same sharing as ble_hub.BleHub
+    writer = BatchedWriter(supabase, Outbox(outbox_path))
+    driver_state = DriverStateWriter(writer)
+    liveness = LivenessMonitor()
+    notifier = NotificationService(supabase, path=outbox_path, sender=NullSender())
+
+    virtual_devices = [VirtualDevice(i, event_rate) for i in range(devices)]
+    supabase.seed('drivers', [
+        {'id': f'driver-{d.arduino_id}', 'name': d.arduino_id, 'email': 'load@example.com', 'arduino_id': d.arduino_id}
+        for d in virtual_devices
+    ])
+
+    stats = LoadStats()
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / rate_hz
+    dt_ms = int(round(interval * 1000))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for service in (writer, driver_state, liveness, notifier):
+            service.start()
+        monitors = []
+        for device in virtual_devices:
+            monitor = SupabaseDrivingMonitor(arduino_id=device.arduino_id, supabase=supabase, writer=writer,
+                                             driver_state=driver_state, liveness=liveness, notifier=notifier)
+            await monitor.initialize_session()
+            monitors.append(monitor)
+
+        calls_before = supabase.total_calls
+        pending = set()
+
+        async def handle(monitor, message, received_at, scheduled):
+            try:
+                await monitor.process_data(message, received_at=received_at)
+                stats.done(loop.time() - scheduled)
+            except Exception:
+                stats.done(loop.time() - scheduled, ok=False)
+
+        async def drive(device, monitor):
+            next_time = loop.time() + random.uniform(0, interval)
+            end_time = loop.time() + seconds
+            while next_time < end_time:
+                delay = next_time - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                for message in device.step(dt_ms):
+                    stats.started()
+                    monitor.touch('ble')
+                    # Same dispatch as the live notification handler
+                    task = asyncio.create_task(handle(monitor, message, time.time(), next_time))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                next_time += interval
+
+        started = loop.time()
+        await asyncio.gather(*(drive(d, m) for d, m in zip(virtual_devices, monitors)))
+        if pending:
+            await asyncio.gather(*pending)
+        elapsed = loop.time() - started
+
+        for monitor in monitors:
+            await monitor.end_session()
+        for service in (liveness, notifier, driver_state, writer):
+            await service.stop()
+
+    result = stats.report(devices, devices * rate_hz, elapsed)
+    result['db_calls_per_message'] = (supabase.total_calls - calls_before) / max(stats.completed, 1)
+    return result
+
+
+def run_http(devices: int, seconds: float, rate_hz: float, event_rate: float, url: str) -> dict:
+    """Drive the Flask API with one keep-alive connection per virtual device"""
+    target = urlparse(url)
+    api_key = os.getenv('ARDUINO_API_KEY', 'your_secret_api_key')
+    headers = {'Content-Type': 'application/json', 'X-API-Key': api_key}
+    stats = LoadStats()
+    interval = 1.0 / rate_hz
+    dt_ms = int(round(interval * 1000))
+
+    def post(conn, path, body):
+        conn.request('POST', path, body=json.dumps(body), headers=headers)
+        response = conn.getresponse()
+        payload = response.read()
+        return response.status, payload
+
+    def drive(device):
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        status, payload = post(conn, '/api/session/start', {'driver_id': f'load|{device.arduino_id}'})
+        if status >= 300:
+            raise RuntimeError(f"Could not start session: {status} {payload[:200]!r}")
+        session_id = json.loads(payload)['session_id']
+
+        next_time = time.perf_counter() + random.uniform(0, interval)
+        end_time = time.perf_counter() + seconds
+        while next_time < end_time:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            for message in device.step(dt_ms):
+                if message.startswith('STATUS:'):
+                    continue
+                if message.startswith('EVENT:'):
+                    event_type = message.split(':')[1].lower()
+                    path, body = '/api/driving/event', {'session_id': session_id, 'event_type': event_type,
+                                                        'severity': 'medium'}
+                else:
+                    ax, ay = (float(v) for v in message.split(',')[:2])
+                    path, body = '/api/driving/metric', {'session_id': session_id,
+                                                         'acceleration': (ax ** 2 + ay ** 2) ** 0.5}
+                stats.started()
+                try:
+                    status, _ = post(conn, path, body)
+                    stats.done(time.perf_counter() - next_time, ok=status < 300)
+                except Exception:
+                    stats.done(time.perf_counter() - next_time, ok=False)
+                    conn.close()
+                    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+            next_time += interval
+
+        post(conn, '/api/session/end', {'session_id': session_id})
+        conn.close()
+
+    threads = [threading.Thread(target=drive, args=(VirtualDevice(i, event_rate),), daemon=True)
+               for i in range(devices)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return stats.report(devices, devices * rate_hz, elapsed)
+
+
+def print_result(result: dict):
+    print(f"{result['devices']:5d} dev | offered {result['offered_msgs_per_sec']:8.0f} msg/s | "
+          f"achieved {result['achieved_msgs_per_sec']:8.0f} msg/s | "
+          f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms | "
+          f"errors {result['errors']}"
+          + (f" | {result['db_calls_per_message']:.3f} db calls/msg" if 'db_calls_per_message' in result else ""))
+
+
+def is_saturated(result: dict, max_p95_ms: float) -> bool:
+    """Saturated when we can't keep up with the offered rate or latency blows through the limit"""
+    return (result['achieved_msgs_per_sec'] < 0.95 * result['offered_msgs_per_sec']
+            or result['p95_ms'] > max_p95_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual Arduino fleet load generator")
+    parser.add_argument('--target', choices=['inproc', 'http'], default='inproc')
+    parser.add_argument('--url', default=f"http://localhost:{os.getenv('API_PORT', 5000)}")
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--ramp', help="Comma-separated device counts to find the saturation point, e.g. 1,5,10,50")
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--rate', type=float, default=50, help="Samples per second per device (sketch: ~50)")
+    parser.add_argument('--event-rate', type=float, default=0.1, help="Driving events per second per device")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated Supabase round trip (inproc)")
+    parser.add_argument('--max-p95-ms', type=float, default=500, help="Latency limit for the saturation check")
+    args = parser.parse_args()
+
+    steps = [int(n) for n in args.ramp.split(',')] if args.ramp else [args.devices]
+
+    print("\n" + "=" * 60)
+    print(f"🚚 VIRTUAL FLEET LOAD TEST ({args.target})")
+    print("=" * 60)
+
+    saturation = None
+    for devices in steps:
+        if args.target == 'inproc':
+            result = asyncio.run(run_inproc(devices, args.seconds, args.rate, args.event_rate, args.latency))
+        else:
+            result = run_http(devices, args.seconds, args.rate, args.event_rate, args.url)
+        print_result(result)
+
+        if saturation is None and is_saturated(result, args.max_p95_ms):
+            saturation = devices
+            if args.ramp:
+                break
+
+    print("-" * 60)
+    if saturation is not None:
+        print(f"⚠️  Saturated at {saturation} device(s)")
+    else:
+        print(f"✅ No saturation up to {steps[-1]} device(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+In-process supervisor notification service
+Replaces spawning `notify_supervisor.py` for every session start.
+
+Jobs are persisted in SQLite (next to the outbox) so a notification
+queued just before a crash or restart is still sent. A single async
+worker sends them, reusing one SMTP connection and caching the
+supervisor recipient list, and records enqueue-to-sent latency.
+
+Several processes may share the queue file (e.g. ble_hub.py and a
+standalone ble_supabase.py): a worker claims a job under a lease of
+OUTBOX_CLAIM_SECONDS before sending it, so each email goes out once.
+Failed jobs are retried until they are older than NOTIFY_MAX_AGE_SECONDS
+(NOTIFY_URGENT_MAX_AGE_SECONDS for crash alerts), so an outage of a few
+minutes delays notifications instead of losing them.
+"""
+import asyncio
+import json
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from email.mime.text import MIMEText
+
+from outbox import CLAIM_SECONDS, OUTBOX_PATH
+
+RECIPIENT_CACHE_SECONDS = float(os.getenv('NOTIFY_RECIPIENT_CACHE_SECONDS', 300))
+# Failed jobs back off up to this delay and are given up once this old
+RETRY_MAX_DELAY = float(os.getenv('NOTIFY_RETRY_MAX_SECONDS', 300))
+MAX_AGE_SECONDS = float(os.getenv('NOTIFY_MAX_AGE_SECONDS', 21600))
+# Urgent jobs (crash alerts) don't run out of attempts: they retry at least this often
+# until delivered, and are only given up after NOTIFY_URGENT_MAX_AGE_SECONDS
+URGENT_RETRY_MAX_DELAY = float(os.getenv('NOTIFY_URGENT_RETRY_MAX_SECONDS', 60))
+URGENT_MAX_AGE_SECONDS = float(os.getenv('NOTIFY_URGENT_MAX_AGE_SECONDS', 86400))
+# How long shutdown waits for queued notifications; the rest are sent on next start
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('NOTIFY_SHUTDOWN_DRAIN_SECONDS', 5))
+DASHBOARD_URL = os.getenv('DASHBOARD_URL', 'http://localhost:5173')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    priority INTEGER NOT NULL DEFAULT 0,
+    delivered TEXT NOT NULL DEFAULT '[]',
+    claimed_by TEXT,
+    claimed_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+# Higher priority jobs are sent first
+PRIORITY_NORMAL = 0
+PRIORITY_URGENT = 10
+
+
+def build_driver_online_email(driver_id: str, driver_name: str, driver_email: str):
+    """Subject and body of the 'driver is online' email"""
+    subject = f"🚙 Driver Alert: {driver_name} is now ACTIVE"
+
+    message = f"""Hello,
+
+Driver {driver_name} ({driver_email}) has just started a driving session and is now ONLINE.
+
+You can monitor their drive in real-time here:
+{DASHBOARD_URL}/driver/{driver_id}
+
+This is an automated notification from your Fleet Monitoring System.
+
+---
+Fleet Safety Monitoring System
+"""
+    return subject, message
+
+
+def build_impact_email(driver_id: str, driver_name: str, peak_g: float, occurred_at: str):
+    """Subject and body of the 'possible crash' alert"""
+    subject = f"🚨 URGENT: Possible crash - {driver_name} ({peak_g:.1f} g impact)"
+
+    message = f"""URGENT
+
+A high-g impact of {peak_g:.1f} g was detected for driver {driver_name} at {occurred_at}.
+This may indicate a collision. Please contact the driver immediately.
+
+Live view:
+{DASHBOARD_URL}/driver/{driver_id}
+
+This is an automated notification from your Fleet Monitoring System.
+
+---
+Fleet Safety Monitoring System
+"""
+    return subject, message
+
+
+def collect_recipients(supabase) -> set:
+    """Default notification email from .env plus every supervisor's email"""
+    recipients = set()  # Use set to avoid duplicates
+
+    default_email = os.getenv("NOTIFICATION_EMAIL") or os.getenv("DEFAULT_RECIPIENT")
+    if default_email:
+        recipients.add(default_email)
+
+    supervisors = supabase.table('supervisors').select('email').execute()
+    for supervisor in supervisors.data or []:
+        if supervisor.get('email'):
+            recipients.add(supervisor['email'])
+
+    return recipients
+
+
+class SmtpSender:
+    """Keeps one logged-in SMTP connection open across emails"""
+
+    def __init__(self):
+        self.user = os.getenv("GMAIL_USER")
+        self.password = os.getenv("GMAIL_APP_PASSWORD")
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=30)
+        server.login(self.user, self.password)
+        self._server = server
+
+    def send(self, subject: str, message: str, recipient: str):
+        if not self.user or not self.password:
+            raise RuntimeError("GMAIL_USER and GMAIL_APP_PASSWORD must be set in .env")
+
+        msg = MIMEText(message)
+        msg['From'] = self.user
+        msg['To'] = recipient
+        msg['Subject'] = subject
+
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Server dropped the idle connection - reconnect once and retry
+            self._connect()
+            self._server.send_message(msg)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+class NotificationService:
+    def __init__(self, supabase, path: str = OUTBOX_PATH, sender: SmtpSender = None):
+        self.supabase = supabase
+        self.sender = sender or SmtpSender()
+        self.worker_task = None
+        self._wakeup = asyncio.Event()
+        self._lock = threading.Lock()
+        self._recipients = None
+        self._recipients_fetched_at = 0.0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(notifications)")]
+        if 'priority' not in columns:
+            # Queue file from before priorities
+            self._conn.execute("ALTER TABLE notifications ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        if 'delivered' not in columns:
+            # Queue file from before per-recipient delivery tracking
+            self._conn.execute("ALTER TABLE notifications ADD COLUMN delivered TEXT NOT NULL DEFAULT '[]'")
+        if 'claimed_by' not in columns:
+            # Queue file from before claims
+            self._conn.execute("ALTER TABLE notifications ADD COLUMN claimed_by TEXT")
+            self._conn.execute("ALTER TABLE notifications ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+        # A job this worker is sending (stop() waits for it)
+        self._sending = False
+
+        # Stats - seconds from enqueue to the last recipient being sent
+        self.latencies = []
+        self.sent = 0
+        self.failed = 0
+
+    def notify_driver_online(self, driver: dict):
+        """Queue the 'driver is online' email; returns immediately"""
+        payload = {
+            'driver_id': driver['id'],
+            'name': driver.get('name', 'Unknown'),
+            'email': driver.get('email', 'N/A')
+        }
+        self._enqueue('driver_online', payload)
+
+    def notify_impact(self, driver: dict, peak_g: float, occurred_at: str):
+        """Queue a crash alert ahead of every other notification"""
+        payload = {
+            'driver_id': driver['id'],
+            'name': driver.get('name', 'Unknown'),
+            'peak_g': peak_g,
+            'occurred_at': occurred_at
+        }
+        self._enqueue('impact', payload, PRIORITY_URGENT)
+
+    def _enqueue(self, kind: str, payload: dict, priority: int = PRIORITY_NORMAL):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO notifications (kind, payload, created_at, priority) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), time.time(), priority)
+            )
+        self._wakeup.set()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    def recipients(self) -> set:
+        """Recipient list, re-queried at most every RECIPIENT_CACHE_SECONDS"""
+        if self._recipients is None or time.time() - self._recipients_fetched_at > RECIPIENT_CACHE_SECONDS:
+            self._recipients = collect_recipients(self.supabase)
+            self._recipients_fetched_at = time.time()
+        return self._recipients
+
+    def _has_ready_job(self) -> bool:
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM notifications WHERE next_attempt_at <= ? AND claimed_until <= ? LIMIT 1",
+                (now, now)
+            ).fetchone() is not None
+
+    def _claim_next_job(self, token: str):
+        """Claim the next ready job nobody else is sending, or None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._conn.execute(
+                    "SELECT id, kind, payload, created_at, attempts, priority FROM notifications "
+                    "WHERE next_attempt_at <= ? AND claimed_until <= ? ORDER BY priority DESC, id LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if job is not None:
+                    self._conn.execute(
+                        "UPDATE notifications SET claimed_by = ?, claimed_until = ? WHERE id = ?",
+                        (token, now + CLAIM_SECONDS, job[0])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job
+
+    def _release_claim(self, token: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE notifications SET claimed_by = NULL, claimed_until = 0 WHERE claimed_by = ?", (token,)
+            )
+
+    def _delivered(self, job_id: int) -> list:
+        with self._lock:
+            row = self._conn.execute("SELECT delivered FROM notifications WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _mark_delivered(self, job_id: int, delivered: list):
+        with self._lock:
+            self._conn.execute("UPDATE notifications SET delivered = ? WHERE id = ?",
+                               (json.dumps(delivered), job_id))
+
+    def _send_job(self, job_id: int, kind: str, payload: dict):
+        """Blocking send of one job (runs in a worker thread)
+
+        Each recipient is recorded as it is sent, so a retry after a partial
+        failure only emails the ones still missing.
+        """
+        if kind == 'driver_online':
+            subject, message = build_driver_online_email(payload['driver_id'], payload['name'], payload['email'])
+        elif kind == 'impact':
+            subject, message = build_impact_email(payload['driver_id'], payload['name'], payload['peak_g'],
+                                                  payload['occurred_at'])
+        else:
+            raise ValueError(f"Unknown notification kind: {kind}")
+
+        recipients = self.recipients()
+        if not recipients:
+            print(f"⚠️ No recipients configured - skipping email notification")
+            return
+
+        delivered = self._delivered(job_id)
+        for recipient in sorted(recipients):
+            if recipient in delivered:
+                continue
+            self.sender.send(subject, message, recipient)
+            delivered.append(recipient)
+            self._mark_delivered(job_id, delivered)
+            print(f"   ✅ Email sent to {recipient}")
+
+    def _finish(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM notifications WHERE id = ?", (job_id,))
+
+    def _retry_later(self, job_id: int, attempts: int, priority: int, created_at: float) -> bool:
+        """Schedule the next attempt; False when the job is given up"""
+        if priority >= PRIORITY_URGENT:
+            # A crash alert has to survive a long connectivity gap, and go out soon after it ends
+            max_age, max_delay = URGENT_MAX_AGE_SECONDS, URGENT_RETRY_MAX_DELAY
+        else:
+            max_age, max_delay = MAX_AGE_SECONDS, RETRY_MAX_DELAY
+        expired = time.time() - created_at >= max_age
+        delay = min(2 ** min(attempts, 16) * 5, max_delay)
+        with self._lock:
+            if expired:
+                self._conn.execute("DELETE FROM notifications WHERE id = ?", (job_id,))
+            else:
+                self._conn.execute(
+                    "UPDATE notifications SET attempts = ?, next_attempt_at = ?, claimed_by = NULL, "
+                    "claimed_until = 0 WHERE id = ?",
+                    (attempts + 1, time.time() + delay, job_id)
+                )
+        return not expired
+
+    async def process_one(self) -> bool:
+        """Send the next ready job; returns False when nothing is ready"""
+        token = str(uuid.uuid4())
+        job = self._claim_next_job(token)
+        if job is None:
+            return False
+
+        job_id, kind, payload, created_at, attempts, priority = job
+        self._sending = True
+        try:
+            await asyncio.to_thread(self._send_job, job_id, kind, json.loads(payload))
+            self._finish(job_id)
+            latency = time.time() - created_at
+            self.latencies.append(latency)
+            self.sent += 1
+            print(f"📧 Supervisor notification delivered in {latency:.2f}s")
+        except Exception as e:
+            self.failed += 1
+            if self._retry_later(job_id, attempts, priority, created_at):
+                print(f"   ⚠️  Could not send {kind} notification (attempt {attempts + 1}), will retry: {e}")
+            else:
+                print(f"   ❌ Gave up on {kind} notification after {attempts + 1} attempts: {e}")
+        finally:
+            # Only still claimed if the send was cancelled
+            self._release_claim(token)
+            self._sending = False
+        return True
+
+    async def worker(self):
+        try:
+            while True:
+                self._wakeup.clear()
+                if not await self.process_one():
+                    # Idle: wait for a new job, or poll for retries coming due
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                    except asyncio.TimeoutError:
+                        pass
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        """Start the worker (must be called inside the event loop)"""
+        if self.worker_task is None:
+            self.worker_task = asyncio.create_task(self.worker())
+
+    async def stop(self):
+        """Give queued notifications a moment to go out, then stop the worker"""
+        deadline = time.time() + SHUTDOWN_DRAIN_SECONDS
+        while (self._sending or self._has_ready_job()) and time.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self.worker_task:
+            self.worker_task.cancel()
+            try:
+                await self.worker_task
+            except asyncio.CancelledError:
+                pass
+            self.worker_task = None
+
+        remaining = self.pending_count()
+        if remaining:
+            print(f"📧 {remaining} notification(s) queued - they'll be sent on next start")
+        await asyncio.to_thread(self.sender.close)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'pending': self.pending_count(),
+            'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+            'latency_max': latencies[-1] if latencies else None
+        }
@@ -1,23 +1,22 @@
 #!/usr/bin/env python3
 """
 Supervisor Email Notification Service
-Sends email to supervisor when a driver goes online
+Sends email to supervisor when a driver goes online.
+Standalone/manual use - the BLE monitors queue these emails in-process
+through notification_service.NotificationService.
 """
-import os
 import sys
 from dotenv import load_dotenv
-from supabase import create_client
+from supabase_client import get_supabase
 from email_notif import send_email_notification
+from notification_service import build_driver_online_email, collect_recipients
 
 load_dotenv()
 
 def notify_supervisor_driver_online(driver_id: str):
     """Send email notification to all supervisors and default email when driver goes online"""
     try:
-        # Initialize Supabase
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-        supabase = create_client(supabase_url, supabase_key)
+        supabase = get_supabase()
 
         # Get driver info
         driver = supabase.table('drivers').select('*').eq('id', driver_id).single().execute()
@@ -31,35 +30,10 @@ def notify_supervisor_driver_online(driver_id: str):
         driver_email = driver_data.get('email', 'N/A')
 
         # Create email content
-        subject = f"🚙 Driver Alert: {driver_name} is now ACTIVE"
+        subject, message = build_driver_online_email(driver_id, driver_name, driver_email)
 
-        message = f"""Hello,
-
-Driver {driver_name} ({driver_email}) has just started a driving session and is now ONLINE.
-
-You can monitor their drive in real-time here:
-http://localhost:5173/driver/{driver_id}
-
-This is an automated notification from your Fleet Monitoring System.
-
----
-Fleet Safety Monitoring System
-"""
-
-        # Collect all email recipients
-        recipients = set()  # Use set to avoid duplicates
-
-        # Add default notification email from .env
-        default_email = os.getenv("NOTIFICATION_EMAIL") or os.getenv("DEFAULT_RECIPIENT")
-        if default_email:
-            recipients.add(default_email)
-
-        # Get all supervisors from database
-        supervisors = supabase.table('supervisors').select('email').execute()
-        if supervisors.data:
-            for supervisor in supervisors.data:
-                if supervisor.get('email'):
-                    recipients.add(supervisor['email'])
+        # Collect all email recipients (default email from .env + all supervisors)
+        recipients = collect_recipients(supabase)
 
         if not recipients:
             print(f"⚠️ No recipients configured - skipping email notification")
@@ -0,0 +1,340 @@
+"""
+Durable outbox for Supabase writes
+Every outbound write is first committed to a local SQLite database (WAL
+mode) and replayed to Supabase from there, so data survives connectivity
+drops and restarts.
+
+Ordering: rows are replayed in enqueue order per session. A session is
+only drained while its oldest pending row is ready, so when a write fails
+and is backed off, rows enqueued after it wait behind it - a later row can
+never overtake an earlier one.
+
+Several processes may drain the same file: a drainer claims whole
+sessions (every ready row, under a lease of OUTBOX_CLAIM_SECONDS) in one
+write transaction before sending, and skips sessions another drainer holds.
+
+Permanent failures: a write Supabase rejects as a client error (4xx, a
+missing table or column, a constraint violation) can never succeed, so it
+is moved to the outbox_dead table instead of being retried, and the rest
+of its session keeps draining. Connection errors and 5xx/408/429 are
+retried with backoff for as long as it takes.
+
+Idempotency: inserted rows carry an `idempotency_key` and are sent as
+upserts that ignore duplicates, so a batch that reached Supabase but
+whose response was lost can be safely replayed.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'outbox.db')
+RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_BASE_DELAY', 1.0))
+RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', 60.0))
+# Lease on claimed rows; a drainer that dies mid-send releases its sessions after this
+CLAIM_SECONDS = float(os.getenv('OUTBOX_CLAIM_SECONDS', 60.0))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    session_id TEXT,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    match TEXT,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_by TEXT,
+    claimed_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (next_attempt_at, id);
+CREATE INDEX IF NOT EXISTS outbox_session ON outbox (session_id, id);
+CREATE TABLE IF NOT EXISTS outbox_dead (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL,
+    session_id TEXT,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    match TEXT,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """True for errors a retry can't fix: 4xx responses and PostgREST request/schema errors"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return 400 <= status < 500 and status not in (408, 429)
+    # postgrest APIError: PGRST1xx/2xx are bad requests and unknown tables/columns; Postgres
+    # classes 22/23/42 are bad data, constraint violations and undefined tables/columns
+    code = str(getattr(error, 'code', None) or '')
+    return code.startswith(('PGRST1', 'PGRST2')) or code[:2] in ('22', '23', '42')
+
+
+class Outbox:
+    """SQLite-backed queue of pending Supabase writes.
+
+    Safe to share between threads, and between processes through the same
+    file: WAL lets the BLE and camera pipelines enqueue concurrently, and
+    claims keep two drainers from sending the same session's rows.
+    """
+
+    def __init__(self, path: str = OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across process crashes in WAL mode; only an OS crash can lose the last commits
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if 'claimed_by' not in columns:
+            # Outbox files from before claims existed
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN claimed_by TEXT")
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN claimed_until REAL NOT NULL DEFAULT 0")
+
+        # Stats
+        self.sent = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_error = None
+
+        # Called (from the draining thread) with the idempotency keys of each committed group
+        self.commit_listeners = []
+
+    def enqueue(self, table: str, payload: dict, op: str = 'insert', match: dict = None,
+                session_id: str = None, idempotency_key: str = None) -> str:
+        """Durably queue one write; returns its idempotency key"""
+        key = idempotency_key or str(uuid.uuid4())
+        if op == 'insert':
+            payload = dict(payload, idempotency_key=key)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, session_id, table_name, op, payload, match, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, session_id, table, op, json.dumps(payload), json.dumps(match) if match else None, time.time())
+            )
+        return key
+
+    def update(self, table: str, fields: dict, match: dict, session_id: str = None) -> str:
+        """Queue an UPDATE (same signature as BatchedWriter.update)"""
+        return self.enqueue(table, fields, op='update', match=match, session_id=session_id)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def oldest_pending_age(self) -> float:
+        """Seconds the oldest queued write has been waiting (0 when empty)"""
+        with self._lock:
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM outbox").fetchone()[0]
+        return time.time() - oldest if oldest else 0.0
+
+    def _claim_ready_rows(self, token: str, limit: int):
+        """Claim up to `limit` ready rows, in order, from sessions nobody else holds.
+
+        A row is taken only if no older row of its session is backed off or
+        claimed by another send in flight, so neither a retry nor a second
+        process can let a later write of the session go first.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, idempotency_key, session_id, table_name, op, payload, match, attempts "
+                    "FROM outbox AS o WHERE next_attempt_at <= ? AND claimed_until <= ? "
+                    "AND NOT EXISTS (SELECT 1 FROM outbox AS h WHERE h.session_id IS o.session_id AND h.id < o.id "
+                    "AND (h.next_attempt_at > ? OR h.claimed_until > ?)) "
+                    "ORDER BY id LIMIT ?",
+                    (now, now, now, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE id = ?",
+                    [(token, now + CLAIM_SECONDS, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _release_claims(self, token: str):
+        """Return rows a send claimed but didn't deliver to the queue"""
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET claimed_by = NULL, claimed_until = 0 WHERE claimed_by = ?", (token,))
+
+    def _delete(self, ids: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def _dead_letter(self, row: tuple, error: str):
+        """Move a write Supabase will never accept out of the queue, keeping it for inspection"""
+        row_id, key, session_id, table, op, payload, match, attempts = row
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO outbox_dead (idempotency_key, session_id, table_name, op, payload, match, "
+                    "created_at, attempts, error, failed_at) "
+                    "SELECT idempotency_key, session_id, table_name, op, payload, match, created_at, ?, ?, ? "
+                    "FROM outbox WHERE id = ?",
+                    (attempts + 1, error, time.time(), row_id)
+                )
+                self._conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.dead_lettered += 1
+        print(f"❌ Supabase rejected {op} on {table} (session {session_id}), moved to outbox_dead: {error}")
+
+    def dead_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+
+    def _back_off_session(self, session_id, attempts: int, error: str):
+        """Delay every pending row of a session so replay order is preserved"""
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempts))
+        next_attempt_at = time.time() + delay
+        with self._lock:
+            if session_id is None:
+                self._conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE session_id IS NULL",
+                    (next_attempt_at, error)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE session_id = ?",
+                    (next_attempt_at, error, session_id)
+                )
+
+    def drain(self, supabase, batch_size: int = 100) -> int:
+        """Send up to batch_size ready writes to Supabase (blocking).
+
+        Consecutive inserts into the same table are grouped into one
+        multi-row upsert. A group rejected permanently is resent row by row
+        so only the bad rows are dead-lettered. Returns the number of rows sent.
+        """
+        token = str(uuid.uuid4())
+        rows = self._claim_ready_rows(token, batch_size)
+        blocked_sessions = set()
+        sent = 0
+
+        # Group consecutive rows that can go out as one request
+        groups = []
+        for row in rows:
+            row_id, key, session_id, table, op, payload, match, attempts = row
+            if session_id in blocked_sessions:
+                continue
+            last = groups[-1] if groups else None
+            if (op == 'insert' and last and last['op'] == 'insert'
+                    and last['table'] == table and last['session_id'] == session_id):
+                last['rows'].append(row)
+            else:
+                groups.append({'op': op, 'table': table, 'session_id': session_id, 'rows': [row]})
+
+        while groups:
+            group = groups.pop(0)
+            if group['session_id'] in blocked_sessions:
+                continue
+            try:
+                if group['op'] == 'insert':
+                    payloads = [json.loads(row[5]) for row in group['rows']]
+                    supabase.table(group['table']).upsert(
+                        payloads, on_conflict='idempotency_key', ignore_duplicates=True
+                    ).execute()
+                else:
+                    row = group['rows'][0]
+                    query = supabase.table(group['table']).update(json.loads(row[5]))
+                    for column, value in json.loads(row[6] or '{}').items():
+                        query = query.eq(column, value)
+                    query.execute()
+
+                self._delete([row[0] for row in group['rows']])
+                sent += len(group['rows'])
+                for listener in self.commit_listeners:
+                    listener([row[1] for row in group['rows']])
+            except Exception as e:
+                if is_permanent_error(e):
+                    if len(group['rows']) > 1:
+                        # Find the rejected row(s); the upsert makes resending the good ones harmless
+                        groups[:0] = [dict(group, rows=[row]) for row in group['rows']]
+                    else:
+                        self._dead_letter(group['rows'][0], str(e))
+                    continue
+                # Stop this session for now; other sessions keep draining
+                blocked_sessions.add(group['session_id'])
+                attempts = max(row[7] for row in group['rows'])
+                self._back_off_session(group['session_id'], attempts, str(e))
+                self.failures += 1
+                self.last_error = str(e)
+
+        # Rows left unsent (their session failed) go back to the queue
+        self._release_claims(token)
+        self.sent += sent
+        return sent
+
+    def send_now(self, supabase, keys: list) -> int:
+        """Send specific queued inserts immediately, ahead of the queue (blocking).
+
+        Used for writes that can't wait for the next batch. On failure the
+        rows simply stay queued for the normal drain; the upsert on
+        idempotency_key makes a later resend harmless.
+        """
+        token, now = str(uuid.uuid4()), time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Rows a drainer is already sending are left to it
+                rows = self._conn.execute(
+                    f"SELECT id, idempotency_key, table_name, payload FROM outbox "
+                    f"WHERE op = 'insert' AND claimed_until <= ? AND idempotency_key IN ({','.join('?' * len(keys))})",
+                    [now] + list(keys)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE id = ?",
+                    [(token, now + CLAIM_SECONDS, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        by_table = {}
+        for row in rows:
+            by_table.setdefault(row[2], []).append(row)
+
+        sent = 0
+        for table, group in by_table.items():
+            try:
+                supabase.table(table).upsert(
+                    [json.loads(row[3]) for row in group], on_conflict='idempotency_key', ignore_duplicates=True
+                ).execute()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                continue
+            self._delete([row[0] for row in group])
+            sent += len(group)
+            for listener in self.commit_listeners:
+                listener([row[1] for row in group])
+
+        self._release_claims(token)
+        self.sent += sent
+        return sent
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -3,19 +3,27 @@
 Quick Bluetooth scanner - just list all devices
 """
 import asyncio
-from bleak import BleakScanner
+import time
+from device_registry import DeviceRegistry, BackgroundScanner
 
 async def quick_scan():
     print("\n🔍 Scanning for Bluetooth devices (10 seconds)...\n")
 
-    devices = await BleakScanner.discover(timeout=10.0)
+    # Sightings are cached in the device registry for the other scripts
+    registry = DeviceRegistry()
+    scan_started = time.time()
+    await BackgroundScanner(registry, inspect_unknown=False).scan_for(10.0)
+    devices = [
+        (address, entry) for address, entry in registry.devices.items()
+        if entry.get('last_seen', 0) >= scan_started
+    ]
 
     print(f"Found {len(devices)} devices:\n")
     print("-" * 70)
 
-    for i, device in enumerate(devices, 1):
-        name = device.name if device.name else "❓ Unnamed"
-        print(f"{i:3d}. {name:30s} | {device.address}")
+    for i, (address, entry) in enumerate(devices, 1):
+        name = entry.get('name') or "❓ Unnamed"
+        print(f"{i:3d}. {name:30s} | {address} | RSSI {entry.get('rssi', '?')}")
 
     print("-" * 70)
     print("\nLook for:")
@@ -2,12 +2,325 @@
 """
 Master Monitoring Script
 Runs both Arduino BLE monitoring and Attention monitoring simultaneously
+
+    python3 run_monitoring.py               # one process: BLE on asyncio, camera in a thread
+    python3 run_monitoring.py --subprocess  # legacy: each pipeline in its own interpreter,
+                                            # coordinating through shared memory (shared_state.py)
 """
+from startup_profile import preload
+
 import asyncio
 import subprocess
 import sys
 import signal
 import os
+import selectors
+import threading
+import time
+from collections import deque
+
+from child_health import ComponentHealth, Heartbeat, parse_probe
+from shared_state import SharedSessionState, SHARED_STATE_ENV
+
+# Same device/driver the standalone scripts default to
+ARDUINO_ID = os.getenv('MONITORING_ARDUINO_ID', "642B8DC2-D778-8A47-20C2-B91C64716DBF")
+# How long to wait for the camera to open before continuing BLE-only
+CAMERA_READY_TIMEOUT_SECONDS = float(os.getenv('CAMERA_READY_TIMEOUT_SECONDS', 15))
+
+# Child output multiplexing (--subprocess mode)
+CHILD_BUFFER_LINES = int(os.getenv('CHILD_OUTPUT_BUFFER_LINES', 1000))
+CHILD_LINES_PER_TICK = int(os.getenv('CHILD_OUTPUT_LINES_PER_TICK', 200))
+CHILD_STATS_SECONDS = float(os.getenv('CHILD_OUTPUT_STATS_SECONDS', 60))
+SUPERVISION_TICK_SECONDS = 0.2
+
+
+class ChildOutput:
+    """Non-blocking reader for one child's stdout with a bounded line buffer.
+
+    Lines are timestamped when read. If the terminal can't keep up the
+    oldest buffered lines are dropped (and counted) so a chatty child can
+    never stall supervision or the other child's output.
+    """
+
+    def __init__(self, tag: str, process: subprocess.Popen, on_probe=None, max_lines: int = CHILD_BUFFER_LINES):
+        self.tag = tag
+        self.process = process
+        # Health probe lines (child_health.py) go here instead of the terminal
+        self.on_probe = on_probe
+        self.fd = process.stdout.fileno()
+        os.set_blocking(self.fd, False)
+        self.lines = deque(maxlen=max_lines)
+        self._partial = b''
+        self.eof = False
+
+        # Stats
+        self.lines_read = 0
+        self.bytes_read = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def read_available(self):
+        """Read whatever is in the pipe right now (called when the selector says it's readable)"""
+        try:
+            chunk = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        if not chunk:
+            self.eof = True
+            if self._partial:
+                self._append(self._partial)
+                self._partial = b''
+            return
+
+        self.bytes_read += len(chunk)
+        *complete, self._partial = (self._partial + chunk).split(b'\n')
+        for line in complete:
+            self._append(line)
+
+    def _append(self, raw: bytes):
+        line = raw.decode('utf-8', errors='replace').rstrip('\r')
+        probe = parse_probe(line)
+        if probe is not None and self.on_probe is not None:
+            # Handled at read time so a full buffer can never delay or drop a heartbeat
+            self.on_probe(probe[0])
+            return
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append((time.time(), line))
+        self.lines_read += 1
+        self.high_water = max(self.high_water, len(self.lines))
+
+    def drain(self):
+        """Read everything the pipe holds right now (e.g. a crashed child's last words)"""
+        while not self.eof:
+            before = self.bytes_read
+            self.read_available()
+            if self.bytes_read == before:
+                break
+
+    def emit(self, limit: int) -> int:
+        """Print up to `limit` buffered lines; returns how many were printed"""
+        printed = 0
+        while self.lines and printed < limit:
+            read_at, line = self.lines.popleft()
+            stamp = time.strftime('%H:%M:%S', time.localtime(read_at)) + f".{int(read_at % 1 * 1000):03d}"
+            print(f"[{stamp} {self.tag}] {line}")
+            printed += 1
+        return printed
+
+    def stats(self) -> str:
+        return (f"{self.tag}: {self.lines_read} lines / {self.bytes_read} B read, {len(self.lines)} buffered "
+                f"(peak {self.high_water}), {self.dropped} dropped")
+
+
+class OutputMultiplexer:
+    """Waits on every child pipe at once with selectors instead of blocking readline() calls"""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.children = []
+        self._last_stats = time.time()
+
+    def add(self, tag: str, process: subprocess.Popen, on_probe=None) -> ChildOutput:
+        child = ChildOutput(tag, process, on_probe)
+        self.selector.register(child.fd, selectors.EVENT_READ, child)
+        self.children.append(child)
+        return child
+
+    def remove(self, child: ChildOutput):
+        """Print the child's remaining output and stop watching its pipe"""
+        child.drain()
+        child.emit(len(child.lines))
+        if child in self.children:
+            self.children.remove(child)
+            try:
+                self.selector.unregister(child.fd)
+            except (KeyError, ValueError):
+                pass
+
+    def pump(self, timeout: float = SUPERVISION_TICK_SECONDS):
+        """Wait up to `timeout` for output, read every ready pipe, then print fairly"""
+        if self.children:
+            for key, _ in self.selector.select(timeout):
+                child = key.data
+                child.read_available()
+                if child.eof:
+                    self.selector.unregister(child.fd)
+        else:
+            time.sleep(timeout)
+
+        # Round-robin so one child's backlog can't hide the other's output
+        for child in self.children:
+            child.emit(CHILD_LINES_PER_TICK)
+
+        if CHILD_STATS_SECONDS and time.time() - self._last_stats >= CHILD_STATS_SECONDS:
+            self.report_stats()
+
+    def flush(self):
+        """Read what's left in the pipes and print everything still buffered"""
+        for child in self.children:
+            child.drain()
+            child.emit(len(child.lines))
+
+    def report_stats(self):
+        self._last_stats = time.time()
+        print("📊 Child output: " + " | ".join(child.stats() for child in self.children))
+
+
+class SessionLink:
+    """Thread-safe view of the BLE session for the camera thread.
+
+    The camera pipeline reads session/driver IDs and the safety score from
+    memory, and its penalties and liveness signals are applied on the BLE
+    event loop - the two pipelines no longer coordinate through Supabase.
+    """
+
+    def __init__(self, monitor, loop: asyncio.AbstractEventLoop):
+        self.monitor = monitor
+        self.loop = loop
+
+    @property
+    def session_id(self):
+        return self.monitor.session_id
+
+    @property
+    def driver_id(self):
+        return self.monitor.driver_id
+
+    @property
+    def safety_score(self) -> int:
+        return self.monitor.safety_score
+
+    def apply_penalty(self, penalty_points: int, timeout: float = 5.0) -> int:
+        """Deduct points through the BLE monitor's score logic; returns the new score"""
+        future = asyncio.run_coroutine_threadsafe(self.monitor.update_session_score(penalty_points), self.loop)
+        future.result(timeout)
+        return self.monitor.safety_score
+
+    def touch(self, source: str = 'camera'):
+        self.loop.call_soon_threadsafe(self.monitor.touch, source)
+
+
+class MonitoringOrchestrator:
+    """Both pipelines in one process, sharing one Supabase client, outbox writer and session.
+
+    The camera thread is supervised with readiness/liveness probes: when it
+    fails it is restarted with backoff while BLE keeps the session going.
+    """
+
+    def __init__(self, arduino_id: str = ARDUINO_ID, camera_index: int = None):
+        self.arduino_id = arduino_id
+        self.camera_index = camera_index
+        self.monitor = None
+        self.camera_health = ComponentHealth('camera', readiness_timeout=CAMERA_READY_TIMEOUT_SECONDS)
+        self.camera_thread = None
+        self.camera_done = threading.Event()
+        self.camera_stop = threading.Event()
+        self.camera_error = None
+
+    def run_camera(self, link: SessionLink, stop: threading.Event, done: threading.Event):
+        """Camera thread: open the camera, then process frames until told to stop"""
+        try:
+            from attention_supabase import AttentionMonitor
+
+            attention = AttentionMonitor(
+                driver_arduino_id=self.arduino_id,
+                iphone_camera_index=self.camera_index,
+                supabase=self.monitor.supabase,
+                outbox=self.monitor.writer.outbox,
+                session_link=link,
+                heartbeat=Heartbeat('camera', sink=self.camera_health.on_probe)
+            )
+            attention.run(stop_event=stop)
+        except Exception as e:
+            self.camera_error = e
+        finally:
+            done.set()
+
+    def start_camera(self, link: SessionLink):
+        """New camera attempt with its own stop/done events (a stuck thread is left behind)"""
+        self.camera_stop = threading.Event()
+        self.camera_done = threading.Event()
+        self.camera_error = None
+        self.camera_health.on_start()
+        self.camera_thread = threading.Thread(target=self.run_camera, args=(link, self.camera_stop, self.camera_done),
+                                              name='camera', daemon=True)
+        self.camera_thread.start()
+
+    def camera_failure(self):
+        """Why the current camera attempt failed, or None while it is healthy"""
+        if self.camera_done.is_set():
+            return str(self.camera_error or 'camera loop ended')
+        return self.camera_health.check()
+
+    async def wait_for_camera(self) -> bool:
+        """True once the camera is processing frames, False if it failed or timed out"""
+        while not self.camera_health.ready:
+            if self.camera_failure():
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def supervise_camera(self, link: SessionLink):
+        """A camera failure only drops attention monitoring - BLE carries on and the camera is retried"""
+        announced = self.camera_health.ready
+        while True:
+            reason = self.camera_failure()
+            if reason:
+                self.camera_stop.set()
+                delay = self.camera_health.on_failure()
+                print(f"\n⚠️  Attention monitoring down ({reason}) - continuing BLE-only, "
+                      f"retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                self.start_camera(link)
+                announced = False
+            elif self.camera_health.ready and not announced:
+                announced = True
+                print("\n✅ Attention monitoring back - BLE + Camera")
+            await asyncio.sleep(SUPERVISION_TICK_SECONDS)
+
+    async def run(self):
+        from ble_supabase import SupabaseDrivingMonitor, stream_with_reconnect
+
+        print("\n" + "="*60)
+        print("🚗 DRIVER MONITORING SYSTEM")
+        print("="*60)
+        print("Press Ctrl+C to stop all monitoring\n")
+
+        started = time.perf_counter()
+        # bleak and the camera stack (cv2) import in the background while the session is created
+        preload('bleak', 'attention_supabase')
+        print("🔵 Starting Arduino BLE monitoring...")
+        self.monitor = SupabaseDrivingMonitor(arduino_id=self.arduino_id)
+        if not await self.monitor.initialize_session():
+            return
+        # Readiness is the session actually existing, not a fixed sleep
+        print(f"   ✓ Session ready in {time.perf_counter() - started:.2f}s")
+
+        print("\n👁️ Starting attention monitoring...")
+        link = SessionLink(self.monitor, asyncio.get_running_loop())
+        self.start_camera(link)
+
+        print("\n" + "="*60)
+        if await self.wait_for_camera():
+            print(f"✅ ALL MONITORING ACTIVE (BLE + Camera) after {time.perf_counter() - started:.2f}s")
+        else:
+            reason = self.camera_failure() or "camera did not start in time"
+            print(f"✅ BLE MONITORING ACTIVE (Camera disabled for now: {reason})")
+        print("="*60 + "\n")
+
+        camera_supervisor = asyncio.create_task(self.supervise_camera(link))
+        try:
+            await stream_with_reconnect(self.monitor, self.arduino_id)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("\n\n🛑 Stopping all monitoring...")
+        finally:
+            camera_supervisor.cancel()
+            self.camera_stop.set()
+            await self.monitor.end_session()
+            await asyncio.to_thread(self.camera_thread.join, 5)
+            print("\n✅ All monitoring stopped")
+
 
 class MonitoringManager:
     def __init__(self):
@@ -43,36 +356,95 @@ class MonitoringManager:
     def cleanup_sessions(self):
         """Ensure all sessions are closed and driver is offline"""
         try:
-            from supabase import create_client
             from dotenv import load_dotenv
-            from datetime import datetime, timezone
-            import os
+            from session_lifecycle import close_stale_sessions, report, set_drivers_offline
+            from supabase_client import get_supabase
 
             load_dotenv()
-            supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_SERVICE_KEY'))
-
-            driver_id = 'b52c0e82-8edf-4049-9696-fd4b9fcffc7c'
-
-            # Close any active sessions
-            active = supabase.table('driving_sessions').select('*').eq('driver_id', driver_id).eq('status', 'active').execute()
-
-            if active.data:
-                print(f"   🧹 Cleaning up {len(active.data)} active session(s)...")
-                for session in active.data:
-                    supabase.table('driving_sessions').update({
-                        'status': 'completed',
-                        'ended_at': datetime.now(timezone.utc).isoformat()
-                    }).eq('id', session['id']).execute()
-
-            # Set driver offline
-            supabase.table('drivers').update({
-                'connection_status': 'offline'
-            }).eq('id', driver_id).execute()
+            supabase = get_supabase()
+
+            # Our driver: the BLE child published it in shared memory, otherwise look it up by device
+            shared_state = getattr(self, 'shared_state', None)
+            driver_id = ((shared_state.session() if shared_state else None) or {}).get('driver_id')
+            if not driver_id:
+                driver = supabase.table('drivers').select('id').eq('arduino_id', ARDUINO_ID).execute()
+                driver_id = driver.data[0]['id'] if driver.data else None
+            if not driver_id:
+                print(f"   ⚠️  No driver for Arduino ID {ARDUINO_ID} - nothing to clean up")
+                return
+
+            # Every session the children left open, closed in bulk with the driver set offline
+            report(close_stale_sessions(supabase, stale_seconds=0, driver_ids=[driver_id]))
+            set_drivers_offline(supabase, {driver_id})
 
             print("   ✓ Sessions closed and driver set offline")
         except Exception as e:
             print(f"   ⚠️  Cleanup warning: {e}")
 
+    def start_child(self, tag: str, script: str, health: ComponentHealth) -> subprocess.Popen:
+        """Start a pipeline script with health probes on and its output multiplexed"""
+        process = subprocess.Popen(
+            [sys.executable, script],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, 'MONITORING_SUPERVISED': '1', 'PYTHONUNBUFFERED': '1',
+                 SHARED_STATE_ENV: self.shared_state.name}
+        )
+        health.on_start()
+        self.outputs[tag] = self.output.add(tag, process, on_probe=health.on_probe)
+        return process
+
+    def start_camera(self):
+        print("\n👁️ Starting attention monitoring...")
+        try:
+            self.attention_process = self.start_child('CAM', 'attention_supabase.py', self.camera_health)
+            print("   ✓ Attention monitoring started (PID: {})".format(self.attention_process.pid))
+        except Exception as e:
+            print(f"   ⚠️  Could not start attention monitoring: {e}")
+            self.attention_process = None
+            self.camera_health.on_failure()
+        self.camera_announced = False
+
+    def degrade_camera(self, reason: str):
+        """Drop to BLE-only and schedule a camera restart - the session stays open"""
+        if self.attention_process.poll() is None:
+            self.attention_process.send_signal(signal.SIGINT)
+            try:
+                self.attention_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.attention_process.kill()
+                self.attention_process.wait()
+        self.output.remove(self.outputs.pop('CAM'))
+        self.attention_process = None
+
+        delay = self.camera_health.on_failure()
+        print(f"\n⚠️  Attention monitoring down ({reason}) - continuing BLE-only")
+        print(f"   🔁 Restarting camera in {delay:.1f}s (failure {self.camera_health.failures})")
+
+    def supervise_camera(self):
+        """One supervision tick for the camera child: probe, degrade, restart or promote"""
+        if self.attention_process is None:
+            if self.camera_health.restart_due():
+                self.start_camera()
+            return
+
+        returncode = self.attention_process.poll()
+        reason = f"exited with code {returncode}" if returncode is not None else self.camera_health.check()
+        if reason:
+            self.degrade_camera(reason)
+        elif self.camera_health.ready and not self.camera_announced:
+            self.camera_announced = True
+            print("\n✅ ALL MONITORING ACTIVE (BLE + Camera)")
+
+    def supervise_ble(self):
+        """BLE owns the session, so it is never restarted - a stuck BLE pipeline is only reported"""
+        reason = self.ble_health.check()
+        if reason and not self.ble_warned:
+            print(f"\n⚠️  BLE monitoring unresponsive ({reason})")
+        elif not reason and self.ble_warned:
+            print("\n✅ BLE monitoring responsive again")
+        self.ble_warned = bool(reason)
+
     def run(self):
         """Start both monitoring processes"""
         print("\n" + "="*60)
@@ -84,113 +456,79 @@ class MonitoringManager:
         # Set up signal handler for Ctrl+C
         signal.signal(signal.SIGINT, self.signal_handler)
 
+        self.output = OutputMultiplexer()
+        self.outputs = {}
+        self.ble_health = ComponentHealth('ble')
+        self.camera_health = ComponentHealth('camera')
+        self.ble_warned = False
+        self.camera_announced = False
+        # Session, score and event times are shared through memory, not Supabase queries
+        self.shared_state = SharedSessionState.create()
+
         try:
             # Start BLE monitoring in background
             print("🔵 Starting Arduino BLE monitoring...")
-            self.ble_process = subprocess.Popen(
-                [sys.executable, 'ble_supabase.py'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1
-            )
+            self.ble_process = self.start_child('BLE', 'ble_supabase.py', self.ble_health)
             print("   ✓ BLE monitoring started (PID: {})".format(self.ble_process.pid))
 
-            # Wait a bit for session to be created
-            print("\n⏳ Waiting 3 seconds for session initialization...")
-            import time
-            time.sleep(3)
+            # The camera looks up the BLE session, so wait for BLE readiness (not a fixed sleep)
+            print("\n⏳ Waiting for session initialization...")
+            while not self.ble_health.ready and self.ble_process.poll() is None and not self.ble_health.check():
+                self.output.pump()
+            if self.ble_health.ready:
+                print("   ✓ Session ready")
+            else:
+                print("   ⚠️  BLE monitoring did not report ready - starting the camera anyway")
 
-            # Start attention monitoring
-            print("\n👁️ Starting attention monitoring...")
-            try:
-                self.attention_process = subprocess.Popen(
-                    [sys.executable, 'attention_supabase.py'],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True,
-                    bufsize=1
-                )
-                print("   ✓ Attention monitoring started (PID: {})".format(self.attention_process.pid))
-
-                # Wait a moment to see if it crashes immediately due to no camera
-                time.sleep(2)
-                if self.attention_process.poll() is not None:
-                    # Process ended - likely no camera
-                    print("   ⚠️  Attention monitoring failed to start (camera not available)")
-                    print("   ℹ️  Continuing with BLE monitoring only...")
-                    print("\n   💡 To enable attention monitoring:")
-                    print("      1. Connect iPhone via Continuity Camera")
-                    print("      2. Or ensure Mac camera is available")
-                    print("      3. Then restart: python3 run_monitoring.py")
-                    self.attention_process = None
-            except Exception as e:
-                print(f"   ⚠️  Could not start attention monitoring: {e}")
-                print("   ℹ️  Continuing with BLE monitoring only...")
-                self.attention_process = None
+            # A camera that fails to start is retried with backoff instead of being given up on
+            self.start_camera()
 
             print("\n" + "="*60)
-            if self.attention_process:
-                print("✅ ALL MONITORING ACTIVE (BLE + Camera)")
-            else:
-                print("✅ BLE MONITORING ACTIVE (Camera disabled)")
+            print("✅ BLE MONITORING ACTIVE (Camera joins once it reports ready)")
             print("="*60)
             print("\n📊 Monitoring Output:")
             print("-"*60 + "\n")
 
             # Monitor both processes and display output
             while self.running:
-                # Check if BLE process ended - if so, kill everything
+                # Check if BLE process ended - it owns the session, so that ends the trip
                 if self.ble_process.poll() is not None:
+                    self.output.flush()
                     print("\n⚠️  BLE monitoring process ended")
                     print("   🛑 Stopping all processes...")
 
                     # Kill attention process if running
                     if self.attention_process:
-                        import signal as sig_module
-                        self.attention_process.send_signal(sig_module.SIGINT)
+                        self.attention_process.send_signal(signal.SIGINT)
                         self.attention_process.wait(timeout=5)
 
                     # Cleanup sessions
+                    self.output.report_stats()
                     self.cleanup_sessions()
                     break
 
-                # Check if attention process ended - if so, kill everything
-                if self.attention_process and self.attention_process.poll() is not None:
-                    print("\n⚠️  Attention monitoring process ended")
-                    print("   🛑 Stopping all processes...")
-
-                    # Kill BLE process
-                    if self.ble_process:
-                        import signal as sig_module
-                        self.ble_process.send_signal(sig_module.SIGINT)
-                        self.ble_process.wait(timeout=5)
-
-                    # Cleanup sessions
-                    self.cleanup_sessions()
-                    break
-
-                # Read output from BLE process
-                if self.ble_process.stdout:
-                    ble_line = self.ble_process.stdout.readline()
-                    if ble_line:
-                        print(f"[BLE] {ble_line}", end='')
-
-                # Read output from attention process
-                if self.attention_process and self.attention_process.stdout:
-                    attention_line = self.attention_process.stdout.readline()
-                    if attention_line:
-                        print(f"[CAM] {attention_line}", end='')
+                self.supervise_ble()
+                self.supervise_camera()
 
-                time.sleep(0.1)
+                # Wait on both pipes at once; returns within a tick even if both are quiet
+                self.output.pump()
 
         except Exception as e:
             print(f"\n❌ Error: {e}")
             self.signal_handler(None, None)
+        finally:
+            self.shared_state.close()
 
 def main():
-    manager = MonitoringManager()
-    manager.run()
+    if '--subprocess' in sys.argv:
+        manager = MonitoringManager()
+        manager.run()
+        return
+
+    try:
+        asyncio.run(MonitoringOrchestrator().run())
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
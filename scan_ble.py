@@ -1,24 +1,40 @@
 #!/usr/bin/env python3
 """Quick BLE scanner to detect nearby devices"""
 import asyncio
-from bleak import BleakScanner
+import time
+from device_registry import DeviceRegistry, BackgroundScanner
 
 async def scan():
+    registry = DeviceRegistry()
+
+    # A recently seen Arduino answers the question without scanning
+    known = registry.known_arduinos(max_age=300)
+    if known:
+        address, entry = known[0]
+        print(f"⚡ {entry.get('name', 'Arduino')} seen recently at {address} (cached in {registry.path})")
+        print("✅ Arduino is already programmed and ready!")
+        return
+
     print("🔍 Scanning for BLE devices...")
     print("(This may take 5-10 seconds)\n")
     
-    devices = await BleakScanner.discover(timeout=10.0)
+    scan_started = time.time()
+    await BackgroundScanner(registry, inspect_unknown=False).scan_for(10.0)
+    devices = [
+        (address, entry) for address, entry in registry.devices.items()
+        if entry.get('last_seen', 0) >= scan_started
+    ]
     
     print(f"Found {len(devices)} device(s):\n")
     
     arduino_found = False
-    for i, device in enumerate(devices, 1):
-        name = device.name if device.name else "(Unknown)"
+    for i, (address, entry) in enumerate(devices, 1):
+        name = entry.get('name') or "(Unknown)"
         print(f"{i}. {name}")
-        print(f"   Address: {device.address}")
+        print(f"   Address: {address}")
         print()
         
-        if name != "(Unknown)" and ("Driving Monitor" in name or "Arduino" in name):
+        if entry.get('is_arduino') or (name != "(Unknown)" and ("Driving Monitor" in name or "Arduino" in name)):
             arduino_found = True
             print("   ⭐ THIS IS YOUR ARDUINO! ⭐\n")
     
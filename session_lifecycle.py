@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Bulk session lifecycle
+Closes stale `active` driving sessions across all drivers in one pass:
+per-session event totals are computed on the way, sessions are completed
+and drivers left without an active session are set offline - in bulk, not
+one UPDATE per session.
+
+A session is stale when it started before the cutoff and its driver has
+not sent a heartbeat since (monitors refresh drivers.last_heartbeat every
+10 s while they run).
+
+Preferred path is the close_stale_sessions() database function (see
+SUPABASE_DATABASE_GUIDE.md): one statement, rows locked with SKIP LOCKED
+so concurrent sweepers don't collide. Without it, pages of
+SESSION_SWEEP_PAGE_SIZE sessions are closed with a handful of bulk `in_`
+requests each.
+
+    python3 session_lifecycle.py sweep [--stale-seconds 900] [--loop]
+"""
+import asyncio
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+SWEEP_STALE_SECONDS = float(os.getenv('SESSION_SWEEP_STALE_SECONDS', 900))
+# 0 disables the periodic sweeper in long-running processes (ble_hub.py)
+SWEEP_INTERVAL_SECONDS = float(os.getenv('SESSION_SWEEP_INTERVAL_SECONDS', 300))
+# Sessions per page; their IDs go into the request URL of the `in_` filters
+SWEEP_PAGE_SIZE = int(os.getenv('SESSION_SWEEP_PAGE_SIZE', 200))
+
+CLOSE_STALE_SESSIONS_RPC = 'close_stale_sessions'
+TOTAL_COLUMNS = {
+    'SWERVING': 'total_swerving',
+    'HARSH_BRAKE': 'total_harsh_brake',
+    'AGGRESSIVE': 'total_aggressive'
+}
+
+
+def _isoformat(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).isoformat()
+
+
+def close_stale_sessions(supabase, stale_seconds: float = SWEEP_STALE_SECONDS, driver_ids: list = None) -> dict:
+    """Close stale active sessions (of `driver_ids`, or of every driver).
+
+    Returns {'sessions', 'drivers', 'via'}. stale_seconds=0 closes every
+    active session of the given drivers, e.g. when a runner shuts down.
+    """
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    try:
+        rows = supabase.rpc(CLOSE_STALE_SESSIONS_RPC, {
+            'stale_before': _isoformat(stale_before),
+            'only_drivers': list(driver_ids) if driver_ids is not None else None
+        }).execute().data or []
+        return {'sessions': len(rows), 'drivers': len({row['driver_id'] for row in rows}), 'via': 'rpc'}
+    except Exception as e:
+        print(f"   ℹ️  {CLOSE_STALE_SESSIONS_RPC}() unavailable ({e}) - closing sessions with bulk updates")
+    return _close_in_pages(supabase, stale_before, driver_ids)
+
+
+def _close_in_pages(supabase, stale_before: datetime, driver_ids: list = None) -> dict:
+    cutoff = _isoformat(stale_before)
+    closed_sessions = 0
+    offline_drivers = set()
+    after_id = None
+
+    # Keyset pagination on id, so sessions of live drivers are walked past only once
+    while True:
+        query = supabase.table('driving_sessions').select('id', 'driver_id').eq('status', 'active').lt('started_at', cutoff)
+        if driver_ids is not None:
+            query = query.in_('driver_id', list(driver_ids))
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        page = query.order('id').limit(SWEEP_PAGE_SIZE).execute().data or []
+        if not page:
+            break
+        after_id = page[-1]['id']
+
+        # Drivers that sent a heartbeat after the cutoff are still driving
+        page_drivers = {row['driver_id'] for row in page}
+        drivers = supabase.table('drivers').select('id', 'last_heartbeat').in_('id', list(page_drivers)).execute().data or []
+        alive = {d['id'] for d in drivers if d.get('last_heartbeat') and d['last_heartbeat'] >= cutoff}
+        stale = [row for row in page if row['driver_id'] not in alive]
+
+        if stale:
+            closed_sessions += _close_page(supabase, stale)
+            offline_drivers |= set_drivers_offline(supabase, {row['driver_id'] for row in stale})
+        if len(page) < SWEEP_PAGE_SIZE:
+            break
+
+    return {'sessions': closed_sessions, 'drivers': len(offline_drivers), 'via': 'bulk'}
+
+
+def _close_page(supabase, sessions: list) -> int:
+    """Complete a page of sessions with their event totals; one UPDATE per distinct set of totals"""
+    session_ids = [row['id'] for row in sessions]
+
+    # Paged as well - a page of long trips can hold more events than one response returns
+    counts = defaultdict(Counter)
+    after_id = None
+    while True:
+        query = supabase.table('events').select('id', 'session_id', 'event_type').in_('session_id', session_ids)
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        events = query.order('id').limit(SWEEP_PAGE_SIZE * 5).execute().data or []
+        for event in events:
+            counts[event['session_id']][event['event_type']] += 1
+        if len(events) < SWEEP_PAGE_SIZE * 5:
+            break
+        after_id = events[-1]['id']
+
+    # Most sessions share the same totals (often all zero), so this is a few requests per page
+    by_totals = defaultdict(list)
+    for session_id in session_ids:
+        session_counts = counts[session_id]
+        totals = tuple(session_counts[event_type] for event_type in TOTAL_COLUMNS) + (sum(session_counts.values()),)
+        by_totals[totals].append(session_id)
+
+    ended_at = _isoformat(datetime.now(timezone.utc))
+    for totals, ids in by_totals.items():
+        fields = dict(zip(TOTAL_COLUMNS.values(), totals))
+        fields.update(total_events=totals[-1], status='completed', ended_at=ended_at)
+        supabase.table('driving_sessions').update(fields).in_('id', ids).eq('status', 'active').execute()
+    return len(session_ids)
+
+
+def set_drivers_offline(supabase, driver_ids: set) -> set:
+    """Set drivers offline unless they still have another active session"""
+    still_active = supabase.table('driving_sessions').select('driver_id').eq('status', 'active') \
+        .in_('driver_id', list(driver_ids)).execute().data or []
+    offline = driver_ids - {row['driver_id'] for row in still_active}
+    if offline:
+        supabase.table('drivers').update({
+            'status': 'inactive',
+            'connection_status': 'offline'
+        }).in_('id', list(offline)).execute()
+    return offline
+
+
+def report(result: dict):
+    if result['sessions']:
+        print(f"   🧹 Closed {result['sessions']} stale session(s), {result['drivers']} driver(s) set offline "
+              f"({result['via']})")
+
+
+async def sweep_forever(supabase, interval: float = SWEEP_INTERVAL_SECONDS, stale_seconds: float = SWEEP_STALE_SECONDS):
+    """Periodic sweeper job; the blocking requests run off the event loop"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                report(await asyncio.to_thread(close_stale_sessions, supabase, stale_seconds))
+            except Exception as e:
+                print(f"⚠️  Session sweep failed: {e}")
+    except asyncio.CancelledError:
+        pass
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != 'sweep':
+        print(__doc__)
+        return
+
+    from dotenv import load_dotenv
+    from supabase_client import get_supabase
+
+    load_dotenv()
+    stale_seconds = float(args[args.index('--stale-seconds') + 1]) if '--stale-seconds' in args else SWEEP_STALE_SECONDS
+    supabase = get_supabase()
+
+    if '--loop' in args:
+        print(f"🧹 Sweeping sessions idle for {stale_seconds:g}s every {SWEEP_INTERVAL_SECONDS:g}s")
+        report(close_stale_sessions(supabase, stale_seconds))
+        try:
+            asyncio.run(sweep_forever(supabase, SWEEP_INTERVAL_SECONDS, stale_seconds))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    result = close_stale_sessions(supabase, stale_seconds)
+    report(result)
+    if not result['sessions']:
+        print("   ✓ No stale sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Local session timeout monitor
+Detects idle sessions from in-process liveness signals (BLE notifications,
+camera frames) instead of polling `drivers.last_heartbeat` in Supabase.
+
+Deadlines live in a heap keyed on the monotonic clock. touch() is O(1):
+it only records the time. When a deadline comes due and the session was
+touched since, it is pushed back with its new deadline, so each check is
+O(log n) no matter how many sessions a hub process watches.
+"""
+import asyncio
+import heapq
+import os
+import time
+
+SESSION_TIMEOUT_SECONDS = float(os.getenv('SESSION_TIMEOUT_SECONDS', 300))
+
+
+class LivenessMonitor:
+    def __init__(self):
+        self._heap = []
+        self._sessions = {}
+        self._wakeup = asyncio.Event()
+        self.task = None
+        self.expired = 0
+
+    def register(self, key, on_timeout, timeout: float = SESSION_TIMEOUT_SECONDS):
+        """Watch a session; `on_timeout` (async, no args) runs once it has been idle for `timeout`"""
+        now = time.monotonic()
+        self._sessions[key] = {
+            'timeout': timeout,
+            'on_timeout': on_timeout,
+            'last_seen': now,
+            'sources': {}
+        }
+        heapq.heappush(self._heap, (now + timeout, key))
+        self._wakeup.set()
+
+    def unregister(self, key):
+        """Stop watching a session (stale heap entries are skipped lazily)"""
+        self._sessions.pop(key, None)
+
+    def touch(self, key, source: str = 'ble'):
+        """Record activity from a liveness source such as 'ble' or 'camera'"""
+        session = self._sessions.get(key)
+        if session:
+            now = time.monotonic()
+            session['last_seen'] = now
+            session['sources'][source] = now
+
+    def idle_seconds(self, key) -> float:
+        session = self._sessions.get(key)
+        return time.monotonic() - session['last_seen'] if session else 0.0
+
+    def start(self):
+        """Start the monitor task (must be called inside the event loop)"""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+
+            while self._heap and self._heap[0][0] <= now:
+                _, key = heapq.heappop(self._heap)
+                session = self._sessions.get(key)
+                if session is None:
+                    continue
+
+                deadline = session['last_seen'] + session['timeout']
+                if deadline > now:
+                    # Touched since this entry was pushed - check again at the new deadline
+                    heapq.heappush(self._heap, (deadline, key))
+                    continue
+
+                del self._sessions[key]
+                self.expired += 1
+                asyncio.create_task(session['on_timeout']())
+
+            delay = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
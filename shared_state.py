@@ -0,0 +1,214 @@
+"""
+Shared-memory session state between the BLE and camera processes
+In run_monitoring.py --subprocess mode the two pipelines used to
+coordinate through Supabase: the camera looked the session up in
+`driving_sessions` and did its own read-modify-write on `safety_score`.
+They now share one small multiprocessing.shared_memory block instead,
+created by the runner and named in MONITORING_SHARED_STATE.
+
+The block has two regions, each written by exactly one process:
+
+    BLE      session ID, driver ID, safety score, active flag,
+             event sequence counter and last time of each driving event
+    camera   cumulative penalty points, event sequence counter and last
+             time of each attention event
+
+Each region starts with a sequence counter (seqlock): the writer makes it
+odd, writes the fields, then makes it even again. Readers retry while it is
+odd or changed under them, so no lock is shared between processes. The
+camera never touches the score: it adds to its penalty total and the BLE
+pipeline applies the difference through update_session_score.
+"""
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+SHARED_STATE_ENV = 'MONITORING_SHARED_STATE'
+# How often the BLE pipeline picks up camera penalties
+SHARED_STATE_POLL_SECONDS = float(os.getenv('SHARED_STATE_POLL_SECONDS', 0.1))
+
+BLE_EVENT_TYPES = ('HARSH_BRAKE', 'AGGRESSIVE', 'SWERVING', 'CRASH')
+CAMERA_EVENT_TYPES = ('DISTRACTED', 'DROWSY', 'EYES_CLOSED')
+
+_SEQ = struct.Struct('<Q')
+# session_id, driver_id, safety_score, active, event_seq, updated_at, last event times
+_BLE = struct.Struct(f'<40s40siiQd{len(BLE_EVENT_TYPES)}d')
+# penalty_total, event_seq, updated_at, last event times
+_CAMERA = struct.Struct(f'<QQd{len(CAMERA_EVENT_TYPES)}d')
+
+BLE_OFFSET = 0
+CAMERA_OFFSET = 256
+BLOCK_SIZE = 512
+# A writer that died mid-update leaves its counter odd; give up instead of spinning forever
+MAX_READ_RETRIES = 10000
+
+
+def _text(raw: bytes):
+    value = raw.rstrip(b'\0').decode('ascii')
+    return value or None
+
+
+class SharedSessionState:
+    """One process's handle on the shared block"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool = False):
+        self.shm = shm
+        self.owner = owner
+        self._ble = {'session_id': None, 'driver_id': None, 'safety_score': 100, 'active': False,
+                     'event_seq': 0, 'last_events': dict.fromkeys(BLE_EVENT_TYPES, 0.0)}
+        self._camera = {'penalty_total': 0, 'event_seq': 0,
+                        'last_events': dict.fromkeys(CAMERA_EVENT_TYPES, 0.0)}
+
+    @classmethod
+    def create(cls, name: str = None):
+        """New zeroed block (the runner creates it and unlinks it at exit)"""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=BLOCK_SIZE)
+        shm.buf[:BLOCK_SIZE] = bytes(BLOCK_SIZE)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str):
+        shm = shared_memory.SharedMemory(name=name)
+        # Before 3.13 every attaching process registers the block with its resource
+        # tracker, which would unlink it when the child exits - only the runner owns it
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return cls(shm)
+
+    @classmethod
+    def from_env(cls):
+        """The runner's block when started by run_monitoring.py, else None"""
+        name = os.getenv(SHARED_STATE_ENV)
+        if not name:
+            return None
+        try:
+            return cls.attach(name)
+        except FileNotFoundError:
+            print(f"⚠️  Shared state block {name} not found - coordinating through Supabase")
+            return None
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    # Seqlock primitives
+
+    def _write(self, offset: int, layout: struct.Struct, values: tuple):
+        buf = self.shm.buf
+        seq = _SEQ.unpack_from(buf, offset)[0]
+        _SEQ.pack_into(buf, offset, seq + 1)
+        layout.pack_into(buf, offset + _SEQ.size, *values)
+        _SEQ.pack_into(buf, offset, seq + 2)
+
+    def _read(self, offset: int, layout: struct.Struct):
+        buf = self.shm.buf
+        for attempt in range(MAX_READ_RETRIES):
+            before = _SEQ.unpack_from(buf, offset)[0]
+            if not before & 1:
+                values = layout.unpack_from(buf, offset + _SEQ.size)
+                if _SEQ.unpack_from(buf, offset)[0] == before:
+                    return before, values
+            if attempt % 100 == 99:
+                time.sleep(0)
+        return None
+
+    # BLE side (single writer)
+
+    def _write_ble(self):
+        state = self._ble
+        self._write(BLE_OFFSET, _BLE, (
+            (state['session_id'] or '').encode('ascii'), (state['driver_id'] or '').encode('ascii'),
+            int(state['safety_score']), int(state['active']), state['event_seq'], time.time(),
+            *(state['last_events'][t] for t in BLE_EVENT_TYPES)
+        ))
+
+    def publish_session(self, session_id: str, driver_id: str, safety_score: int = 100):
+        self._ble.update(session_id=session_id, driver_id=driver_id, safety_score=safety_score, active=True)
+        self._write_ble()
+
+    def publish_score(self, safety_score: int):
+        self._ble['safety_score'] = safety_score
+        self._write_ble()
+
+    def publish_event(self, event_type: str, at: float = None):
+        self._ble['event_seq'] += 1
+        if event_type in self._ble['last_events']:
+            self._ble['last_events'][event_type] = at or time.time()
+        self._write_ble()
+
+    def end_session(self):
+        self._ble['active'] = False
+        self._write_ble()
+
+    # Camera side (single writer)
+
+    def add_penalty(self, points: int, event_type: str = None, at: float = None):
+        """Request a score deduction; the BLE pipeline applies it
+
+        Continues from the totals in the block, not from this handle: a
+        restarted camera process must keep counting where the last one
+        stopped, or the BLE side would see its total go backwards.
+        """
+        state = self._camera
+        stored = self.camera()
+        if stored is not None:
+            state.update(penalty_total=stored['penalty_total'], event_seq=stored['event_seq'],
+                         last_events=stored['last_events'])
+        state['penalty_total'] += points
+        state['event_seq'] += 1
+        if event_type in state['last_events']:
+            state['last_events'][event_type] = at or time.time()
+        self._write(CAMERA_OFFSET, _CAMERA, (
+            state['penalty_total'], state['event_seq'], time.time(),
+            *(state['last_events'][t] for t in CAMERA_EVENT_TYPES)
+        ))
+
+    # Readers
+
+    def session(self):
+        """Consistent snapshot of the BLE region, or None if it can't be read"""
+        snapshot = self._read(BLE_OFFSET, _BLE)
+        if snapshot is None:
+            return None
+        seq, (session_id, driver_id, score, active, event_seq, updated_at, *last) = snapshot
+        return {
+            'seq': seq,
+            'session_id': _text(session_id),
+            'driver_id': _text(driver_id),
+            'safety_score': score,
+            'active': bool(active),
+            'event_seq': event_seq,
+            'updated_at': updated_at,
+            'last_events': dict(zip(BLE_EVENT_TYPES, last))
+        }
+
+    def camera(self):
+        """Consistent snapshot of the camera region, or None if it can't be read"""
+        snapshot = self._read(CAMERA_OFFSET, _CAMERA)
+        if snapshot is None:
+            return None
+        seq, (penalty_total, event_seq, updated_at, *last) = snapshot
+        return {
+            'seq': seq,
+            'penalty_total': penalty_total,
+            'event_seq': event_seq,
+            'updated_at': updated_at,
+            'last_events': dict(zip(CAMERA_EVENT_TYPES, last))
+        }
+
+    def last_event_time(self) -> float:
+        """Most recent event of either pipeline (0 when there was none)"""
+        session, camera = self.session() or {}, self.camera() or {}
+        return max([0.0, *session.get('last_events', {}).values(), *camera.get('last_events', {}).values()])
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Startup profiling and the time-to-first-notification benchmark
+
+Profile a cold start - import cost per package, initialization phases and
+milestones (session ready, camera ready, first BLE notification):
+    STARTUP_PROFILE=1 python3 run_monitoring.py
+
+Track time-to-first-notification as a regression benchmark. Each run is a
+fresh interpreter that imports the BLE pipeline, starts a session against
+the in-memory backend and processes its first notification:
+    python3 startup_profile.py bench [--runs 5] [--update-baseline]
+
+The bench compares the median against STARTUP_BASELINE_PATH and exits 1
+when it is more than STARTUP_REGRESSION_TOLERANCE slower.
+
+Entry points import this module before anything heavy so the import timer
+sees every package they pull in.
+"""
+import builtins
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Close enough to interpreter start: entry points import this first
+PROCESS_STARTED = time.perf_counter()
+
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE') == '1'
+BASELINE_PATH = os.getenv('STARTUP_BASELINE_PATH', 'startup_baseline.json')
+# Allowed slowdown of the median over the baseline before the bench fails
+REGRESSION_TOLERANCE = float(os.getenv('STARTUP_REGRESSION_TOLERANCE', 0.25))
+# Rows shown in the import table
+TOP_IMPORTS = 15
+
+
+class StartupProfile:
+    """Import costs, timed init phases and milestones of this process"""
+
+    def __init__(self, enabled: bool = STARTUP_PROFILE):
+        self.enabled = enabled
+        # Top-level package -> seconds of its first import (includes what it imports)
+        self.imports = {}
+        self.phases = []
+        self.marks = {}
+        self._importing = set()
+        self._original_import = None
+        self._lock = threading.Lock()
+
+    def install_import_timer(self):
+        if self._original_import is not None:
+            return
+        self._original_import = original = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            top = name.partition('.')[0]
+            if level or not top or top in sys.modules or top in self._importing:
+                return original(name, globals, locals, fromlist, level)
+            self._importing.add(top)
+            started = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                self._importing.discard(top)
+                self.imports[top] = self.imports.get(top, 0.0) + time.perf_counter() - started
+
+        builtins.__import__ = timed_import
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time an initialization step"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - started))
+
+    def mark(self, name: str) -> float:
+        """Record a milestone (first time only); returns seconds since process start"""
+        elapsed = time.perf_counter() - PROCESS_STARTED
+        with self._lock:
+            if name in self.marks:
+                return self.marks[name]
+            self.marks[name] = elapsed
+        if self.enabled:
+            print(f"⏱️  {name.replace('_', ' ')} {elapsed:.2f}s after start")
+            if name == 'first_notification':
+                # Cold start is over
+                self.print_report()
+        return elapsed
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                'imports': dict(sorted(self.imports.items(), key=lambda item: -item[1])),
+                'phases': list(self.phases),
+                'marks': dict(self.marks)
+            }
+
+    def print_report(self):
+        report = self.report()
+        print("⏱️  Startup profile (seconds):")
+        print("   imports (first import, incl. nested):")
+        for name, seconds in list(report['imports'].items())[:TOP_IMPORTS]:
+            print(f"      {name:28s} {seconds:7.3f}")
+        if report['phases']:
+            print("   init phases:")
+            for name, seconds in report['phases']:
+                print(f"      {name:28s} {seconds:7.3f}")
+        if report['marks']:
+            print("   milestones (since start):")
+            for name, seconds in sorted(report['marks'].items(), key=lambda item: item[1]):
+                print(f"      {name:28s} {seconds:7.3f}")
+
+
+def preload(*modules: str):
+    """Import modules on a background thread, e.g. bleak while the session is being created"""
+    def run():
+        for module in modules:
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+    thread = threading.Thread(target=run, name='preload', daemon=True)
+    thread.start()
+    return thread
+
+
+profile = StartupProfile()
+if profile.enabled:
+    profile.install_import_timer()
+
+
+# Benchmark: one cold start per fresh interpreter
+
+BENCH_CHILD = r'''
+import asyncio, contextlib, io, json, time
+started = time.time()
+from startup_profile import profile
+profile.enabled = False
+from ble_replay import build_fake_pipeline
+
+async def main():
+    monitor, _ = build_fake_pipeline(arduino_id='BENCH-001')
+    with contextlib.redirect_stdout(io.StringIO()):
+        monitor.writer.start()
+        monitor.notifier.start()
+        await monitor.initialize_session()
+        session_ready = time.time()
+        await monitor.process_data("0.01,0.02,1.00,,0,1000")
+        first_notification = time.time()
+        await monitor.end_session()
+        await monitor.notifier.stop()
+        await monitor.writer.stop()
+    print(json.dumps({'started': started, 'session_ready': session_ready,
+                      'first_notification': first_notification}))
+
+asyncio.run(main())
+'''
+
+
+def bench_once() -> dict:
+    spawned = time.time()
+    result = subprocess.run([sys.executable, '-c', BENCH_CHILD], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'bench run failed')
+    run = json.loads(result.stdout.strip().splitlines()[-1])
+    return {
+        'interpreter': run['started'] - spawned,
+        'session_ready': run['session_ready'] - spawned,
+        'first_notification': run['first_notification'] - spawned
+    }
+
+
+def bench(runs: int = 5, update_baseline: bool = False) -> int:
+    results = [bench_once() for _ in range(runs)]
+    medians = {key: sorted(r[key] for r in results)[len(results) // 2] for key in results[0]}
+
+    print(f"⏱️  Time to first notification ({runs} cold starts, median):")
+    for key, seconds in medians.items():
+        print(f"   {key:20s} {seconds * 1000:8.1f} ms")
+
+    if update_baseline or not os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(medians, f, indent=2)
+        print(f"📌 Baseline written to {BASELINE_PATH}")
+        return 0
+
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    limit = baseline['first_notification'] * (1 + REGRESSION_TOLERANCE)
+    if medians['first_notification'] > limit:
+        print(f"❌ Regression: {medians['first_notification'] * 1000:.1f} ms > {limit * 1000:.1f} ms "
+              f"(baseline {baseline['first_notification'] * 1000:.1f} ms + {REGRESSION_TOLERANCE:.0%})")
+        return 1
+    print(f"✅ Within {REGRESSION_TOLERANCE:.0%} of baseline ({baseline['first_notification'] * 1000:.1f} ms)")
+    return 0
+
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == 'bench':
+        runs = int(args[args.index('--runs') + 1]) if '--runs' in args else 5
+        sys.exit(bench(runs, update_baseline='--update-baseline' in args))
+    print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Shared Supabase client
+Every pipeline in a process uses the same client, created on first use -
+the supabase package (and its HTTP stack) is only imported then.
+"""
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from startup_profile import profile
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_supabase() -> 'Client':
+    """Process-wide Supabase client from SUPABASE_URL / SUPABASE_SERVICE_KEY"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                supabase_url = os.getenv("SUPABASE_URL")
+                supabase_key = os.getenv("SUPABASE_SERVICE_KEY")  # Use service key for backend operations
+
+                if not supabase_url or not supabase_key:
+                    raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_KEY in .env file")
+
+                with profile.phase('supabase client'):
+                    from supabase import create_client
+                    _client = create_client(supabase_url, supabase_key)
+                print(f"✅ Connected to Supabase")
+    return _client
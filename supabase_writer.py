@@ -0,0 +1,126 @@
+"""
+Shared Supabase writer
+Queues writes from many monitors in the durable outbox and drains them
+onto a single Supabase client in batches.
+"""
+import asyncio
+import os
+import time
+
+from outbox import Outbox
+
+BATCH_SIZE = int(os.getenv('SUPABASE_BATCH_SIZE', 50))
+FLUSH_INTERVAL = float(os.getenv('SUPABASE_FLUSH_INTERVAL', 1.0))
+# How long shutdown waits for the outbox to drain; anything left is sent on next start
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SUPABASE_SHUTDOWN_DRAIN_SECONDS', 5.0))
+
+
+class BatchedWriter:
+    """Async sender in front of the outbox.
+
+    insert()/update() only commit to local SQLite, so ingest never waits
+    on the network. The outbox is drained when BATCH_SIZE writes are
+    queued or every FLUSH_INTERVAL seconds; the blocking Supabase call
+    runs in a worker thread so the BLE event loop is never stalled.
+    """
+
+    def __init__(self, supabase, outbox: Outbox = None, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.supabase = supabase
+        self.outbox = outbox or Outbox()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_task = None
+        self._unflushed = 0
+        self._lock = asyncio.Lock()
+
+        # Stats
+        self.rows_written = 0
+        self.batches_written = 0
+        self.failed_batches = 0
+        self.last_flush_duration = 0.0
+
+    def start(self):
+        """Start the periodic flush task (must be called inside the event loop)"""
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and try to drain what is still queued"""
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+
+        deadline = time.time() + SHUTDOWN_DRAIN_SECONDS
+        while self.outbox.pending_count() and time.time() < deadline:
+            if not await self.flush():
+                await asyncio.sleep(0.5)
+
+        remaining = self.outbox.pending_count()
+        if remaining:
+            print(f"📦 {remaining} write(s) left in outbox - they'll be sent on next start")
+
+    def insert(self, table: str, row: dict, session_id: str = None) -> str:
+        """Queue a row for insertion; returns its idempotency key"""
+        key = self.outbox.enqueue(table, row, session_id=session_id)
+        self._queued()
+        return key
+
+    async def insert_now(self, table: str, row: dict, session_id: str = None, idempotency_key: str = None) -> str:
+        """Queue a row and send it right away instead of with the next batch.
+
+        The row is committed to the outbox first, so if the immediate send
+        fails it still goes out with the normal drain.
+        """
+        key = self.outbox.enqueue(table, row, session_id=session_id, idempotency_key=idempotency_key)
+        if await asyncio.to_thread(self.outbox.send_now, self.supabase, [key]):
+            self.rows_written += 1
+        else:
+            print(f"⚠️  Immediate {table} write failed, left in outbox: {self.outbox.last_error}")
+            self._queued()
+        return key
+
+    def update(self, table: str, fields: dict, match: dict, session_id: str = None) -> str:
+        """Queue an UPDATE of `fields` on rows matching column == value for each item of `match`"""
+        key = self.outbox.enqueue(table, fields, op='update', match=match, session_id=session_id)
+        self._queued()
+        return key
+
+    def _queued(self):
+        self._unflushed += 1
+        if self._unflushed >= self.batch_size:
+            self._unflushed = 0
+            asyncio.create_task(self.flush())
+
+    def pending_count(self) -> int:
+        return self.outbox.pending_count()
+
+    async def flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                # Keep draining while full batches are ready
+                while await self.flush() >= self.batch_size:
+                    pass
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self) -> int:
+        """Send one batch from the outbox; returns the number of rows sent"""
+        async with self._lock:
+            failures_before = self.outbox.failures
+            started = time.perf_counter()
+            sent = await asyncio.to_thread(self.outbox.drain, self.supabase, self.batch_size)
+            self.last_flush_duration = time.perf_counter() - started
+
+            if sent:
+                self.rows_written += sent
+                self.batches_written += 1
+            if self.outbox.failures > failures_before:
+                self.failed_batches += self.outbox.failures - failures_before
+                print(f"⚠️  Outbox write failed, will retry ({self.outbox.pending_count()} queued): {self.outbox.last_error}")
+            return sent
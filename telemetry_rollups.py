@@ -0,0 +1,149 @@
+"""
+Windowed telemetry aggregates computed at the edge
+Folds the raw accelerometer stream into per-window rollup rows (per second
+and per minute by default) so dashboards get a continuous signal at about
+1/50th of the raw sample volume.
+
+Statistics are updated incrementally (Welford) one sample at a time, so a
+window costs a few floats no matter how many samples it sees.
+"""
+import math
+import os
+from datetime import datetime, timezone
+
+# Window lengths in seconds; an empty value disables rollups
+ROLLUP_WINDOWS = [float(w) for w in os.getenv('TELEMETRY_ROLLUP_WINDOWS', '1,60').split(',') if w.strip()]
+
+EVENT_TYPES = ('SWERVING', 'HARSH_BRAKE', 'AGGRESSIVE')
+
+# Samples further apart than this don't produce a jerk value (link gap, reboot)
+MAX_JERK_GAP_SECONDS = 1.0
+
+
+class RunningStats:
+    """Incremental min/max/mean/RMS of one signal"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sum_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sum_squares += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def rms(self) -> float:
+        return math.sqrt(self.sum_squares / self.count) if self.count else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class Window:
+    """Aggregates for one window of one length"""
+
+    def __init__(self, start: float, seconds: float):
+        self.start = start
+        self.seconds = seconds
+        self.axes = {'x': RunningStats(), 'y': RunningStats(), 'z': RunningStats()}
+        self.magnitude = RunningStats()
+        self.jerk = RunningStats()
+        self.events = dict.fromkeys(EVENT_TYPES, 0)
+
+    def to_row(self) -> dict:
+        row = {
+            'window_seconds': self.seconds,
+            'window_start': datetime.fromtimestamp(self.start, timezone.utc).isoformat(),
+            'sample_count': self.magnitude.count,
+        }
+        for axis, stats in self.axes.items():
+            row[f'{axis}_min'] = round(stats.min, 4)
+            row[f'{axis}_max'] = round(stats.max, 4)
+            row[f'{axis}_mean'] = round(stats.mean, 4)
+            row[f'{axis}_rms'] = round(stats.rms, 4)
+        row['magnitude_max'] = round(self.magnitude.max, 4)
+        row['magnitude_rms'] = round(self.magnitude.rms, 4)
+        row['magnitude_stddev'] = round(self.magnitude.stddev, 4)
+        row['jerk_max'] = round(self.jerk.max, 4) if self.jerk.count else None
+        row['jerk_mean'] = round(self.jerk.mean, 4) if self.jerk.count else None
+        for event_type, count in self.events.items():
+            row[f'{event_type.lower()}_count'] = count
+        return row
+
+
+class TelemetryRollups:
+    """Rolls one device's samples into closed-window rows.
+
+    Samples are expected in (roughly) time order. A sample that belongs to
+    an already-closed window is dropped and counted in `late_samples`.
+    """
+
+    def __init__(self, windows: list = None):
+        self.window_lengths = ROLLUP_WINDOWS if windows is None else windows
+        self.current = {}
+        self.previous_sample = None
+        self.late_samples = 0
+        self.rows_emitted = 0
+
+    def _window_start(self, sample_time: float, seconds: float) -> float:
+        return math.floor(sample_time / seconds) * seconds
+
+    def add(self, sample_time: float, x: float, y: float, z: float) -> list:
+        """Fold in one sample; returns rows for any windows it closed"""
+        closed = []
+
+        # Jerk: rate of change of the acceleration vector (g/s)
+        jerk = None
+        if self.previous_sample is not None:
+            previous_time, px, py, pz = self.previous_sample
+            dt = sample_time - previous_time
+            if 0 < dt <= MAX_JERK_GAP_SECONDS:
+                jerk = math.sqrt((x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2) / dt
+        if self.previous_sample is None or sample_time >= self.previous_sample[0]:
+            self.previous_sample = (sample_time, x, y, z)
+
+        magnitude = math.sqrt(x * x + y * y + z * z)
+        for seconds in self.window_lengths:
+            start = self._window_start(sample_time, seconds)
+            window = self.current.get(seconds)
+            if window is not None and start < window.start:
+                self.late_samples += 1
+                continue
+            if window is None or start > window.start:
+                if window is not None:
+                    closed.append(window.to_row())
+                window = self.current[seconds] = Window(start, seconds)
+
+            window.axes['x'].add(x)
+            window.axes['y'].add(y)
+            window.axes['z'].add(z)
+            window.magnitude.add(magnitude)
+            if jerk is not None:
+                window.jerk.add(jerk)
+
+        self.rows_emitted += len(closed)
+        return closed
+
+    def count_event(self, sample_time: float, event_type: str):
+        """Count a saved driving event in every open window covering its time"""
+        for window in self.current.values():
+            if event_type in window.events and window.start <= sample_time < window.start + window.seconds:
+                window.events[event_type] += 1
+
+    def flush(self) -> list:
+        """Close every open window (end of session)"""
+        closed = [window.to_row() for window in self.current.values() if window.magnitude.count]
+        self.current = {}
+        self.previous_sample = None
+        self.rows_emitted += len(closed)
+        return closed